@@ -0,0 +1,22 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import contextlib
+import sys
+
+# nsl.stac prints the service it connects to when it's imported. the benchmarks keep stdout for result documents
+with contextlib.redirect_stdout(sys.stderr):
+    import nsl.stac  # noqa: F401
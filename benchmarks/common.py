@@ -0,0 +1,105 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+
+def package_version() -> str:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version('nsl.stac')
+        except PackageNotFoundError:
+            pass
+    except ImportError:
+        pass
+    return 'unknown'
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def environment() -> Dict:
+    """details of the machine and code under test, stored with every result file"""
+    return {
+        'created': datetime.now(tz=timezone.utc).isoformat(),
+        'nsl_stac_version': package_version(),
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """nearest-rank percentile of values (pct in 0-100)"""
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def time_repeats(func: Callable[[], int], repeat: int = 5, warmup: int = 1) -> Dict:
+    """
+    run func `warmup + repeat` times. func returns the number of operations it performed
+    :return: dict of ops and per-op timings (in microseconds) across the repeats
+    """
+    for _ in range(warmup):
+        func()
+
+    ops = 0
+    per_op_us = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = func()
+        elapsed = time.perf_counter() - start
+        per_op_us.append(elapsed * 1e6 / max(ops, 1))
+
+    return {
+        'ops': ops,
+        'repeat': repeat,
+        'per_op_us_min': min(per_op_us),
+        'per_op_us_median': statistics.median(per_op_us),
+        'per_op_us_mean': statistics.mean(per_op_us),
+        'ops_per_sec': 1e6 / statistics.median(per_op_us) if statistics.median(per_op_us) > 0 else 0.0,
+    }
+
+
+def write_results(path: str, suite: str, params: Dict, results: List[Dict]):
+    """write the result document to path, or to stdout if path is '-'. the benchmarks print everything else to stderr"""
+    document = {'suite': suite, 'environment': environment(), 'params': params, 'results': results}
+    if path == '-':
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    with open(path, 'w') as file_obj:
+        json.dump(document, file_obj, indent=2)
+    print("wrote {0} results to {1}".format(len(results), path), file=sys.stderr)
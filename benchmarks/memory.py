@@ -0,0 +1,185 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+"""
+Memory footprint of long auto-paginated searches against a local fake STAC service and asset server.
+
+For each path (search, wrap, feature, download) the same search is run twice: once sampling process RSS, and once
+under tracemalloc. Results are reported per 10k items: peak RSS growth, peak traced allocations, and traced
+allocations still held when the path finishes (e.g. the features of a feature collection).
+
+    python -m benchmarks.memory --items 20000 --output memory.json
+"""
+
+import argparse
+import gc
+import io
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from typing import Callable, Dict, List
+
+from benchmarks.common import write_results
+from nsl.stac import StacRequest, utils
+from nsl.stac.enum import AssetType
+from nsl.stac.experimental import NSLClientEx, StacRequestWrap
+from nsl.stac.fake import FakeAssetServer, FakeStacServer, FakeStacService, SyntheticCorpus
+
+PATHS = ('search', 'wrap', 'feature', 'download')
+PER_ITEMS = 10000
+
+
+def current_rss() -> int:
+    """resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as file_obj:
+            return int(file_obj.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # no procfs (e.g. macOS). fall back to the high water mark, reported in bytes on macOS and KiB elsewhere
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+
+class _RSSSampler(threading.Thread):
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+def workloads(client_ex: NSLClientEx, item_count: int, page_size: int) -> Dict[str, Callable[[], object]]:
+    """the paths under test. each returns whatever the caller would keep hold of"""
+    def search():
+        count = 0
+        for _ in client_ex.search(StacRequest(limit=item_count), auto_paginate=True, page_size=page_size):
+            count += 1
+        return count
+
+    def wrap():
+        request_wrapped = StacRequestWrap()
+        request_wrapped.limit = item_count
+        count = 0
+        for _ in client_ex.search_ex(request_wrapped, auto_paginate=True, page_size=page_size):
+            count += 1
+        return count
+
+    def feature():
+        request_wrapped = StacRequestWrap()
+        request_wrapped.limit = item_count
+        return client_ex.feature_collection_ex(request_wrapped, auto_paginate=True)
+
+    def download():
+        count = 0
+        for stac_item in client_ex.search(StacRequest(limit=item_count), auto_paginate=True, page_size=page_size):
+            buffer = io.BytesIO()
+            utils.download_asset(asset=utils.get_asset(stac_item, asset_type=AssetType.THUMBNAIL), file_obj=buffer)
+            count += 1
+        return count
+
+    return {'search': search, 'wrap': wrap, 'feature': feature, 'download': download}
+
+
+def traced(func: Callable[[], object]) -> Dict:
+    """run func under tracemalloc. returns the peak and retained traced bytes, in excess of those before the call"""
+    gc.collect()
+    tracemalloc.start()
+    traced_before, _ = tracemalloc.get_traced_memory()
+    result = func()
+    gc.collect()
+    traced_retained, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {'traced_peak_bytes': traced_peak - traced_before, 'traced_retained_bytes': traced_retained - traced_before}
+
+
+def measure(func: Callable[[], object], item_count: int) -> Dict:
+    scale = PER_ITEMS / max(item_count, 1)
+
+    gc.collect()
+    sampler = _RSSSampler()
+    rss_before = current_rss()
+    sampler.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    rss_peak = sampler.stop()
+    del result
+
+    traced_result = traced(func)
+
+    return {
+        'items': item_count,
+        'seconds': elapsed,
+        'rss_before_bytes': rss_before,
+        'rss_peak_growth_bytes': rss_peak - rss_before,
+        'rss_peak_growth_per_10k_items': (rss_peak - rss_before) * scale,
+        'traced_peak_bytes': traced_result['traced_peak_bytes'],
+        'traced_peak_per_10k_items': traced_result['traced_peak_bytes'] * scale,
+        'traced_retained_per_10k_items': traced_result['traced_retained_bytes'] * scale,
+    }
+
+
+def run(item_count: int = 10000, page_size: int = 50, paths: List[str] = PATHS, thumbnail_size: int = 16 * 1024) \
+        -> List[Dict]:
+    results = []
+    with FakeAssetServer(sizes={'.png': thumbnail_size}) as asset_server, \
+            FakeStacServer(FakeStacService(SyntheticCorpus(size=item_count, asset_host=asset_server.url))) as server:
+        client_ex = server.client(NSLClientEx)
+        funcs = workloads(client_ex, item_count, page_size)
+        print("{0:<10} {1:>8} {2:>16} {3:>16} {4:>16}".format(
+            'path', 'items', 'rss peak/10k MB', 'traced peak/10k', 'retained/10k'), file=sys.stderr)
+        for path in paths:
+            result = dict(path=path, page_size=page_size, **measure(funcs[path], item_count))
+            print("{0:<10} {1:>8} {2:>16.2f} {3:>16.0f} {4:>16.0f}".format(
+                path, item_count, result['rss_peak_growth_per_10k_items'] / (1024 * 1024),
+                result['traced_peak_per_10k_items'], result['traced_retained_per_10k_items']), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000, help='items searched per path')
+    parser.add_argument('--page-size', type=int, default=50, help='search page size')
+    parser.add_argument('--paths', default=','.join(PATHS), help='comma separated paths to measure')
+    parser.add_argument('--thumbnail-size', type=int, default=16 * 1024, help='bytes per downloaded thumbnail')
+    parser.add_argument('--output', default='memory_benchmarks.json', help="result file, or '-' for stdout")
+    args = parser.parse_args()
+
+    results = run(item_count=args.items,
+                  page_size=args.page_size,
+                  paths=[path for path in args.paths.split(',') if path],
+                  thumbnail_size=args.thumbnail_size)
+    write_results(args.output, 'memory', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+"""
+Micro-benchmarks for the CPU-bound wrapper and utility hot paths, run on synthetic items.
+
+    python -m benchmarks.micro --items 2000 --repeat 5 --output micro.json
+    python -m benchmarks.micro --compare micro.json
+
+Results are written as JSON (per-op timings in microseconds). `--compare` prints the ratio of each benchmark's
+median against a previous result file. Progress and the comparison are printed to stderr, so `--output -` writes
+only the JSON document to stdout.
+"""
+
+import argparse
+import json
+import sys
+
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.common import time_repeats, write_results
+from nsl.stac import FloatFilter, utils
+from nsl.stac.enum import AssetType, CloudPlatform, FilterRelationship
+from nsl.stac.experimental import StacItemWrap
+from nsl.stac.fake import SyntheticCorpus
+
+FLOAT_RELATIONSHIPS = [FilterRelationship.EQ, FilterRelationship.NEQ, FilterRelationship.BETWEEN,
+                       FilterRelationship.NOT_BETWEEN, FilterRelationship.GTE, FilterRelationship.GT,
+                       FilterRelationship.LTE, FilterRelationship.LT]
+# EQ and NEQ expand a date into the range of that day, so they're only exercised with dates
+DATE_RELATIONSHIPS = [FilterRelationship.EQ, FilterRelationship.LTE, FilterRelationship.GTE,
+                      FilterRelationship.LT, FilterRelationship.GT, FilterRelationship.NEQ]
+DATETIME_RELATIONSHIPS = [FilterRelationship.LTE, FilterRelationship.GTE, FilterRelationship.LT, FilterRelationship.GT]
+
+
+def benchmarks(item_count: int, seed: int = 0) -> List[Tuple[str, Callable[[], int]]]:
+    """
+    build the named benchmark functions. each function returns the number of operations it ran
+    :param item_count: number of synthetic items each benchmark iterates over
+    :param seed: corpus seed
+    """
+    corpus = SyntheticCorpus(size=item_count, seed=seed)
+    stac_items = list(corpus)
+    wrapped = [StacItemWrap(stac_item) for stac_item in stac_items]
+    asset_wraps = [asset_wrap for item_wrap in wrapped for asset_wrap in item_wrap.get_assets()]
+    encoded = [utils.stac_item_to_b64(stac_item) for stac_item in stac_items]
+
+    float_filters = []
+    for rel_type in FLOAT_RELATIONSHIPS:
+        if rel_type in (FilterRelationship.BETWEEN, FilterRelationship.NOT_BETWEEN):
+            float_filters.append(FloatFilter(rel_type=rel_type, start=0.05, end=0.15))
+        else:
+            float_filters.append(FloatFilter(rel_type=rel_type, value=0.1))
+    cloud_covers = [stac_item.eo.cloud_cover.value for stac_item in stac_items]
+
+    timestamp_args = []
+    for i in range(item_count):
+        if i % 3 == 0:
+            timestamp_args.append(dict(rel_type=FilterRelationship.BETWEEN,
+                                       start=datetime(2019, 1, 1, tzinfo=timezone.utc),
+                                       end=datetime(2020, 1, 1 + i % 28)))
+        elif i % 3 == 1:
+            timestamp_args.append(dict(rel_type=DATE_RELATIONSHIPS[i % len(DATE_RELATIONSHIPS)],
+                                       value=date(2019, 1 + i % 12, 1 + i % 28)))
+        else:
+            timestamp_args.append(dict(rel_type=DATETIME_RELATIONSHIPS[i % len(DATETIME_RELATIONSHIPS)],
+                                       value=datetime(2019, 1 + i % 12, 1 + i % 28, 12)))
+
+    def stac_item_wrap():
+        for stac_item in stac_items:
+            StacItemWrap(stac_item)
+        return len(stac_items)
+
+    def stac_item_wrap_feature():
+        for item_wrap in wrapped:
+            item_wrap.feature
+        return len(wrapped)
+
+    def stac_item_wrap_get_assets():
+        for item_wrap in wrapped:
+            item_wrap.get_assets(asset_type=AssetType.GEOTIFF, cloud_platform=CloudPlatform.GCP)
+        return len(wrapped)
+
+    def asset_wrap_matches_details():
+        for asset_wrap in asset_wraps:
+            asset_wrap.matches_details(asset_type=AssetType.TIFF,
+                                       cloud_platform=CloudPlatform.GCP,
+                                       asset_regex={'asset_key': r'.*_RGB$'},
+                                       b_relaxed_types=True)
+        return len(asset_wraps)
+
+    def utils_get_assets():
+        for stac_item in stac_items:
+            utils.get_assets(stac_item, asset_type=AssetType.GEOTIFF, cloud_platform=CloudPlatform.GCP)
+        return len(stac_items)
+
+    def pb_timestampfield():
+        for kwargs in timestamp_args:
+            utils.pb_timestampfield(**kwargs)
+        return len(timestamp_args)
+
+    def stac_item_to_b64():
+        for stac_item in stac_items:
+            utils.stac_item_to_b64(stac_item)
+        return len(stac_items)
+
+    def stac_item_from_b64():
+        for value in encoded:
+            utils.stac_item_from_b64(value)
+        return len(encoded)
+
+    def eval_float_filter():
+        for float_filter in float_filters:
+            for cloud_cover in cloud_covers:
+                utils.eval_float_filter(float_filter, cloud_cover)
+        return len(float_filters) * len(cloud_covers)
+
+    return [('StacItemWrap', stac_item_wrap),
+            ('StacItemWrap.feature', stac_item_wrap_feature),
+            ('StacItemWrap.get_assets', stac_item_wrap_get_assets),
+            ('AssetWrap.matches_details', asset_wrap_matches_details),
+            ('utils.get_assets', utils_get_assets),
+            ('utils.pb_timestampfield', pb_timestampfield),
+            ('utils.stac_item_to_b64', stac_item_to_b64),
+            ('utils.stac_item_from_b64', stac_item_from_b64),
+            ('utils.eval_float_filter', eval_float_filter)]
+
+
+def run(item_count: int = 1000, repeat: int = 5, warmup: int = 1, seed: int = 0, only: List[str] = None) -> List[Dict]:
+    results = []
+    for name, func in benchmarks(item_count, seed=seed):
+        if only and not any(selected in name for selected in only):
+            continue
+        result = dict(name=name, **time_repeats(func, repeat=repeat, warmup=warmup))
+        print("{0:<28} {1:>10.2f} us/op {2:>12.0f} ops/s".format(
+            name, result['per_op_us_median'], result['ops_per_sec']), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def compare(results: List[Dict], baseline_path: str):
+    with open(baseline_path) as file_obj:
+        baseline = {result['name']: result for result in json.load(file_obj)['results']}
+
+    print("\n{0:<28} {1:>12} {2:>12} {3:>8}".format('benchmark', 'baseline us', 'current us', 'ratio'),
+          file=sys.stderr)
+    for result in results:
+        if result['name'] not in baseline:
+            continue
+        before = baseline[result['name']]['per_op_us_median']
+        after = result['per_op_us_median']
+        ratio = after / before if before > 0 else float('nan')
+        print("{0:<28} {1:>12.2f} {2:>12.2f} {3:>8.2f}".format(result['name'], before, after, ratio), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help='synthetic items per benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='timed repeats per benchmark')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed repeats per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='synthetic corpus seed')
+    parser.add_argument('--only', action='append', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--output', default='micro_benchmarks.json', help="result file, or '-' for stdout")
+    parser.add_argument('--compare', help='previous result file to compare against')
+    args = parser.parse_args()
+
+    results = run(item_count=args.items, repeat=args.repeat, warmup=args.warmup, seed=args.seed, only=args.only)
+    write_results(args.output, 'micro', vars(args), results)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
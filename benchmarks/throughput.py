@@ -0,0 +1,227 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+"""
+End-to-end search-and-download throughput against a local fake STAC service and a local HTTP asset server.
+
+Each run searches the fake service with `auto_paginate` and downloads one asset per item as items arrive, using one of
+the concurrency models (serial, threads, processes, asyncio). The asyncio model downloads with nsl.stac.aio's
+AsyncDownloader on one event loop, while the search runs in a thread. Every combination of model, page size and worker
+count is run and reported as items/s, MB/s and p50/p99 per-download latency.
+
+    python -m benchmarks.throughput --items 2000 --workers 1,4,16 --page-sizes 50,200 --output throughput.json
+"""
+
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.common import percentile, write_results
+from nsl.stac import Asset, StacRequest, utils
+from nsl.stac.aio import AsyncConnectionPool, AsyncDownloader
+from nsl.stac.enum import AssetType
+from nsl.stac.fake import FakeAssetServer, FakeStacServer, FakeStacService, SyntheticCorpus, use_fake_credentials
+
+MODELS = ('serial', 'threads', 'processes', 'asyncio')
+
+
+def _download(serialized_asset: bytes, save_directory: Optional[str]) -> Tuple[int, float]:
+    """download one asset. returns (bytes downloaded, seconds). module level so process pools can pickle it"""
+    asset = Asset.FromString(serialized_asset)
+    start = time.perf_counter()
+    if save_directory:
+        filename = utils.download_asset(asset=asset, save_directory=save_directory)
+        size = os.path.getsize(filename)
+        os.remove(filename)
+    else:
+        buffer = io.BytesIO()
+        utils.download_asset(asset=asset, file_obj=buffer)
+        size = len(buffer.getbuffer())
+    return size, time.perf_counter() - start
+
+
+def _assets(client, item_count: int, page_size: int, asset_type: AssetType):
+    for stac_item in client.search(StacRequest(limit=item_count), auto_paginate=True, page_size=page_size):
+        yield utils.get_asset(stac_item, asset_type=asset_type).SerializeToString()
+
+
+async def _download_async(assets, workers: int, save_directory: Optional[str]) -> List[Tuple[int, float]]:
+    """
+    download with an AsyncDownloader, starting each download as soon as the search yields its asset. the search is a
+    blocking generator, so it's consumed in a thread that hands the assets to the loop
+    """
+    loop = asyncio.get_running_loop()
+    arrived = asyncio.Queue()
+    pool = AsyncConnectionPool()
+    downloader = AsyncDownloader(max_concurrency=workers, max_per_host=workers, pool=pool)
+
+    def search():
+        try:
+            for asset in assets:
+                loop.call_soon_threadsafe(arrived.put_nowait, asset)
+        finally:
+            loop.call_soon_threadsafe(arrived.put_nowait, None)
+
+    async def download(serialized_asset: bytes) -> Tuple[int, float]:
+        asset = Asset.FromString(serialized_asset)
+        if save_directory:
+            result = await downloader.download(asset, save_directory=save_directory)
+            if not result.ok:
+                raise result.error
+            size = os.path.getsize(result.save_filename)
+            os.remove(result.save_filename)
+        else:
+            buffer = io.BytesIO()
+            result = await downloader.download(asset, file_obj=buffer)
+            if not result.ok:
+                raise result.error
+            size = len(buffer.getbuffer())
+        return size, result.seconds
+
+    searching = loop.run_in_executor(None, search)
+    tasks = []
+    try:
+        while True:
+            asset = await arrived.get()
+            if asset is None:
+                break
+            tasks.append(asyncio.ensure_future(download(asset)))
+        await searching
+        return list(await asyncio.gather(*tasks))
+    finally:
+        pool.close()
+
+
+def run_once(client,
+             model: str,
+             workers: int,
+             page_size: int,
+             item_count: int,
+             asset_type: AssetType,
+             save_directory: Optional[str]) -> Dict:
+    start = time.perf_counter()
+    assets = _assets(client, item_count, page_size, asset_type)
+
+    if model == 'serial':
+        results = [_download(asset, save_directory) for asset in assets]
+    elif model in ('threads', 'processes'):
+        if model == 'threads':
+            executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            # gRPC doesn't survive fork() while its threads are running, so worker processes are spawned
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=use_fake_credentials)
+        with executor:
+            pending = [executor.submit(_download, asset, save_directory) for asset in assets]
+            results = [future.result() for future in pending]
+    elif model == 'asyncio':
+        results = asyncio.run(_download_async(assets, workers, save_directory))
+    else:
+        raise ValueError("unknown concurrency model {}".format(model))
+
+    elapsed = time.perf_counter() - start
+    latencies = [seconds for _, seconds in results]
+    total_bytes = sum(size for size, _ in results)
+    return {
+        'model': model,
+        'workers': workers,
+        'page_size': page_size,
+        'items': len(results),
+        'bytes': total_bytes,
+        'seconds': elapsed,
+        'items_per_sec': len(results) / elapsed if elapsed > 0 else 0.0,
+        'mb_per_sec': total_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': percentile(latencies, 50) * 1000,
+        'latency_p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def run(item_count: int = 1000,
+        models: List[str] = MODELS,
+        workers: List[int] = (1, 4, 16),
+        page_sizes: List[int] = (50, 200),
+        asset_type: AssetType = AssetType.THUMBNAIL,
+        asset_size: int = None,
+        service_latency: float = 0.0,
+        asset_latency: float = 0.0,
+        to_disk: bool = False) -> List[Dict]:
+    sizes = None
+    if asset_size is not None:
+        sizes = {ext: asset_size for ext in ('.tif', '.tiff', '.png', '.jpg')}
+
+    results = []
+    with FakeAssetServer(sizes=sizes, latency=asset_latency) as asset_server, \
+            FakeStacServer(FakeStacService(SyntheticCorpus(size=item_count, asset_host=asset_server.url),
+                                           latency=service_latency)) as stac_server, \
+            tempfile.TemporaryDirectory() as save_directory:
+        client = stac_server.client()
+        print("{0:<10} {1:>7} {2:>9} {3:>7} {4:>10} {5:>9} {6:>9} {7:>9}".format(
+            'model', 'workers', 'page_size', 'items', 'items/s', 'MB/s', 'p50 ms', 'p99 ms'), file=sys.stderr)
+        for model in models:
+            for page_size in page_sizes:
+                # serial ignores the worker count
+                for worker_count in ([1] if model == 'serial' else workers):
+                    result = run_once(client, model, worker_count, page_size, item_count, asset_type,
+                                      save_directory if to_disk else None)
+                    print("{model:<10} {workers:>7} {page_size:>9} {items:>7} {items_per_sec:>10.1f} "
+                          "{mb_per_sec:>9.2f} {latency_p50_ms:>9.2f} {latency_p99_ms:>9.2f}".format(**result),
+                          file=sys.stderr)
+                    results.append(result)
+    return results
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help='items searched and downloaded per run')
+    parser.add_argument('--models', default=','.join(MODELS), help='comma separated concurrency models')
+    parser.add_argument('--workers', type=_int_list, default=[1, 4, 16], help='comma separated worker counts')
+    parser.add_argument('--page-sizes', type=_int_list, default=[50, 200], help='comma separated search page sizes')
+    parser.add_argument('--asset-type', default='THUMBNAIL', choices=[t.name for t in AssetType],
+                        help='asset downloaded from every item')
+    parser.add_argument('--asset-size', type=int, help='override the size, in bytes, of every served asset')
+    parser.add_argument('--service-latency', type=float, default=0.0, help='seconds added to every rpc')
+    parser.add_argument('--asset-latency', type=float, default=0.0, help='seconds added to every asset request')
+    parser.add_argument('--to-disk', action='store_true', help='download to files instead of memory buffers')
+    parser.add_argument('--output', default='throughput_benchmarks.json', help="result file, or '-' for stdout")
+    args = parser.parse_args()
+
+    results = run(item_count=args.items,
+                  models=[model for model in args.models.split(',') if model],
+                  workers=args.workers,
+                  page_sizes=args.page_sizes,
+                  asset_type=AssetType[args.asset_type],
+                  asset_size=args.asset_size,
+                  service_latency=args.service_latency,
+                  asset_latency=args.asset_latency,
+                  to_disk=args.to_disk)
+    write_results(args.output, 'throughput', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import asyncio
+import functools
+import http.client
+import os
+import ssl
+import time
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, IO, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from nsl.stac import Asset, gcs_storage_client, utils
+from nsl.stac.connections import MAX_IDLE_PER_HOST
+from nsl.stac.enum import CloudPlatform
+from nsl.stac.s3 import s3_transfer_engine
+from nsl.stac.transfer import DEFAULT_MAX_PER_HOST, DownloadResult
+
+__all__ = ['AsyncConnectionPool', 'AsyncDownloader', 'async_connection_pool', 'download_asset', 'stream_asset']
+
+# concurrent downloads of an AsyncDownloader. they're coroutines, not threads, so this can be far higher than
+# transfer.DEFAULT_MAX_WORKERS
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('NSL_ASYNC_MAX_CONCURRENCY', 64))
+# bucket downloads are made by the blocking GCS and S3 clients on the loop's default executor, a range request of
+# this many bytes at a time, so a cancelled download stops within one range
+BUCKET_RANGE_SIZE = 8 * 1024 * 1024
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AsyncResponse:
+    def __init__(self, reader: asyncio.StreamReader, status: int, headers: Dict[str, str], method: str):
+        """the status, headers and body stream of a response on an AsyncConnectionPool connection"""
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        self._chunk_left = 0
+        content_length = headers.get('content-length')
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self.length = 0
+        elif self._chunked:
+            self.length = None
+        else:
+            self.length = int(content_length) if content_length is not None else None
+        # body bytes left, None until the end of the body (chunked or until close)
+        self._left = self.length
+        self.will_close = headers.get('connection', '').lower() == 'close' or \
+            (not self._chunked and self.length is None)
+        self.complete = self.length == 0
+
+    def getheader(self, name: str, default: str = None) -> Optional[str]:
+        return self.headers.get(name.lower(), default)
+
+    async def read_chunk(self, size: int = utils.DOWNLOAD_CHUNK_SIZE) -> bytes:
+        """up to size bytes of the body, as soon as any arrive. b'' at the end of the body"""
+        if self.complete:
+            return b''
+        if self._chunked:
+            return await self._read_chunked(size)
+        if self._left is None:
+            data = await self._reader.read(size)
+            self.complete = not data
+            return data
+
+        data = await self._reader.read(min(size, self._left))
+        if not data:
+            raise http.client.IncompleteRead(b'', self._left)
+        self._left -= len(data)
+        self.complete = self._left == 0
+        return data
+
+    async def read(self) -> bytes:
+        """the rest of the body"""
+        chunks = []
+        while True:
+            chunk = await self.read_chunk()
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    async def _read_chunked(self, size: int) -> bytes:
+        if self._chunk_left == 0:
+            line = await self._reader.readline()
+            if not line:
+                raise http.client.IncompleteRead(b'')
+            self._chunk_left = int(line.split(b';', 1)[0].strip(), 16)
+            if self._chunk_left == 0:
+                # trailers, then the blank line that ends the body
+                while (await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.complete = True
+                return b''
+        data = await self._reader.read(min(size, self._chunk_left))
+        if not data:
+            raise http.client.IncompleteRead(b'', self._chunk_left)
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            # the CRLF after the chunk
+            await self._reader.readline()
+        return data
+
+
+class AsyncConnectionPool:
+    def __init__(self, max_idle_per_host: int = MAX_IDLE_PER_HOST, timeout: float = None):
+        """
+        Pool of keep-alive HTTP/1.1 and HTTPS connections made with asyncio streams, per scheme and host. The asyncio
+        counterpart of connections.ConnectionPool: a connection is checked out for one request at a time and only
+        returned to the pool once its response has been read to the end.
+        :param max_idle_per_host: idle connections kept per host. connections returned beyond this are closed
+        :param timeout: seconds to wait for a connection, and for the status and headers of a response
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle: Dict[Tuple[str, str], Deque[_Connection]] = {}
+        # the event loop of the idle connections
+        self._loop = None
+        self._ssl_context = None
+
+    @asynccontextmanager
+    async def request(self,
+                      method: str,
+                      scheme: str,
+                      netloc: str,
+                      url: str,
+                      headers: Dict[str, str] = None) -> AsyncIterator[AsyncResponse]:
+        """
+        send a request on a pooled connection
+        :param method: GET, HEAD, etc
+        :param scheme: 'https' for HTTPS, anything else is plain HTTP
+        :param netloc: host and optional port
+        :param url: path and query of the request
+        :param headers:
+        :return: async context manager of the response. read the response within the context; if it's read to the end
+        the connection is reused, otherwise (including when the task is cancelled) it's closed
+        """
+        key = ('https' if scheme == 'https' else 'http', netloc)
+        conn, reused = self._checkout(key)
+        try:
+            try:
+                if conn is None:
+                    conn = await self._connect(key)
+                res = await self._send(conn, method, netloc, url, headers or {})
+            except (ConnectionError, http.client.RemoteDisconnected):
+                if not reused:
+                    raise
+                # the server closed the idle connection, retry once on a new one
+                conn[1].close()
+                conn = await self._connect(key)
+                res = await self._send(conn, method, netloc, url, headers or {})
+            yield res
+        except BaseException:
+            if conn is not None:
+                conn[1].close()
+            raise
+
+        if res.complete and not res.will_close:
+            self._checkin(key, conn)
+        else:
+            conn[1].close()
+
+    def close(self):
+        """close every idle connection"""
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+
+    def idle_count(self, scheme: str, netloc: str) -> int:
+        return len(self._idle.get(('https' if scheme == 'https' else 'http', netloc), ()))
+
+    async def _send(self, conn: _Connection, method: str, netloc: str, url: str,
+                    headers: Dict[str, str]) -> AsyncResponse:
+        reader, writer = conn
+        lines = ["{0} {1} HTTP/1.1".format(method, url), "host: {}".format(netloc)]
+        lines.extend("{0}: {1}".format(name, value) for name, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+        return await asyncio.wait_for(self._read_head(reader, method), self.timeout)
+
+    @staticmethod
+    async def _read_head(reader: asyncio.StreamReader, method: str) -> AsyncResponse:
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("remote end closed connection without response")
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise http.client.BadStatusLine(status_line.decode('latin-1'))
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        res = AsyncResponse(reader, int(parts[1]), headers, method)
+        if parts[0] == 'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive':
+            res.will_close = True
+        return res
+
+    def _checkout(self, key: Tuple[str, str]) -> Tuple[Optional[_Connection], bool]:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # the connections of another event loop can't be used, e.g. after a second asyncio.run
+            self._idle, self._loop = {}, loop
+        connections = self._idle.get(key)
+        while connections:
+            conn = connections.pop()
+            if not conn[0].at_eof():
+                return conn, True
+            conn[1].close()
+        return None, False
+
+    def _checkin(self, key: Tuple[str, str], conn: _Connection):
+        connections = self._idle.setdefault(key, deque())
+        if len(connections) < self.max_idle_per_host:
+            connections.append(conn)
+        else:
+            conn[1].close()
+
+    async def _connect(self, key: Tuple[str, str]) -> _Connection:
+        scheme, netloc = key
+        parsed = urlparse('//' + netloc)
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            connect = asyncio.open_connection(parsed.hostname, parsed.port or 443, ssl=self._ssl_context)
+        else:
+            connect = asyncio.open_connection(parsed.hostname, parsed.port or 80)
+        return await asyncio.wait_for(connect, self.timeout)
+
+
+async_connection_pool = AsyncConnectionPool()
+
+
+async def stream_asset(asset: Asset,
+                       from_bucket: bool = False,
+                       requester_pays: bool = False,
+                       nsl_id: str = None,
+                       profile_name: str = None,
+                       chunk_size: int = utils.DOWNLOAD_CHUNK_SIZE,
+                       pool: AsyncConnectionPool = None) -> AsyncIterator[bytes]:
+    """
+    stream an asset, chunk by chunk, without blocking the event loop. href downloads are made with asyncio streams,
+    with the same url and authorization as utils.download_href_object. bucket downloads are range requests of the
+    GCS or S3 client, run on the loop's default executor
+    :param asset: The asset to download
+    :param from_bucket: force the download to occur from cloud storage instead of href endpoint
+    :param requester_pays: authorize a requester pays download. see utils.download_asset
+    :param nsl_id: ADVANCED ONLY. see utils.download_asset
+    :param profile_name: ADVANCED ONLY. see utils.download_asset
+    :param chunk_size: href downloads only. the largest chunk yielded
+    :param pool: href downloads only. defaults to async_connection_pool
+    :return: async iterator of bytes chunks. closing it, or cancelling the task consuming it, stops the download
+    """
+    if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+        chunks = _stream_gcs(asset)
+    elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+        chunks = _stream_s3(asset, requester_pays)
+    else:
+        chunks = _stream_href(asset, nsl_id, profile_name, chunk_size, pool or async_connection_pool)
+    async for chunk in chunks:
+        yield chunk
+
+
+async def download_asset(asset: Asset,
+                         from_bucket: bool = False,
+                         file_obj: IO[bytes] = None,
+                         save_filename: str = "",
+                         save_directory: str = "",
+                         requester_pays: bool = False,
+                         nsl_id: str = None,
+                         profile_name: str = None,
+                         progress: Callable[[int, Optional[int]], Any] = None,
+                         checksum=None,
+                         pool: AsyncConnectionPool = None) -> str:
+    """
+    the asyncio version of utils.download_asset. save the asset to a BinaryIO file object, a filename, or a directory
+    (the filename will be chosen from the basename of the object). chunks are written to the file as they arrive; a
+    save_filename download that fails or is cancelled leaves no file behind
+    :param progress: called after every chunk with the bytes written so far, and None for the total size
+    :param checksum: a hashlib hash object updated with every chunk written
+    :param pool: see stream_asset
+    :return: the save_filename. if file_obj isn't a named file, an empty string
+    """
+    if len(save_directory) > 0 and file_obj is None and len(save_filename) == 0:
+        if os.path.exists(save_directory):
+            save_filename = os.path.join(save_directory, os.path.basename(asset.object_path))
+        else:
+            raise ValueError("directory 'save_directory' doesn't exist")
+    if len(save_filename) == 0 and file_obj is None:
+        raise ValueError("must provide filename or file_obj")
+
+    chunks = stream_asset(asset, from_bucket=from_bucket, requester_pays=requester_pays, nsl_id=nsl_id,
+                          profile_name=profile_name, pool=pool)
+    if file_obj is not None:
+        await _write_chunks(chunks, file_obj, progress, checksum)
+        save_filename = file_obj.name if "name" in file_obj.__dict__ else ""
+        file_obj.seek(0)
+        return save_filename
+
+    try:
+        with open(save_filename, 'wb') as f:
+            await _write_chunks(chunks, f, progress, checksum)
+    except BaseException:
+        if os.path.exists(save_filename):
+            os.remove(save_filename)
+        raise
+    return save_filename
+
+
+class AsyncDownloader:
+    def __init__(self,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 pool: AsyncConnectionPool = None):
+        """
+        Runs many downloads concurrently on one event loop, at most max_concurrency at once and max_per_host at once
+        from one href host. The asyncio counterpart of transfer.DownloadEngine.
+        :param max_concurrency: number of simultaneous downloads
+        :param max_per_host: number of simultaneous href downloads from one host
+        :param pool: defaults to async_connection_pool
+        """
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.pool = pool
+        # made on first use, so they belong to the loop the downloads run on
+        self._semaphore = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def download(self, asset: Asset, asset_key: str = "", stac_id: str = "", **download_kwargs) -> DownloadResult:
+        """
+        download an asset once a slot is free
+        :param download_kwargs: from_bucket, file_obj, save_filename, save_directory, requester_pays, nsl_id,
+        profile_name, progress, checksum. see download_asset
+        :return: DownloadResult, with the error if the download failed. cancellation isn't caught
+        """
+        result = DownloadResult(asset, asset_key=asset_key, stac_id=stac_id)
+        host = "" if download_kwargs.get('from_bucket') else urlparse(asset.href).netloc
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_per_host if host else self.max_concurrency)
+        async with self._host_semaphores[host], self._semaphore:
+            start = time.perf_counter()
+            try:
+                result.save_filename = await download_asset(asset, pool=self.pool, **download_kwargs)
+            except Exception as e:
+                result.error = e
+            result.seconds = time.perf_counter() - start
+        return result
+
+    async def download_many(self, assets: Iterable[Asset], save_directory: str, **download_kwargs) \
+            -> List[DownloadResult]:
+        """
+        download many assets into a directory concurrently
+        :param download_kwargs: as in `download`, without a file_obj or save_filename
+        :return: a DownloadResult per asset, in the order of assets
+        """
+        return list(await asyncio.gather(*[self.download(asset, save_directory=save_directory, **download_kwargs)
+                                           for asset in assets]))
+
+
+async def _write_chunks(chunks: AsyncIterator[bytes],
+                        file_obj: IO[bytes],
+                        progress: Callable[[int, Optional[int]], Any],
+                        checksum) -> int:
+    written = 0
+    async for chunk in chunks:
+        file_obj.write(chunk)
+        if checksum is not None:
+            checksum.update(chunk)
+        written += len(chunk)
+        if progress is not None:
+            progress(written, None)
+    return written
+
+
+async def _stream_href(asset: Asset,
+                       nsl_id: str,
+                       profile_name: str,
+                       chunk_size: int,
+                       pool: AsyncConnectionPool) -> AsyncIterator[bytes]:
+    if not asset.href:
+        raise ValueError("no href on asset")
+    host, asset_url, headers = utils._href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+    async with pool.request(method="GET", scheme=host.scheme, netloc=host.netloc, url=asset_url,
+                            headers=headers) as res:
+        utils._raise_for_href_status(res, asset.href)
+        while True:
+            chunk = await res.read_chunk(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _stream_gcs(asset: Asset) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    blob = await loop.run_in_executor(None, functools.partial(utils.get_blob_metadata, bucket=asset.bucket,
+                                                              blob_name=asset.object_path))
+    if blob is None:
+        raise ValueError("not found error for gs://{0}/{1}".format(asset.bucket, asset.object_path))
+    for start in range(0, blob.size, BUCKET_RANGE_SIZE):
+        end = min(start + BUCKET_RANGE_SIZE, blob.size) - 1
+        # the generation, so the ranges of an object that's overwritten midway fail rather than mix versions
+        yield await loop.run_in_executor(None, functools.partial(blob.download_as_bytes,
+                                                                 client=gcs_storage_client.client, start=start,
+                                                                 end=end, if_generation_match=blob.generation))
+
+
+async def _stream_s3(asset: Asset, requester_pays: bool) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    request_args = {'Bucket': asset.bucket, 'Key': asset.object_path,
+                    **s3_transfer_engine.extra_args(asset.bucket, requester_pays)}
+    head = await loop.run_in_executor(None, functools.partial(s3_transfer_engine.client.head_object, **request_args))
+    for start in range(0, head['ContentLength'], BUCKET_RANGE_SIZE):
+        end = min(start + BUCKET_RANGE_SIZE, head['ContentLength']) - 1
+        # IfMatch fails the request, rather than mixing bytes of two versions, if the object has changed
+        res = await loop.run_in_executor(None, functools.partial(s3_transfer_engine.client.get_object,
+                                                                 Range="bytes={0}-{1}".format(start, end),
+                                                                 IfMatch=head['ETag'], **request_args))
+        try:
+            yield await loop.run_in_executor(None, res['Body'].read)
+        finally:
+            res['Body'].close()
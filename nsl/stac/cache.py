@@ -0,0 +1,373 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+"""
+On-disk asset cache shared by every process on a host.
+
+Enable it for `utils.download_asset` (and so the destinations) by setting NSL_CACHE_DIR, and optionally
+NSL_CACHE_MAX_BYTES (default 10 GiB), or pass an AssetCache as download_asset's `cache` argument.
+
+Entries are keyed by the asset's location (cloud platform, bucket and object_path, or href) plus its version: the GCS
+generation, the S3 ETag or the href's ETag (or Last-Modified), looked up with one metadata request, so an object that's
+overwritten is downloaded again rather than read from its old entry. An asset whose storage reports no version isn't
+cached. An entry is downloaded by one caller at a time, under a lock file, into a temporary
+file that is renamed into place, so readers never see a partial entry. When the cache grows past its size cap the least
+recently used entries are removed.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, Optional, Union
+
+from nsl.stac import Asset, utils
+from nsl.stac.connections import http_connection_pool
+from nsl.stac.enum import CloudPlatform
+from nsl.stac.s3 import s3_transfer_engine
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+__all__ = ['AssetCache', 'default_cache']
+
+NSL_CACHE_DIR = os.getenv('NSL_CACHE_DIR')
+NSL_CACHE_MAX_BYTES = int(os.getenv('NSL_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+
+
+class _FileLock:
+    def __init__(self, path: str):
+        """exclusive lock on a file, held across processes and across threads of one process"""
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class AssetCache:
+    def __init__(self, directory: Union[str, Path] = None, max_bytes: int = NSL_CACHE_MAX_BYTES):
+        """
+        :param directory: cache directory, created if it doesn't exist. defaults to NSL_CACHE_DIR, or ~/.nsl/cache
+        :param max_bytes: total size of the cached files before least recently used entries are removed
+        """
+        if directory is None:
+            directory = NSL_CACHE_DIR or Path(Path.home(), '.nsl', 'cache')
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._entries_dir = os.path.join(self.directory, 'entries')
+        self._locks_dir = os.path.join(self.directory, 'locks')
+        os.makedirs(self._entries_dir, exist_ok=True)
+        os.makedirs(self._locks_dir, exist_ok=True)
+
+    @staticmethod
+    def remote_version(asset: Asset,
+                       from_bucket: bool = False,
+                       requester_pays: bool = False,
+                       nsl_id: str = None,
+                       profile_name: str = None) -> Optional[str]:
+        """
+        the version of an asset as its storage reports it: the GCS generation (from the blob metadata, cached for
+        gcs.METADATA_TTL seconds), the S3 ETag, or the ETag of the href, or its Last-Modified and Content-Length
+        :return: None if the storage reports none of them. ValueError if the asset doesn't exist
+        """
+        if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+            blob = utils.get_blob_metadata(bucket=asset.bucket, blob_name=asset.object_path)
+            if blob is None:
+                raise ValueError("not found error for gs://{0}/{1}".format(asset.bucket, asset.object_path))
+            return "generation:{}".format(blob.generation)
+        elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+            head = s3_transfer_engine.head(asset.bucket, asset.object_path, requester_pays=requester_pays)
+            if head is None:
+                raise ValueError("not found error for s3://{0}/{1}".format(asset.bucket, asset.object_path))
+            return "etag:{}".format(head['ETag'].strip('"')) if head.get('ETag') else None
+
+        host, asset_url, headers = utils._href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+        with http_connection_pool.request(method="HEAD", scheme=host.scheme, netloc=host.netloc,
+                                          url=asset_url, headers=headers) as res:
+            res.read()
+            utils._raise_for_href_status(res, asset.href)
+            if res.getheader('etag'):
+                return "etag:{}".format(res.getheader('etag'))
+            if res.getheader('last-modified'):
+                return "modified:{0}:{1}".format(res.getheader('last-modified'), res.getheader('content-length'))
+        return None
+
+    def key(self, asset: Asset, from_bucket: bool = False, version: str = None) -> str:
+        """
+        the cache key of an asset
+        :param asset:
+        :param from_bucket: whether the asset is downloaded from its bucket or from its href
+        :param version: defaults to the remote_version of the asset. entries of other versions of the same object are
+        not used. ValueError if it's not set and the asset has no remote version
+        :return: hex key
+        """
+        if version is None:
+            version = self.remote_version(asset, from_bucket=from_bucket)
+            if version is None:
+                raise ValueError("no version of asset {} to cache it by".format(asset.href or asset.object_path))
+        if from_bucket or not asset.href:
+            location = "{0}:{1}/{2}".format(CloudPlatform(asset.cloud_platform).name, asset.bucket,
+                                            asset.object_path.strip('/'))
+        else:
+            location = asset.href
+        return hashlib.sha256("{0}#{1}".format(location, version).encode('utf-8')).hexdigest()
+
+    def entry_path(self, asset: Asset, from_bucket: bool = False, version: str = None) -> str:
+        """where the asset is, or would be, cached"""
+        key = self.key(asset, from_bucket=from_bucket, version=version)
+        return os.path.join(self._entries_dir, key[:2], key + os.path.splitext(asset.object_path)[1])
+
+    def contains(self, asset: Asset, from_bucket: bool = False, version: str = None) -> bool:
+        return os.path.exists(self.entry_path(asset, from_bucket=from_bucket, version=version))
+
+    def get(self,
+            asset: Asset,
+            from_bucket: bool = False,
+            file_obj: IO = None,
+            save_filename: str = "",
+            save_directory: str = "",
+            version: str = None,
+            link: bool = True,
+            **download_kwargs) -> str:
+        """
+        get an asset from the cache, downloading it with utils.download_asset first if it isn't cached. only one caller,
+        in any process, downloads a given entry; the others wait for it.
+        :param asset: The asset to download
+        :param from_bucket: as in utils.download_asset
+        :param file_obj: the cached file is copied into this file object
+        :param save_filename: the cached file is hard linked (or copied, see link) to this filename
+        :param save_directory: as save_filename, with the filename from the basename of the object_path
+        :param version: see key. if it's not set and the asset has no remote version, the asset is downloaded without
+        being cached
+        :param link: hard link the cached file to save_filename when possible. the linked file is the cached file, so
+        modifying it in place modifies the cache entry. if False, it's always copied
+        :param download_kwargs: requester_pays, nsl_id, profile_name, etc. as in utils.download_asset
+        :return: save_filename, the file_obj's name, or if neither destination is set the cached file's path, which
+        shouldn't be modified and may be evicted at any time
+        """
+        if len(save_directory) > 0 and file_obj is None and len(save_filename) == 0:
+            if not os.path.exists(save_directory):
+                raise ValueError("directory 'save_directory' doesn't exist")
+            save_filename = os.path.join(save_directory, os.path.basename(asset.object_path))
+
+        version = self._version(asset, from_bucket, version, download_kwargs)
+        if version is None:
+            if file_obj is None and len(save_filename) == 0:
+                raise ValueError("no version of asset {} to cache it by".format(asset.href or asset.object_path))
+            return utils.download_asset(asset=asset, from_bucket=from_bucket, file_obj=file_obj,
+                                        save_filename=save_filename, cache=False, **download_kwargs)
+
+        with self._entry(asset, from_bucket, version, download_kwargs) as entry_path:
+            if file_obj is not None:
+                with open(entry_path, 'rb') as entry_obj:
+                    shutil.copyfileobj(entry_obj, file_obj)
+                file_obj.seek(0)
+                return file_obj.name if "name" in file_obj.__dict__ else ""
+            elif len(save_filename) > 0:
+                self._materialize(entry_path, save_filename, link)
+                return save_filename
+            return entry_path
+
+    def open(self, asset: Asset, from_bucket: bool = False, version: str = None, **download_kwargs) -> IO[bytes]:
+        """
+        open the cached file of an asset for reading, downloading it first if it isn't cached. the open file stays
+        readable even if the entry is evicted
+        :param version: see get. an asset that isn't cached for lack of a version is downloaded to a temporary file
+        :return: binary file object, to be closed by the caller
+        """
+        version = self._version(asset, from_bucket, version, download_kwargs)
+        if version is None:
+            file_obj = tempfile.TemporaryFile()
+            try:
+                utils.download_asset(asset=asset, from_bucket=from_bucket, file_obj=file_obj, cache=False,
+                                     **download_kwargs)
+            except BaseException:
+                file_obj.close()
+                raise
+            return file_obj
+
+        with self._entry(asset, from_bucket, version, download_kwargs) as entry_path:
+            return open(entry_path, 'rb')
+
+    def _version(self, asset: Asset, from_bucket: bool, version: Optional[str], download_kwargs: dict) -> Optional[str]:
+        if version is not None:
+            return version
+        return self.remote_version(asset, from_bucket=from_bucket,
+                                   requester_pays=download_kwargs.get('requester_pays', False),
+                                   nsl_id=download_kwargs.get('nsl_id'),
+                                   profile_name=download_kwargs.get('profile_name'))
+
+    @contextmanager
+    def _entry(self, asset: Asset, from_bucket: bool, version: str, download_kwargs: dict) -> Iterator[str]:
+        entry_path = self.entry_path(asset, from_bucket=from_bucket, version=version)
+        # the entry is downloaded to a temporary file under the entry's lock already. a part file of its random name
+        # would never be resumed
+        download_kwargs = {key: value for key, value in download_kwargs.items() if key != 'resumable'}
+        added = False
+        with _FileLock(self._lock_path(entry_path)):
+            if os.path.exists(entry_path):
+                # most recently used
+                os.utime(entry_path)
+            else:
+                os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+                fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix='.tmp')
+                os.close(fd)
+                try:
+                    utils.download_asset(asset=asset, from_bucket=from_bucket, save_filename=temp_filename,
+                                         cache=False, **download_kwargs)
+                    os.replace(temp_filename, entry_path)
+                    added = True
+                finally:
+                    if os.path.exists(temp_filename):
+                        os.remove(temp_filename)
+            yield entry_path
+
+        if added:
+            self.evict()
+
+    @property
+    def size(self) -> int:
+        """total bytes of the cached files"""
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def evict(self, max_bytes: int = None) -> int:
+        """
+        remove least recently used entries until the cache is no bigger than max_bytes. entries being downloaded or
+        read are skipped. if another process is already evicting, returns straight away
+        :param max_bytes: defaults to the cache's max_bytes
+        :return: bytes removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        evict_lock = _FileLock(os.path.join(self.directory, 'evict.lock'))
+        if not evict_lock.acquire(blocking=False):
+            return 0
+
+        removed = 0
+        try:
+            entries = []
+            for path in self._entries():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if total <= max_bytes:
+                    break
+                entry_lock = _FileLock(self._lock_path(path))
+                if not entry_lock.acquire(blocking=False):
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += size
+                except FileNotFoundError:
+                    pass
+                finally:
+                    entry_lock.release()
+        finally:
+            evict_lock.release()
+        return removed
+
+    def clear(self) -> int:
+        """remove every entry that isn't in use. returns bytes removed"""
+        return self.evict(max_bytes=0)
+
+    def _entries(self):
+        for root, _, filenames in os.walk(self._entries_dir):
+            for filename in filenames:
+                # downloads in progress
+                if not filename.endswith(('.tmp', '.part')):
+                    yield os.path.join(root, filename)
+
+    def _lock_path(self, entry_path: str) -> str:
+        return os.path.join(self._locks_dir, os.path.basename(entry_path) + '.lock')
+
+    @staticmethod
+    def _materialize(entry_path: str, save_filename: str, link: bool):
+        save_directory = os.path.dirname(os.path.abspath(save_filename))
+        os.makedirs(save_directory, exist_ok=True)
+        fd, temp_filename = tempfile.mkstemp(dir=save_directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            linked = False
+            if link:
+                os.remove(temp_filename)
+                try:
+                    os.link(entry_path, temp_filename)
+                    linked = True
+                except OSError:
+                    # another filesystem, or no hard link support
+                    pass
+            if not linked:
+                shutil.copyfile(entry_path, temp_filename)
+            os.replace(temp_filename, save_filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> Optional[AssetCache]:
+    """the cache configured by NSL_CACHE_DIR, or None if it isn't set"""
+    global _default_cache
+    if NSL_CACHE_DIR is None:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AssetCache(NSL_CACHE_DIR)
+        return _default_cache
@@ -23,18 +23,20 @@ from warnings import warn
 
 from epl.protobuf.v1 import stac_pb2
 
-from nsl.stac import AUTH0_TENANT, bearer_auth, stac_service as stac_singleton, utils, TimestampFilter
+from nsl.stac import AUTH0_TENANT, bearer_auth, profiling, stac_service as stac_singleton, utils, TimestampFilter
 from nsl.stac.destinations import BaseDestination, MemoryDestination
 from nsl.stac.subscription import Subscription
 from nsl.stac.utils import item_region
 
 
 class NSLClient:
-    def __init__(self, nsl_only=True, nsl_id=None, profile_name=None):
+    def __init__(self, nsl_only=True, nsl_id=None, profile_name=None, profile_dir: str = None):
         """
         Create a client connection to a gRPC STAC service. nsl_only limits all queries to only return data from Near
         Space Labs.
         :param nsl_only:
+        :param profile_dir: if set (or if the NSL_PROFILE_DIR environment variable is set), the public methods of this
+        client and the utils download functions are profiled with cProfile to this directory. see nsl.stac.profiling
         """
         self._stac_service = stac_singleton
         self._nsl_only = nsl_only
@@ -42,6 +44,8 @@ class NSLClient:
             nsl_id = bearer_auth._get_auth_info(profile_name=profile_name).nsl_id
         if nsl_id:
             bearer_auth._default_nsl_id = nsl_id
+        if profile_dir or profiling.PROFILE_DIR:
+            profiling.profile_client(self, profiling.get_profiler(profile_dir))
 
     @property
     def default_nsl_id(self):
@@ -252,7 +256,8 @@ class NSLClient:
             offset = stac_request.offset
             count = 0
 
-            stac_request.limit = page_size if original_limit is None else max(original_limit, page_size)
+            # each page is held in memory before it's yielded, so never request more than page_size at a time
+            stac_request.limit = page_size if original_limit is None else min(original_limit, page_size)
             items = list(self._search_all(stac_request, timeout=timeout,
                                           nsl_id=nsl_id, profile_name=profile_name,
                                           page_size=page_size, correlation_id=correlation_id))
@@ -268,6 +273,9 @@ class NSLClient:
                     break
 
                 stac_request.offset += len(items)
+                if original_limit is not None:
+                    # the last page only requests what's left of the limit
+                    stac_request.limit = min(original_limit - count, page_size)
                 items = list(self._search_all(stac_request, timeout=timeout,
                                               nsl_id=nsl_id, profile_name=profile_name,
                                               page_size=page_size, correlation_id=correlation_id))
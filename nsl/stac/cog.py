@@ -0,0 +1,668 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+"""
+Windowed reads of cloud optimized GeoTIFF assets, fetching only the bytes needed.
+
+`COGReader` reads the TIFF header and every IFD with one range request, then fetches only the tiles that intersect a
+pixel window or a bounding box, from the overview that matches a requested resolution. Ranges are requested from the
+href, or with `from_bucket` from GCS or S3. `read_chips` reads many windows of many assets, fetching the tiles of each
+asset with a few coalesced range requests, and reports a failed chip in its ChipResult without failing the others.
+
+Tiled, chunky (PlanarConfiguration 1) TIFFs and BigTIFFs are supported, uncompressed or compressed with deflate, LZW
+or JPEG. JPEG needs Pillow, and predictors and `as_array` need NumPy; neither is a dependency of this package.
+"""
+
+import io
+import math
+import struct
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from nsl.stac import Asset, transfer, utils
+from nsl.stac.connections import http_connection_pool
+from nsl.stac.enum import CloudPlatform
+
+__all__ = ['ChipResult', 'COGLevel', 'COGReader', 'read_chips', 'read_window']
+
+# bytes of the first request. IFDs of a COG are at the start of the file, and this covers them for most files
+DEFAULT_HEADER_SIZE = 64 * 1024
+DEFAULT_TILE_WORKERS = 8
+DEFAULT_ASSET_WORKERS = 8
+# tiles less than this many bytes apart are fetched with one request, up to DEFAULT_MAX_RANGE_SIZE bytes per request
+DEFAULT_MAX_GAP = 16 * 1024
+DEFAULT_MAX_RANGE_SIZE = 16 * 1024 * 1024
+
+# tags
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+JPEG_TABLES = 347
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+
+# compressions
+NONE = 1
+LZW = 5
+JPEG = 7
+DEFLATE = 8
+ADOBE_DEFLATE = 32946
+
+# tag type -> (struct format, size)
+_TYPES = {1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1), 8: ('h', 2),
+          9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8)}
+# SampleFormat -> numpy dtype kind
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+class COGLevel:
+    def __init__(self, tags: Dict[int, tuple], byte_order: str):
+        """one full resolution image or overview of a COG, from the tags of its IFD"""
+        if TILE_WIDTH not in tags or TILE_OFFSETS not in tags:
+            raise ValueError("not a tiled TIFF. windowed reads need a cloud optimized GeoTIFF")
+        if tags.get(PLANAR_CONFIGURATION, (1,))[0] != 1:
+            raise ValueError("only chunky (PlanarConfiguration 1) TIFFs are supported")
+
+        self.tags = tags
+        self.byte_order = byte_order
+        self.width = tags[IMAGE_WIDTH][0]
+        self.height = tags[IMAGE_LENGTH][0]
+        self.tile_width = tags[TILE_WIDTH][0]
+        self.tile_height = tags[TILE_LENGTH][0]
+        self.samples = tags.get(SAMPLES_PER_PIXEL, (1,))[0]
+        self.bits = tags.get(BITS_PER_SAMPLE, (1,))[0]
+        if self.bits % 8 != 0:
+            raise ValueError("{} bits per sample isn't supported".format(self.bits))
+        self.sample_format = tags.get(SAMPLE_FORMAT, (1,))[0]
+        self.compression = tags.get(COMPRESSION, (NONE,))[0]
+        self.predictor = tags.get(PREDICTOR, (1,))[0]
+        self.offsets = tags[TILE_OFFSETS]
+        self.byte_counts = tags[TILE_BYTE_COUNTS]
+        self.jpeg_tables = bytes(tags[JPEG_TABLES]) if JPEG_TABLES in tags else None
+        self.is_overview = bool(tags.get(NEW_SUBFILE_TYPE, (0,))[0] & 1)
+        # pixels of the full resolution image per pixel of this level. set by the reader
+        self.scale = 1.0
+
+    @property
+    def bytes_per_pixel(self) -> int:
+        return self.samples * self.bits // 8
+
+    @property
+    def tiles_across(self) -> int:
+        return -(-self.width // self.tile_width)
+
+    @property
+    def tiles_down(self) -> int:
+        return -(-self.height // self.tile_height)
+
+    @property
+    def dtype(self) -> str:
+        """numpy dtype string of a sample, e.g. '<u2'"""
+        return "{0}{1}{2}".format(self.byte_order, _SAMPLE_KINDS.get(self.sample_format, 'u'), self.bits // 8)
+
+    def tiles(self, col_off: int, row_off: int, width: int, height: int) -> List[int]:
+        """indexes of the tiles that intersect a window of this level"""
+        first_across, last_across = col_off // self.tile_width, (col_off + width - 1) // self.tile_width
+        first_down, last_down = row_off // self.tile_height, (row_off + height - 1) // self.tile_height
+        return [tile_down * self.tiles_across + tile_across
+                for tile_down in range(first_down, last_down + 1)
+                for tile_across in range(first_across, last_across + 1)]
+
+    def tile_range(self, index: int) -> Optional[Tuple[int, int]]:
+        """first and last byte of a tile in the file, or None for a sparse tile that isn't stored"""
+        if self.byte_counts[index] == 0:
+            return None
+        return self.offsets[index], self.offsets[index] + self.byte_counts[index] - 1
+
+    def decode(self, data: Optional[bytes]) -> bytes:
+        """decompress a tile to tile_height rows of tile_width pixels. a sparse tile (data None) is all zeros"""
+        size = self.tile_width * self.tile_height * self.bytes_per_pixel
+        if data is None:
+            return bytes(size)
+        if self.compression == NONE:
+            decoded = data
+        elif self.compression in (DEFLATE, ADOBE_DEFLATE):
+            decoded = zlib.decompress(data)
+        elif self.compression == LZW:
+            decoded = _lzw_decode(data)
+        elif self.compression == JPEG:
+            decoded = self._decode_jpeg(data)
+        else:
+            raise ValueError("compression {} isn't supported".format(self.compression))
+
+        if len(decoded) < size:
+            decoded = decoded + bytes(size - len(decoded))
+        if self.predictor == 2:
+            decoded = self._undo_horizontal_predictor(decoded[:size])
+        elif self.predictor != 1:
+            raise ValueError("predictor {} isn't supported".format(self.predictor))
+        return decoded[:size]
+
+    def _decode_jpeg(self, data: bytes) -> bytes:
+        try:
+            from PIL import Image
+        except ImportError:
+            raise ImportError("reading JPEG compressed COGs needs Pillow (pip install Pillow)")
+
+        if self.jpeg_tables is not None:
+            # the tables are shared by every tile: splice them in before the tile's start of frame
+            data = self.jpeg_tables[:-2] + data[2:]
+        return Image.open(io.BytesIO(data)).tobytes()
+
+    def _undo_horizontal_predictor(self, decoded: bytes) -> bytes:
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("reading COGs with a predictor needs NumPy (pip install numpy)")
+
+        pixels = np.frombuffer(decoded, dtype=self.dtype).reshape(self.tile_height, self.tile_width, self.samples)
+        return np.cumsum(pixels, axis=1, dtype=pixels.dtype).tobytes()
+
+
+class COGReader:
+    def __init__(self,
+                 asset: Asset,
+                 from_bucket: bool = False,
+                 requester_pays: bool = False,
+                 nsl_id: str = None,
+                 profile_name: str = None,
+                 header_size: int = DEFAULT_HEADER_SIZE,
+                 max_workers: int = DEFAULT_TILE_WORKERS):
+        """
+        open a cloud optimized GeoTIFF asset, reading its header and IFDs
+        :param asset: a CO_GEOTIFF asset
+        :param from_bucket: read from the asset's GCS or S3 bucket instead of its href
+        :param requester_pays: authorize requester pays reads from S3
+        :param nsl_id: ADVANCED ONLY. see utils.download_asset
+        :param profile_name: ADVANCED ONLY. see utils.download_asset
+        :param header_size: bytes read by the first request. IFDs beyond it are read with more requests
+        :param max_workers: tiles fetched at once
+        """
+        self.asset = asset
+        self.max_workers = max_workers
+        self._fetch = _range_fetcher(asset, from_bucket, requester_pays, nsl_id, profile_name)
+        self._head = self._fetch(0, header_size - 1)
+        self._parse()
+
+    @property
+    def width(self) -> int:
+        return self.levels[0].width
+
+    @property
+    def height(self) -> int:
+        return self.levels[0].height
+
+    @property
+    def samples(self) -> int:
+        return self.levels[0].samples
+
+    @property
+    def geotransform(self) -> Optional[Tuple[float, float, float, float, float, float]]:
+        """GDAL style (x origin, pixel width, row rotation, y origin, column rotation, pixel height), or None"""
+        tags = self.levels[0].tags
+        if MODEL_TRANSFORMATION in tags:
+            m = tags[MODEL_TRANSFORMATION]
+            return m[3], m[0], m[1], m[7], m[4], m[5]
+        if MODEL_PIXEL_SCALE in tags and MODEL_TIEPOINT in tags:
+            scale_x, scale_y = tags[MODEL_PIXEL_SCALE][:2]
+            i, j, _, x, y, _ = tags[MODEL_TIEPOINT][:6]
+            return x - i * scale_x, scale_x, 0.0, y + j * scale_y, 0.0, -scale_y
+        return None
+
+    def resolution(self, level: int = 0) -> float:
+        """pixel width of a level, in the units of the geotransform, or in full resolution pixels if there isn't one"""
+        geotransform = self.geotransform
+        pixel_width = abs(geotransform[1]) if geotransform is not None else 1.0
+        return pixel_width * self.levels[level].scale
+
+    def overview_level(self, resolution: float = None) -> int:
+        """
+        the coarsest level whose pixels are no bigger than resolution, so a read at that resolution needs no more data
+        than necessary without losing detail
+        :param resolution: pixel width wanted, in the units of the geotransform (or full resolution pixels)
+        :return: index into levels. 0, the full resolution image, if resolution is None or finer than it
+        """
+        if resolution is None:
+            return 0
+        best = 0
+        for index in range(len(self.levels)):
+            if self.resolution(index) <= resolution * (1 + 1e-9) and self.resolution(index) > self.resolution(best):
+                best = index
+        return best
+
+    def window(self,
+               bbox: Sequence[float] = None,
+               window: Sequence[int] = None,
+               level: int = 0) -> Tuple[int, int, int, int]:
+        """
+        the pixel window of a level covered by a bbox or a full resolution window, clipped to the image
+        :param bbox: (minx, miny, maxx, maxy) in the coordinates of the geotransform
+        :param window: (column offset, row offset, width, height) in full resolution pixels
+        :param level: index into levels
+        :return: (column offset, row offset, width, height) in pixels of the level
+        """
+        if bbox is not None and window is not None:
+            raise ValueError("bbox and window can't both be set")
+        if bbox is not None:
+            geotransform = self.geotransform
+            if geotransform is None:
+                raise ValueError("asset {} isn't georeferenced, use window".format(self.asset.href))
+            x_origin, pixel_width, _, y_origin, _, pixel_height = geotransform
+            columns = sorted([(bbox[0] - x_origin) / pixel_width, (bbox[2] - x_origin) / pixel_width])
+            rows = sorted([(bbox[1] - y_origin) / pixel_height, (bbox[3] - y_origin) / pixel_height])
+        elif window is not None:
+            columns = [window[0], window[0] + window[2]]
+            rows = [window[1], window[1] + window[3]]
+        else:
+            columns, rows = [0, self.width], [0, self.height]
+
+        target = self.levels[level]
+        col_start = max(int(math.floor(columns[0] / target.scale)), 0)
+        col_end = min(int(math.ceil(columns[1] / target.scale)), target.width)
+        row_start = max(int(math.floor(rows[0] / target.scale)), 0)
+        row_end = min(int(math.ceil(rows[1] / target.scale)), target.height)
+        if col_end <= col_start or row_end <= row_start:
+            raise ValueError("window is outside of asset {}".format(self.asset.href))
+        return col_start, row_start, col_end - col_start, row_end - row_start
+
+    def read(self,
+             bbox: Sequence[float] = None,
+             window: Sequence[int] = None,
+             resolution: float = None,
+             level: int = None,
+             as_array: bool = False):
+        """
+        read the pixels of a bbox or window, fetching only the tiles that intersect it
+        :param bbox: (minx, miny, maxx, maxy) in the coordinates of the geotransform. defaults to the whole image
+        :param window: (column offset, row offset, width, height) in full resolution pixels, instead of bbox
+        :param resolution: pixel width wanted. the read is from the level chosen by overview_level
+        :param level: index into levels to read from, instead of resolution
+        :param as_array: return a NumPy array of shape (rows, columns, samples)
+        :return: bytes of rows of pixels of interleaved samples, in the byte order of the file, or a NumPy array
+        """
+        level = self.overview_level(resolution) if level is None else level
+        col_off, row_off, width, height = self.window(bbox=bbox, window=window, level=level)
+        target = self.levels[level]
+        tiles = self.fetch_tiles(level, target.tiles(col_off, row_off, width, height))
+        decoded = {index: target.decode(data) for index, data in tiles.items()}
+        data = _assemble(target, decoded, col_off, row_off, width, height)
+        return _to_array(data, target, width, height) if as_array else data
+
+    def fetch_tiles(self,
+                    level: int,
+                    indexes: Iterable[int],
+                    max_gap: int = DEFAULT_MAX_GAP,
+                    max_range_size: int = DEFAULT_MAX_RANGE_SIZE) -> Dict[int, Optional[bytes]]:
+        """
+        fetch the compressed bytes of tiles of a level. tiles stored next to each other, or less than max_gap bytes
+        apart, are fetched with one range request, and the requests are made concurrently
+        :param level: index into levels
+        :param indexes: tile indexes, see COGLevel.tiles
+        :param max_gap: bytes between two tiles that are fetched, and thrown away, rather than making another request
+        :param max_range_size: bytes of one request at most, unless a single tile is bigger
+        :return: tile index -> bytes, or None for a sparse tile
+        """
+        target = self.levels[level]
+        tiles = {}
+        ranges = []
+        for index in set(indexes):
+            tile_range = target.tile_range(index)
+            if tile_range is None:
+                tiles[index] = None
+            else:
+                ranges.append((tile_range[0], tile_range[1], index))
+
+        def fetch(merged: Tuple[int, int, List[Tuple[int, int, int]]]):
+            start, end, members = merged
+            data = self._fetch(start, end)
+            return [(index, data[tile_start - start:tile_end - start + 1]) for tile_start, tile_end, index in members]
+
+        merged_ranges = _coalesce(ranges, max_gap=max_gap, max_range_size=max_range_size)
+        if len(merged_ranges) <= 1 or self.max_workers <= 1:
+            results = [fetch(merged) for merged in merged_ranges]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(merged_ranges))) as executor:
+                results = list(executor.map(fetch, merged_ranges))
+        for members in results:
+            tiles.update(members)
+        return tiles
+
+    def _read(self, offset: int, size: int) -> bytes:
+        if offset + size <= len(self._head):
+            return self._head[offset:offset + size]
+        return self._fetch(offset, offset + size - 1)
+
+    def _parse(self):
+        if self._head[:2] == b'II':
+            byte_order = '<'
+        elif self._head[:2] == b'MM':
+            byte_order = '>'
+        else:
+            raise ValueError("asset {} isn't a TIFF".format(self.asset.href))
+
+        version = struct.unpack(byte_order + 'H', self._head[2:4])[0]
+        if version == 42:
+            count_format, entry_format, offset_format = 'H', 'HHI', 'I'
+            ifd_offset = struct.unpack(byte_order + 'I', self._head[4:8])[0]
+        elif version == 43:
+            count_format, entry_format, offset_format = 'Q', 'HHQ', 'Q'
+            ifd_offset = struct.unpack(byte_order + 'Q', self._head[8:16])[0]
+        else:
+            raise ValueError("asset {} isn't a TIFF".format(self.asset.href))
+        inline_size = struct.calcsize(offset_format)
+        entry_size = struct.calcsize(byte_order + entry_format) + inline_size
+        count_size = struct.calcsize(byte_order + count_format)
+
+        levels = []
+        seen = set()
+        while ifd_offset and ifd_offset not in seen:
+            seen.add(ifd_offset)
+            count = struct.unpack(byte_order + count_format, self._read(ifd_offset, count_size))[0]
+            entries = self._read(ifd_offset + count_size, count * entry_size + inline_size)
+            tags = {}
+            for i in range(count):
+                entry = entries[i * entry_size:(i + 1) * entry_size]
+                tag, tag_type, value_count = struct.unpack(byte_order + entry_format, entry[:-inline_size])
+                if tag_type not in _TYPES:
+                    continue
+                value_format, value_size = _TYPES[tag_type]
+                total = value_size * value_count
+                if total <= inline_size:
+                    value = entry[-inline_size:][:total]
+                else:
+                    value = self._read(struct.unpack(byte_order + offset_format, entry[-inline_size:])[0], total)
+                if tag_type == 2:
+                    tags[tag] = (value.rstrip(b'\0').decode('ascii', errors='replace'),)
+                else:
+                    tags[tag] = struct.unpack(byte_order + value_format * value_count, value)
+            ifd_offset = struct.unpack(byte_order + offset_format, entries[count * entry_size:])[0]
+
+            # skip masks
+            if not tags.get(NEW_SUBFILE_TYPE, (0,))[0] & 4:
+                levels.append(COGLevel(tags, byte_order))
+
+        if not levels:
+            raise ValueError("asset {} has no images".format(self.asset.href))
+        levels.sort(key=lambda lvl: -lvl.width)
+        for lvl in levels:
+            lvl.scale = levels[0].width / lvl.width
+        self.levels = levels
+
+
+def read_window(asset: Asset,
+                bbox: Sequence[float] = None,
+                window: Sequence[int] = None,
+                resolution: float = None,
+                from_bucket: bool = False,
+                as_array: bool = False,
+                **reader_kwargs):
+    """
+    read a window of a cloud optimized GeoTIFF asset. see COGReader.read. to read many windows of one asset, make a
+    COGReader once and call its read
+    :return: bytes or a NumPy array
+    """
+    reader = COGReader(asset, from_bucket=from_bucket, **reader_kwargs)
+    return reader.read(bbox=bbox, window=window, resolution=resolution, as_array=as_array)
+
+
+class ChipResult:
+    def __init__(self, asset: Asset, bounds: Sequence[float], data=None, error: Optional[BaseException] = None):
+        """
+        the outcome of reading one chip
+        :param asset: the asset the chip was read from
+        :param bounds: the bbox, or pixel window, of the chip
+        :param data: the chip's bytes, or NumPy array, if it was read
+        :param error: the exception raised reading the chip, or its asset, if it failed
+        """
+        self.asset = asset
+        self.bounds = bounds
+        self.data = data
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else "error: {!r}".format(self.error)
+        return "ChipResult({0}, {1}, {2})".format(self.asset.href or self.asset.object_path, tuple(self.bounds), status)
+
+
+def read_chips(chips: Iterable[Tuple[Asset, Sequence[float]]],
+               pixel_windows: bool = False,
+               resolution: float = None,
+               from_bucket: bool = False,
+               as_array: bool = False,
+               max_assets: int = DEFAULT_ASSET_WORKERS,
+               max_gap: int = DEFAULT_MAX_GAP,
+               max_range_size: int = DEFAULT_MAX_RANGE_SIZE,
+               **reader_kwargs) -> List[ChipResult]:
+    """
+    read many chips from many cloud optimized GeoTIFF assets. chips are grouped by asset, each asset's header is read
+    once, the tiles every chip of an asset needs are fetched with a few coalesced range requests (see
+    COGReader.fetch_tiles), and each tile is decoded once no matter how many chips it's in
+    :param chips: (asset, bbox) pairs, with the bbox in the coordinates of the asset's geotransform
+    :param pixel_windows: the chips are (asset, window) pairs instead, see COGReader.read
+    :param resolution: pixel width wanted. see COGReader.overview_level
+    :param from_bucket: read from the assets' GCS or S3 buckets instead of their hrefs
+    :param as_array: return NumPy arrays, see COGReader.read
+    :param max_assets: assets read at once. each also fetches up to the reader's max_workers ranges at once
+    :param max_gap: see COGReader.fetch_tiles
+    :param max_range_size: see COGReader.fetch_tiles
+    :param reader_kwargs: requester_pays, nsl_id, profile_name, header_size, max_workers. see COGReader
+    :return: a ChipResult per (asset, bbox) pair, in the order of chips. a chip that couldn't be read, e.g. because
+    its asset is missing or its bbox is outside the image, has the exception in `error` and doesn't fail the others
+    """
+    groups: Dict[Tuple[str, str, str], List[int]] = {}
+    chips = list(chips)
+    for i, (asset, _) in enumerate(chips):
+        groups.setdefault((asset.href, asset.bucket, asset.object_path), []).append(i)
+
+    results = [ChipResult(asset, bounds) for asset, bounds in chips]
+
+    def read_asset(positions: List[int]):
+        try:
+            reader = COGReader(chips[positions[0]][0], from_bucket=from_bucket, **reader_kwargs)
+            level = reader.overview_level(resolution)
+            target = reader.levels[level]
+        except Exception as e:
+            for i in positions:
+                results[i].error = e
+            return
+
+        windows = {}
+        for i in positions:
+            bounds = chips[i][1]
+            try:
+                windows[i] = reader.window(window=bounds, level=level) if pixel_windows else \
+                    reader.window(bbox=bounds, level=level)
+            except Exception as e:
+                results[i].error = e
+
+        try:
+            needed = [index for window in windows.values() for index in target.tiles(*window)]
+            tiles = reader.fetch_tiles(level, needed, max_gap=max_gap, max_range_size=max_range_size)
+            decoded = {index: target.decode(data) for index, data in tiles.items()}
+        except Exception as e:
+            for i in windows:
+                results[i].error = e
+            return
+        for i, window in windows.items():
+            try:
+                data = _assemble(target, decoded, *window)
+                results[i].data = _to_array(data, target, window[2], window[3]) if as_array else data
+            except Exception as e:
+                results[i].error = e
+
+    if len(groups) <= 1 or max_assets <= 1:
+        for positions in groups.values():
+            read_asset(positions)
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_assets, len(groups))) as executor:
+            for future in [executor.submit(read_asset, positions) for positions in groups.values()]:
+                future.result()
+    return results
+
+
+def _coalesce(ranges: List[Tuple[int, int, int]],
+              max_gap: int,
+              max_range_size: int) -> List[Tuple[int, int, List[Tuple[int, int, int]]]]:
+    # (start, end, key) byte ranges -> (start, end, members) ranges covering them, merging ranges that overlap, touch
+    # or are less than max_gap apart, as long as the merged range isn't bigger than max_range_size
+    merged = []
+    for start, end, key in sorted(ranges):
+        if merged:
+            merged_start, merged_end, members = merged[-1]
+            if start - merged_end - 1 <= max_gap and max(end, merged_end) - merged_start + 1 <= max_range_size:
+                merged[-1] = (merged_start, max(end, merged_end), members + [(start, end, key)])
+                continue
+        merged.append((start, end, [(start, end, key)]))
+    return merged
+
+
+def _assemble(target: COGLevel, decoded: Dict[int, bytes], col_off: int, row_off: int, width: int,
+              height: int) -> bytes:
+    pixel_size = target.bytes_per_pixel
+    tile_row_size = target.tile_width * pixel_size
+    out_row_size = width * pixel_size
+    out = bytearray(out_row_size * height)
+    for index in target.tiles(col_off, row_off, width, height):
+        tile = decoded[index]
+        tile_col = (index % target.tiles_across) * target.tile_width
+        tile_row = (index // target.tiles_across) * target.tile_height
+        # the part of the tile inside the window
+        col_start, col_end = max(col_off, tile_col), min(col_off + width, tile_col + target.tile_width)
+        row_start, row_end = max(row_off, tile_row), min(row_off + height, tile_row + target.tile_height)
+        span = (col_end - col_start) * pixel_size
+        for row in range(row_start, row_end):
+            src = (row - tile_row) * tile_row_size + (col_start - tile_col) * pixel_size
+            dst = (row - row_off) * out_row_size + (col_start - col_off) * pixel_size
+            out[dst:dst + span] = tile[src:src + span]
+    return bytes(out)
+
+
+def _to_array(data: bytes, target: COGLevel, width: int, height: int):
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("as_array needs NumPy (pip install numpy)")
+    return np.frombuffer(data, dtype=target.dtype).reshape(height, width, target.samples)
+
+
+def _range_fetcher(asset: Asset,
+                   from_bucket: bool,
+                   requester_pays: bool,
+                   nsl_id: str,
+                   profile_name: str) -> Callable[[int, int], bytes]:
+    """a function that returns the bytes from start to end (inclusive, clipped to the object's size), with retries"""
+    if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+        _, fetch_range, retry_errors, _ = transfer._gcs_ranges(asset)
+    elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+        _, fetch_range, retry_errors, _ = transfer._s3_ranges(asset, requester_pays)
+    else:
+        fetch_range, retry_errors = _href_range(asset, nsl_id, profile_name), utils.HREF_RETRY_ERRORS
+
+    def fetch(start: int, end: int) -> bytes:
+        for attempt in Retrying(reraise=True,
+                                stop=stop_after_attempt(utils.RESUME_ATTEMPTS),
+                                wait=wait_exponential(multiplier=0.5, max=10),
+                                retry=retry_if_exception_type(retry_errors)):
+            with attempt:
+                file_obj = io.BytesIO()
+                fetch_range(start, end, file_obj)
+                return file_obj.getvalue()
+
+    return fetch
+
+
+def _href_range(asset: Asset, nsl_id: str, profile_name: str) -> Callable[[int, int, io.BytesIO], None]:
+    host, asset_url, headers = utils._href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+    # the whole asset, if the server answers range requests with it
+    whole = []
+
+    def fetch_range(start: int, end: int, file_obj: io.BytesIO):
+        if whole:
+            file_obj.write(whole[0][start:end + 1])
+            return
+        with http_connection_pool.request(method="GET", scheme=host.scheme, netloc=host.netloc, url=asset_url,
+                                          headers={**headers, "range": "bytes={0}-{1}".format(start, end)}) as res:
+            utils._raise_for_href_status(res, asset.href)
+            if res.status == 206:
+                utils._write_response(res, file_obj, asset.href, utils.DOWNLOAD_CHUNK_SIZE)
+                return
+            content = io.BytesIO()
+            utils._write_response(res, content, asset.href, utils.DOWNLOAD_CHUNK_SIZE)
+            whole.append(content.getvalue())
+            file_obj.write(whole[0][start:end + 1])
+
+    return fetch_range
+
+
+def _lzw_decode(data: bytes) -> bytes:
+    # TIFF LZW: MSB first codes of 9 to 12 bits, 256 clear, 257 end of information, and the code width grows one code
+    # early
+    out = bytearray()
+    table = [bytes([i]) for i in range(256)] + [b'', b'']
+    width = 9
+    previous = None
+    bit_buffer, bit_count, position = 0, 0, 0
+    while True:
+        while bit_count < width and position < len(data):
+            bit_buffer = (bit_buffer << 8) | data[position]
+            bit_count += 8
+            position += 1
+        if bit_count < width:
+            break
+        bit_count -= width
+        code = (bit_buffer >> bit_count) & ((1 << width) - 1)
+        bit_buffer &= (1 << bit_count) - 1
+
+        if code == 257:
+            break
+        if code == 256:
+            table = table[:258]
+            width = 9
+            previous = None
+            continue
+        if code < len(table):
+            entry = table[code]
+            if previous is not None:
+                table.append(previous + entry[:1])
+        elif previous is not None:
+            entry = previous + previous[:1]
+            table.append(entry)
+        else:
+            raise ValueError("invalid LZW data")
+        out += entry
+        previous = entry
+        if len(table) + 1 >= (1 << width) and width < 12:
+            width += 1
+    return bytes(out)
@@ -0,0 +1,152 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import http.client
+import os
+import ssl
+import threading
+import weakref
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Tuple
+
+__all__ = ['ConnectionPool', 'http_connection_pool']
+
+# idle keep-alive connections kept per host
+MAX_IDLE_PER_HOST = int(os.getenv('NSL_MAX_IDLE_PER_HOST', 16))
+
+# errors from sending a request on a keep-alive connection that the server has since closed
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                            BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+# every pool, so that a forked child can drop the connections it shares with its parent
+_pools = weakref.WeakSet()
+
+
+class ConnectionPool:
+    def __init__(self, max_idle_per_host: int = MAX_IDLE_PER_HOST, timeout: float = None):
+        """
+        Thread safe pool of keep-alive HTTP and HTTPS connections, per scheme and host. A connection is checked out for
+        one request at a time and is only returned to the pool once its response has been read to the end. A process
+        forked from one that used the pool starts with no idle connections, so parent and child never share a socket.
+        :param max_idle_per_host: idle connections kept per host. connections returned beyond this are closed
+        :param timeout: socket timeout, in seconds, of new connections
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle: Dict[Tuple[str, str], Deque[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+        _pools.add(self)
+
+    @contextmanager
+    def request(self,
+                method: str,
+                scheme: str,
+                netloc: str,
+                url: str,
+                headers: Dict[str, str] = None) -> Iterator[http.client.HTTPResponse]:
+        """
+        send a request on a pooled connection
+        :param method: GET, HEAD, etc
+        :param scheme: 'https' for HTTPS, anything else is plain HTTP
+        :param netloc: host and optional port
+        :param url: path and query of the request
+        :param headers:
+        :return: context manager of the response. read the response within the context; if it's read to the end the
+        connection is reused, otherwise it's closed
+        """
+        key = ('https' if scheme == 'https' else 'http', netloc)
+        conn, reused = self._checkout(key)
+        try:
+            try:
+                conn.request(method=method, url=url, headers=headers or {})
+                res = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # the server closed the idle connection, retry once on a new one
+                conn.close()
+                conn = self._connect(key)
+                conn.request(method=method, url=url, headers=headers or {})
+                res = conn.getresponse()
+            yield res
+        except BaseException:
+            conn.close()
+            raise
+
+        if res.length == 0:
+            res.read()
+        if res.isclosed() and not res.will_close:
+            self._checkin(key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def idle_count(self, scheme: str, netloc: str) -> int:
+        with self._lock:
+            return len(self._idle.get(('https' if scheme == 'https' else 'http', netloc), ()))
+
+    def _checkout(self, key: Tuple[str, str]) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        return self._connect(key), False
+
+    def _checkin(self, key: Tuple[str, str], conn: http.client.HTTPConnection):
+        with self._lock:
+            connections = self._idle.setdefault(key, deque())
+            if len(connections) < self.max_idle_per_host:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def _after_fork(self):
+        # in the child, whose idle connections are the parent's sockets. the child closes its copies, without the lock,
+        # which another thread of the parent may have held when it forked
+        idle, self._idle = self._idle, {}
+        self._lock = threading.Lock()
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def _connect(self, key: Tuple[str, str]) -> http.client.HTTPConnection:
+        scheme, netloc = key
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+
+def _after_fork_in_child():
+    for pool in list(_pools):
+        pool._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+http_connection_pool = ConnectionPool()
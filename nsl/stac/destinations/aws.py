@@ -1,17 +1,28 @@
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Union
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 
 from epl.protobuf.v1 import stac_pb2
-from nsl.stac.enum import AssetType
+from nsl.stac import gcs_storage_client
+from nsl.stac.cache import default_cache
+from nsl.stac.enum import AssetType, CloudPlatform
 from nsl.stac.destinations.base import BaseDestination
 
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 
+# GCS to S3 transfers hold at most max_concurrency parts of part_size bytes in memory
+DEFAULT_PART_SIZE = int(os.getenv('NSL_DELIVERY_PART_SIZE', 16 * 1024 * 1024))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('NSL_DELIVERY_MAX_CONCURRENCY', 8))
+# the S3 limits on multipart uploads
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
 
 class AWSDestination(BaseDestination):
     type = 'aws'
@@ -27,28 +38,90 @@ class AWSDestination(BaseDestination):
                  bucket: str,
                  region: str,
                  asset_type: AssetType = AssetType.GEOTIFF,
-                 save_directory: Union[Path, str] = '/'):
+                 save_directory: Union[Path, str] = '/',
+                 part_size: int = DEFAULT_PART_SIZE,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        :param part_size: bytes per part of the multipart upload, and per range read of a GCS asset. raised to S3's
+        minimum of 5 MiB, and as needed to stay within 10000 parts
+        :param max_concurrency: parts read and uploaded at once
+        """
         super().__init__(asset_type=asset_type)
         self.save_directory = Path(save_directory)
         self.role_arn = role_arn
         self.bucket = bucket
         self.region = region
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency
 
     def deliver(self, nsl_id: str, sub_id: str, stac_item: stac_pb2.StacItem):
         try:
-            # TODO: in the future, check a local cache for this asset to avoid multiple downloads
-            self.target_obj(stac_item).upload_fileobj(self.src_blob(stac_item).open('rb'))
+            target = self.target_obj(stac_item)
+            if self.asset(stac_item).cloud_platform == CloudPlatform.GCP and default_cache() is None:
+                self.transfer_src(stac_item, target)
+            else:
+                config = TransferConfig(multipart_threshold=self.part_size, multipart_chunksize=self.part_size,
+                                        max_concurrency=self.max_concurrency)
+                with self.open_src(stac_item) as src:
+                    target.upload_fileobj(src, Config=config)
             return None
         except BaseException as err:
             print(f'ERROR: failed to transfer asset {stac_item.id}:\n{err}')
             raise err
 
+    def transfer_src(self, stac_item: stac_pb2.StacItem, target):
+        """
+        copy a GCS asset to the target object with a multipart upload. every part is a GCS range read and an upload,
+        max_concurrency of them at once, so the reads and uploads overlap and memory is bounded by the parts in flight
+        """
+        src = self.src_blob(stac_item)
+        client = self.s3.meta.client
+        part_size = max(self.part_size, -(-src.size // MAX_PARTS))
+        if src.size <= part_size:
+            body = self._read_part(src, 0, src.size) if src.size else b''
+            client.put_object(Bucket=target.bucket_name, Key=target.key, Body=body)
+            return
+
+        upload_id = client.create_multipart_upload(Bucket=target.bucket_name, Key=target.key)['UploadId']
+
+        def upload_part(part_number: int) -> dict:
+            start = (part_number - 1) * part_size
+            res = client.upload_part(Bucket=target.bucket_name, Key=target.key, UploadId=upload_id,
+                                     PartNumber=part_number,
+                                     Body=self._read_part(src, start, min(start + part_size, src.size)))
+            return {'ETag': res['ETag'], 'PartNumber': part_number}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='nsl-deliver') as executor:
+                # parts are only read once a worker takes them, so the queued ones take no memory
+                futures = [executor.submit(upload_part, part_number)
+                           for part_number in range(1, -(-src.size // part_size) + 1)]
+                try:
+                    parts = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            client.complete_multipart_upload(Bucket=target.bucket_name, Key=target.key, UploadId=upload_id,
+                                             MultipartUpload={'Parts': parts})
+        except BaseException:
+            client.abort_multipart_upload(Bucket=target.bucket_name, Key=target.key, UploadId=upload_id)
+            raise
+
+    @staticmethod
+    def _read_part(src, start: int, end: int) -> bytes:
+        # the generation, so the parts of an object that's overwritten midway fail rather than mix versions
+        return src.download_as_bytes(client=gcs_storage_client.client, start=start, end=end - 1,
+                                     if_generation_match=src.generation)
+
     def __json__(self) -> dict:
         return dict(**super().__json__(),
                     role_arn=self.role_arn,
                     bucket=self.bucket,
                     region=self.region,
-                    save_directory=str(self.save_directory))
+                    save_directory=str(self.save_directory),
+                    part_size=self.part_size,
+                    max_concurrency=self.max_concurrency)
 
     def target_obj(self, stac_item: stac_pb2.StacItem) -> Optional[object]:
         return self.s3.Object(self.bucket, self.blob_path(stac_item, self.save_directory))
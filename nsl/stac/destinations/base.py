@@ -1,9 +1,10 @@
 import json
 from pathlib import Path
-from typing import Iterator, Optional
+from typing import IO, Iterator, Optional
 
 from epl.protobuf.v1 import stac_pb2
 from nsl.stac import Asset
+from nsl.stac.cache import default_cache
 from nsl.stac.enum import AssetType
 from nsl.stac.utils import get_asset, get_blob_metadata
 
@@ -47,8 +48,19 @@ class BaseDestination(dict):
         return get_asset(stac_item=stac_item, asset_type=self.asset_type, b_relaxed_types=True)
 
     def src_blob(self, stac_item: stac_pb2.StacItem):
+        """the GCS blob of the asset. raises ValueError if it doesn't exist"""
         asset = self.asset(stac_item)
-        return get_blob_metadata(asset.bucket, asset.object_path)
+        blob = get_blob_metadata(asset.bucket, asset.object_path)
+        if blob is None:
+            raise ValueError("not found error for gs://{0}/{1}".format(asset.bucket, asset.object_path))
+        return blob
+
+    def open_src(self, stac_item: stac_pb2.StacItem) -> IO[bytes]:
+        """open the asset from the local asset cache (see nsl.stac.cache) if one is set, otherwise from its bucket"""
+        cache = default_cache()
+        if cache is None:
+            return self.src_blob(stac_item).open('rb')
+        return cache.open(self.asset(stac_item), from_bucket=True)
 
     def blob_path(self, stac_item: stac_pb2.StacItem, root_dir=Path('/')) -> str:
         return str(root_dir.joinpath(self.file_name(stac_item)))
@@ -5,13 +5,12 @@ from google.cloud.storage import Blob, Bucket
 
 from epl.protobuf.v1 import stac_pb2
 from nsl.stac import gcs_storage_client
-from nsl.stac.enum import AssetType
+from nsl.stac.enum import AssetType, CloudPlatform
 from nsl.stac.destinations.base import BaseDestination
 
 
 class GCPDestination(BaseDestination):
     # TODO: GKE access to a bucket w/in the same region is Free
-    # TODO: "transfer" between buckets w/in the same region is Free
     type = 'gcp'
 
     save_directory: Path
@@ -30,14 +29,31 @@ class GCPDestination(BaseDestination):
 
     def deliver(self, nsl_id: str, sub_id: str, stac_item: stac_pb2.StacItem):
         try:
-            # TODO: in the future, check a local cache for this asset to avoid multiple downloads
-            self.target_blob(stac_item)\
-                .upload_from_file(self.src_blob(stac_item).open('rb'), client=gcs_storage_client.client)
+            target = self.target_blob(stac_item)
+            if not self.copy_src(stac_item, target):
+                with self.open_src(stac_item) as src:
+                    target.upload_from_file(src, client=gcs_storage_client.client)
             return None
         except BaseException as err:
             print(f'ERROR: failed to transfer asset {stac_item.id}:\n{err}')
             raise err
 
+    def copy_src(self, stac_item: stac_pb2.StacItem, target: Blob) -> bool:
+        """
+        copy a GCS asset to the target blob with a server-side rewrite, so that none of it passes through this process
+        :return: False if the asset isn't in GCS, it's streamed then. a missing asset raises ValueError, and a rewrite
+        the credentials can't make raises its error, as streaming with the same credentials would fail the same way
+        """
+        if self.asset(stac_item).cloud_platform != CloudPlatform.GCP:
+            return False
+        src = self.src_blob(stac_item)
+        token = None
+        # large objects, and copies across locations or storage classes, take more than one rewrite call
+        while True:
+            token, _, _ = target.rewrite(src, token=token, client=gcs_storage_client.client)
+            if token is None:
+                return True
+
     def __json__(self) -> dict:
         return dict(**super().__json__(),
                     bucket=self.bucket,
@@ -7,8 +7,6 @@ from copy import deepcopy
 from datetime import date, datetime, timezone
 from typing import BinaryIO, Dict, IO, Iterator, List, Optional, Set, Tuple, Union
 
-import boto3
-import botocore.exceptions
 from google.protobuf.any_pb2 import Any
 from google.protobuf.wrappers_pb2 import FloatValue
 from shapely.geometry.base import BaseGeometry
@@ -20,8 +18,14 @@ from nsl.stac import enum, utils, stac_service as stac_singleton, \
     Asset, FloatFilter, StringFilter, TimestampFilter
 from nsl.stac.client import NSLClient
 from nsl.stac.destinations import BaseDestination
+from nsl.stac.gcs import MAX_LOOKUP_WORKERS
+from nsl.stac.inventory import AssetChecker
+from nsl.stac.s3 import s3_transfer_engine
 from nsl.stac.subscription import Subscription
 
+# a pool thread is started per asset checked, up to MAX_LOOKUP_WORKERS, so the few assets of an item take a few threads
+_asset_checker = AssetChecker(max_workers=MAX_LOOKUP_WORKERS)
+
 
 class ProviderRole:
     LICENSOR = 'licensor'
@@ -110,38 +114,35 @@ def _set_properties(stac_data, properties, type_url_prefix):
 
 
 def _check_assets_exist(stac_item: StacItem, b_raise=True) -> List[str]:
-    results = []
     for asset_key in stac_item.assets:
-        asset = stac_item.assets[asset_key]
-        b_file_exists = _check_asset_exists(asset)
+        _check_cloud_platform(stac_item.assets[asset_key])
 
-        if not b_file_exists and b_raise:
-            raise ValueError("get_blob_metadata returns false for asset key {}".format(asset_key))
-        results.append(asset_key)
+    # every asset is checked at once. see nsl.stac.inventory for checking the assets of many items
+    results = []
+    for status in _asset_checker.check_items([stac_item], requester_pays=True):
+        if not status.exists and b_raise:
+            if status.error is not None:
+                raise status.error
+            raise ValueError("get_blob_metadata returns false for asset key {}".format(status.asset_key))
+        results.append(status.asset_key)
     return results
 
 
+def _check_cloud_platform(asset: Asset):
+    if asset.cloud_platform not in (enum.CloudPlatform.GCP, enum.CloudPlatform.AWS):
+        raise ValueError("cloud platform {0} of asset {1} not supported"
+                         .format(enum.CloudPlatform(asset.cloud_platform).name, asset))
+
+
 def _check_asset_exists(asset: Asset) -> bool:
     if asset.cloud_platform == enum.CloudPlatform.GCP:
         return utils.get_blob_metadata(bucket=asset.bucket, blob_name=asset.object_path) is not None
-    elif asset.cloud_platform == enum.CloudPlatform.AWS:
-        return _check_aws_asset_exists(asset)
-    else:
-        raise ValueError("cloud platform {0} of asset {1} not supported"
-                         .format(enum.CloudPlatform(asset.cloud_platform).name, asset))
+    _check_cloud_platform(asset)
+    return _check_aws_asset_exists(asset)
 
 
 def _check_aws_asset_exists(asset: Asset) -> bool:
-    s3 = boto3.client('s3')
-
-    try:
-        s3.head_object(Bucket=asset.bucket, Key=asset.object_path, RequestPayer='requester')
-    except botocore.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == "404":
-            return False
-        else:
-            raise e
-    return True
+    return s3_transfer_engine.head(asset.bucket, asset.object_path, requester_pays=True) is not None
 
 
 class AssetWrap(object):
@@ -330,7 +331,8 @@ does the AssetWrap equal a protobuf Asset
                  save_directory: str = '',
                  requester_pays: bool = False,
                  nsl_id: str = None,
-                 profile_name: str = None) -> str:
+                 profile_name: str = None,
+                 skip_unchanged: bool = False) -> str:
         return utils.download_asset(asset=self._asset,
                                     from_bucket=from_bucket,
                                     file_obj=file_obj,
@@ -338,7 +340,21 @@ does the AssetWrap equal a protobuf Asset
                                     save_directory=save_directory,
                                     requester_pays=requester_pays,
                                     nsl_id=nsl_id,
-                                    profile_name=profile_name)
+                                    profile_name=profile_name,
+                                    skip_unchanged=skip_unchanged)
+
+    def download_into(self,
+                      buffer,
+                      from_bucket: bool = False,
+                      requester_pays: bool = False,
+                      nsl_id: str = None,
+                      profile_name: str = None) -> int:
+        return utils.download_asset_into(asset=self._asset,
+                                         buffer=buffer,
+                                         from_bucket=from_bucket,
+                                         requester_pays=requester_pays,
+                                         nsl_id=nsl_id,
+                                         profile_name=profile_name)
 
     def matches_details(self,
                         asset_key: str = None,
@@ -0,0 +1,800 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+
+import hashlib
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+
+from collections import Counter
+from concurrent import futures
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import grpc
+
+from google.protobuf.wrappers_pb2 import FloatValue
+from shapely import wkb as shapely_wkb, wkt as shapely_wkt
+from shapely.geometry import Polygon, box
+
+from epl.protobuf.v1 import stac_service_pb2_grpc
+from epl.protobuf.v1.stac_pb2 import StacDbResponse
+from nsl.stac import GRPC_CHANNEL_OPTIONS, AuthInfo, Contract, bearer_auth, url_to_channel, \
+    StacItem, StacRequest, Asset, Collection, CollectionRequest, Eo, View, Extent, Interval, \
+    GeometryData, ProjectionData, EnvelopeData, utils
+from nsl.stac.client import NSLClient
+from nsl.stac.enum import AssetType, Band, CloudPlatform, Instrument, Mission, Platform
+
+__all__ = ['SyntheticCorpus', 'FakeStacService', 'FakeStacServer', 'FakeAssetServer', 'use_fake_credentials',
+           'synthetic_cog', 'synthetic_pixel']
+
+FAKE_NSL_ID = 'fake-nsl-id'
+DEFAULT_ASSET_HOST = 'https://api.nearspacelabs.net'
+DEFAULT_BOUNDS = (-98.0, 30.0, -97.5, 30.5)
+DEFAULT_PLACES = ('TRAVIS_COUNTY', 'WILLIAMSON_COUNTY', 'HAYS_COUNTY', 'BASTROP_COUNTY')
+DEFAULT_ASSET_TYPES = (AssetType.GEOTIFF, AssetType.THUMBNAIL)
+ASSET_EXTENSIONS = {AssetType.GEOTIFF: '.tif',
+                    AssetType.CO_GEOTIFF: '_cog.tif',
+                    AssetType.TIFF: '.tiff',
+                    AssetType.THUMBNAIL: '.png',
+                    AssetType.PNG: '.png',
+                    AssetType.JPEG: '.jpg'}
+ASSET_HREF_TYPES = {AssetType.GEOTIFF: 'image/vnd.stac.geotiff',
+                    AssetType.CO_GEOTIFF: 'image/vnd.stac.geotiff; cloud-optimized=true',
+                    AssetType.TIFF: 'image/tiff',
+                    AssetType.THUMBNAIL: 'image/png',
+                    AssetType.PNG: 'image/png',
+                    AssetType.JPEG: 'image/jpeg'}
+# fields of a StacRequest that don't filter the result set
+PAGING_FIELDS = {'limit', 'offset'}
+# default size, in bytes, of the synthetic content served for each file extension
+DEFAULT_ASSET_SIZES = {'.tif': 4 * 1024 * 1024, '.tiff': 4 * 1024 * 1024, '.png': 64 * 1024, '.jpg': 64 * 1024}
+RANGE_REGEX = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class SyntheticCorpus:
+    """
+    A deterministic, lazily generated collection of NSL-like StacItems. Items are built on demand from their index,
+    so a corpus of millions of items costs no memory until items are read. The same (size, seed) always produces the
+    same items, and items are ordered by observation time.
+    """
+
+    def __init__(self,
+                 size: int = 10000,
+                 seed: int = 0,
+                 asset_host: str = DEFAULT_ASSET_HOST,
+                 bucket: str = 'swiftera-processed-data',
+                 bounds: Tuple[float, float, float, float] = DEFAULT_BOUNDS,
+                 start: datetime = datetime(2019, 1, 1, tzinfo=timezone.utc),
+                 end: datetime = datetime(2022, 1, 1, tzinfo=timezone.utc),
+                 regions: Tuple[str, ...] = ('REGION_0',),
+                 asset_types: Tuple[AssetType, ...] = DEFAULT_ASSET_TYPES,
+                 footprint_size: float = 0.01):
+        """
+        :param size: number of items in the corpus
+        :param seed: seed for the random details of every item
+        :param asset_host: scheme and host used for asset hrefs, e.g. the url of a local asset server
+        :param bucket: bucket name set on every asset
+        :param bounds: (xmin, ymin, xmax, ymax) in WGS-84 that footprint centers are drawn from
+        :param start: observation time of the first item
+        :param end: observation time after the last item
+        :param regions: regions that items are spread across (used in object paths, and by `only_accessible`)
+        :param asset_types: the assets every item has
+        :param footprint_size: approximate footprint width and height, in degrees
+        """
+        if size < 0:
+            raise ValueError("size must be non-negative")
+        self._size = size
+        self._seed = seed
+        self._asset_host = asset_host.rstrip('/')
+        self._bucket = bucket
+        self._bounds = bounds
+        self._start = start
+        self._span = (end - start).total_seconds()
+        self._regions = regions
+        self._asset_types = asset_types
+        self._footprint_size = footprint_size
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self) -> Iterator[StacItem]:
+        for index in range(self._size):
+            yield self.item(index)
+
+    def __getitem__(self, index: int) -> StacItem:
+        if index < 0:
+            index += self._size
+        return self.item(index)
+
+    @property
+    def asset_host(self) -> str:
+        return self._asset_host
+
+    def item(self, index: int) -> StacItem:
+        """
+        build the StacItem at the index
+        :param index: position of the item in the corpus
+        :return: StacItem
+        """
+        if index < 0 or index >= self._size:
+            raise IndexError("corpus index {0} out of range for size {1}".format(index, self._size))
+
+        rng = random.Random(self._seed * 1000003 + index)
+        observed = self._start + timedelta(seconds=self._span * index / max(self._size, 1))
+        stac_id = "{0}_{1}_POM1_ST2_P".format(observed.strftime('%Y%m%dT%H%M%SZ'), index)
+
+        footprint = self._footprint(rng)
+        xmin, ymin, xmax, ymax = footprint.bounds
+        envelope = EnvelopeData(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax, proj=ProjectionData(epsg=4326))
+
+        stac_item = StacItem(id=stac_id,
+                             collection='NSL_SCENE',
+                             geometry=GeometryData(wkb=footprint.wkb, proj=ProjectionData(epsg=4326)),
+                             bbox=envelope,
+                             platform_enum=Platform.SWIFT_2 if index % 2 == 0 else Platform.SWIFT_3,
+                             instrument_enum=Instrument.POM_1,
+                             mission_enum=Mission.SWIFT,
+                             gsd=FloatValue(value=rng.uniform(0.1, 0.3)),
+                             eo=Eo(cloud_cover=FloatValue(value=rng.uniform(0.0, 0.2))),
+                             view=View(off_nadir=FloatValue(value=rng.uniform(0.0, 20.0)),
+                                       azimuth=FloatValue(value=rng.uniform(-180.0, 180.0)),
+                                       sun_azimuth=FloatValue(value=rng.uniform(90.0, 270.0)),
+                                       sun_elevation=FloatValue(value=rng.uniform(20.0, 80.0))))
+        stac_item.platform = Platform(stac_item.platform_enum).name
+        stac_item.instrument = Instrument.POM_1.name
+        stac_item.mission = Mission.SWIFT.name
+        stac_item.datetime.CopyFrom(utils.pb_timestamp(observed))
+        stac_item.observed.CopyFrom(utils.pb_timestamp(observed))
+        stac_item.created.CopyFrom(utils.pb_timestamp(observed + timedelta(days=rng.randint(1, 30))))
+        stac_item.updated.CopyFrom(stac_item.created)
+
+        capture = "{0}_{1}".format(observed.strftime('%Y%m%dT000000Z'), rng.choice(DEFAULT_PLACES))
+        region = self._regions[index % len(self._regions)]
+        for asset_type in self._asset_types:
+            object_path = "{0}/Published/{1}/{2}{3}".format(capture,
+                                                            region,
+                                                            stac_id,
+                                                            ASSET_EXTENSIONS.get(asset_type, '.bin'))
+            asset_key = "{0}_{1}".format(asset_type.name, Band.RGB.name)
+            stac_item.assets[asset_key].CopyFrom(
+                Asset(href="{0}/download/{1}".format(self._asset_host, object_path),
+                      type=ASSET_HREF_TYPES.get(asset_type, 'application/octet-stream'),
+                      eo_bands=Band.RGB,
+                      asset_type=asset_type,
+                      cloud_platform=CloudPlatform.GCP,
+                      bucket_manager='Near Space Labs',
+                      bucket_region='us-central1',
+                      bucket=self._bucket,
+                      object_path=object_path))
+        return stac_item
+
+    def index_of(self, stac_id: str) -> Optional[int]:
+        """
+        the corpus index of a stac id, or None if the id isn't from this corpus
+        :param stac_id: StacItem id
+        :return: index or None
+        """
+        parts = stac_id.split('_')
+        if len(parts) < 2 or not parts[1].isdigit():
+            return None
+        index = int(parts[1])
+        if index >= self._size or self.item(index).id != stac_id:
+            return None
+        return index
+
+    def collections(self) -> List[Collection]:
+        """
+        one collection per region, each spanning the corpus extent
+        :return: list of Collections
+        """
+        xmin, ymin, xmax, ymax = self._bounds
+        end = self._start + timedelta(seconds=self._span)
+        results = []
+        for region in self._regions:
+            collection = Collection(id="NSL_SCENE_{}".format(region),
+                                    title="Synthetic NSL scenes for {}".format(region),
+                                    description="generated by nsl.stac.fake.SyntheticCorpus",
+                                    license='proprietary')
+            collection.extent.CopyFrom(Extent(
+                spatial=[EnvelopeData(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax, proj=ProjectionData(epsg=4326))],
+                temporal=[Interval(start=utils.pb_timestamp(self._start), end=utils.pb_timestamp(end))]))
+            results.append(collection)
+        return results
+
+    def _footprint(self, rng: random.Random) -> Polygon:
+        xmin, ymin, xmax, ymax = self._bounds
+        half = self._footprint_size / 2
+        cx = rng.uniform(xmin + half, xmax - half)
+        cy = rng.uniform(ymin + half, ymax - half)
+        # flight lines aren't north-up, so rotate each footprint a little
+        theta = math.radians(rng.uniform(-15.0, 15.0))
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        corners = [(-half, -half), (half, -half), (half, half), (-half, half)]
+        return Polygon([(cx + x * cos_t - y * sin_t, cy + x * sin_t + y * cos_t) for x, y in corners])
+
+
+class FakeStacService(stac_service_pb2_grpc.StacServiceServicer):
+    """
+    An in-process StacService that answers SearchItems, SearchOneItem, CountItems and SearchCollections from a
+    SyntheticCorpus. Requests that only page (limit/offset) are answered by slicing the corpus; any other filter
+    scans the corpus in order.
+    """
+
+    def __init__(self,
+                 corpus: SyntheticCorpus = None,
+                 latency: float = 0.0,
+                 item_latency: float = 0.0,
+                 default_limit: int = 10,
+                 max_page_size: int = 1000):
+        """
+        :param corpus: the items to serve. defaults to a 10k item SyntheticCorpus
+        :param latency: seconds to wait before answering each call
+        :param item_latency: seconds to wait before streaming each item
+        :param default_limit: page size used when a request has no limit
+        :param max_page_size: the largest page returned, regardless of the request limit
+        """
+        self.corpus = corpus if corpus is not None else SyntheticCorpus()
+        self.latency = latency
+        self.item_latency = item_latency
+        self.default_limit = default_limit
+        self.max_page_size = max_page_size
+        self._calls = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self) -> Counter:
+        """number of calls made to each rpc method"""
+        with self._lock:
+            return Counter(self._calls)
+
+    def SearchItems(self, request: StacRequest, context) -> Iterator[StacItem]:
+        self._record('SearchItems')
+        for stac_item in self._search(request):
+            if self.item_latency > 0:
+                time.sleep(self.item_latency)
+            yield stac_item
+
+    def SearchOneItem(self, request: StacRequest, context) -> StacItem:
+        self._record('SearchOneItem')
+        request_one = StacRequest()
+        request_one.CopyFrom(request)
+        request_one.limit = 1
+        for stac_item in self._search(request_one):
+            return stac_item
+        return StacItem()
+
+    def CountItems(self, request: StacRequest, context) -> StacDbResponse:
+        self._record('CountItems')
+        if request.id:
+            return StacDbResponse(count=1 if self._find(request) is not None else 0)
+        elif not self._has_filters(request):
+            return StacDbResponse(count=len(self.corpus))
+        return StacDbResponse(count=sum(1 for stac_item in self.corpus if self._matches(stac_item, request)))
+
+    def SearchCollections(self, request: CollectionRequest, context) -> Iterator[Collection]:
+        self._record('SearchCollections')
+        for collection in self.corpus.collections():
+            if not request.id or request.id == collection.id:
+                yield collection
+
+    def _record(self, method: str):
+        with self._lock:
+            self._calls[method] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _search(self, request: StacRequest) -> Iterator[StacItem]:
+        limit = min(request.limit if request.limit > 0 else self.default_limit, self.max_page_size)
+        offset = max(request.offset, 0)
+
+        if request.id:
+            stac_item = self._find(request)
+            if stac_item is not None and offset == 0:
+                yield stac_item
+        elif not self._has_filters(request):
+            for index in range(offset, min(offset + limit, len(self.corpus))):
+                yield self.corpus.item(index)
+        else:
+            skipped = 0
+            returned = 0
+            for stac_item in self.corpus:
+                if not self._matches(stac_item, request):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                yield stac_item
+                returned += 1
+                if returned >= limit:
+                    return
+
+    def _find(self, request: StacRequest) -> Optional[StacItem]:
+        index = self.corpus.index_of(request.id)
+        if index is None:
+            return None
+        stac_item = self.corpus.item(index)
+        return stac_item if self._matches(stac_item, request) else None
+
+    @staticmethod
+    def _has_filters(request: StacRequest) -> bool:
+        return any(field.name not in PAGING_FIELDS for field, _ in request.ListFields())
+
+    @staticmethod
+    def _matches(stac_item: StacItem, request: StacRequest) -> bool:
+        if request.id and request.id != stac_item.id:
+            return False
+        if request.collection and request.collection != stac_item.collection:
+            return False
+        if request.mission_enum and request.mission_enum != stac_item.mission_enum:
+            return False
+        if request.platform_enum and request.platform_enum != stac_item.platform_enum:
+            return False
+        if request.instrument_enum and request.instrument_enum != stac_item.instrument_enum:
+            return False
+        if request.HasField('datetime') and not utils.eval_timestamp_filter(request.datetime, stac_item.datetime):
+            return False
+        if request.HasField('observed') and not utils.eval_timestamp_filter(request.observed, stac_item.observed):
+            return False
+        if request.HasField('created') and not utils.eval_timestamp_filter(request.created, stac_item.created):
+            return False
+        if request.HasField('updated') and not utils.eval_timestamp_filter(request.updated, stac_item.updated):
+            return False
+        if request.HasField('gsd') and not utils.eval_float_filter(request.gsd, stac_item.gsd.value):
+            return False
+        if request.eo.HasField('cloud_cover') and \
+                not utils.eval_float_filter(request.eo.cloud_cover, stac_item.eo.cloud_cover.value):
+            return False
+        if request.view.HasField('off_nadir') and \
+                not utils.eval_float_filter(request.view.off_nadir, stac_item.view.off_nadir.value):
+            return False
+        if request.HasField('bbox'):
+            item_box = box(stac_item.bbox.xmin, stac_item.bbox.ymin, stac_item.bbox.xmax, stac_item.bbox.ymax)
+            if not item_box.intersects(box(request.bbox.xmin, request.bbox.ymin,
+                                           request.bbox.xmax, request.bbox.ymax)):
+                return False
+        if request.HasField('intersects'):
+            if len(request.intersects.wkt) > 0:
+                geometry = shapely_wkt.loads(request.intersects.wkt)
+            else:
+                geometry = shapely_wkb.loads(request.intersects.wkb)
+            if not geometry.intersects(shapely_wkb.loads(stac_item.geometry.wkb)):
+                return False
+        return True
+
+
+class _FakeServiceStub:
+    """stand-in for the `nsl.stac.stac_service` singleton, bound to one fake server"""
+
+    def __init__(self, stac_service_url: str):
+        self.update_service_url(stac_service_url)
+
+    def update_service_url(self, stac_service_url: str):
+        self.channel = url_to_channel(stac_service_url)
+        self.stub = stac_service_pb2_grpc.StacServiceStub(self.channel)
+
+
+class FakeStacServer:
+    """
+    Runs a FakeStacService on a local port, e.g.
+
+        with FakeStacServer(FakeStacService(SyntheticCorpus(size=100000))) as server:
+            client = server.client()
+            for stac_item in client.search(StacRequest(), auto_paginate=True):
+                ...
+    """
+
+    def __init__(self, service: FakeStacService = None, host: str = 'localhost', port: int = 0, max_workers: int = 10):
+        """
+        :param service: the servicer to run. defaults to a FakeStacService over a 10k item corpus
+        :param host: interface to listen on
+        :param port: port to listen on. 0 picks a free port
+        :param max_workers: size of the server thread pool, i.e. the number of concurrent rpcs
+        """
+        self.service = service if service is not None else FakeStacService()
+        self._host = host
+        self._port = port
+        self._max_workers = max_workers
+        self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return "{0}:{1}".format(self._host, self._port)
+
+    def start(self) -> 'FakeStacServer':
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=self._max_workers),
+                                   options=GRPC_CHANNEL_OPTIONS)
+        stac_service_pb2_grpc.add_StacServiceServicer_to_server(self.service, self._server)
+        self._port = self._server.add_insecure_port("{0}:{1}".format(self._host, self._port))
+        self._server.start()
+        return self
+
+    def stop(self, grace: float = None):
+        if self._server is not None:
+            self._server.stop(grace).wait()
+            self._server = None
+
+    def client(self, client_class=NSLClient, nsl_id: str = FAKE_NSL_ID, **kwargs) -> NSLClient:
+        """
+        create a client (NSLClient, NSLClientEx or a subclass) that talks to this server instead of the shared
+        `stac_service` connection. fake credentials are registered for `nsl_id` so no authentication call is made.
+        :param client_class: the client class to construct
+        :param nsl_id: the fake NSL_ID to register and use
+        :param kwargs: passed to the client constructor
+        :return: client
+        """
+        use_fake_credentials(nsl_id)
+        kwargs.setdefault('nsl_only', False)
+        client = client_class(nsl_id=nsl_id, **kwargs)
+        stub = _FakeServiceStub(self.url)
+        client._stac_service = stub
+        if hasattr(client, '_internal_stac_service'):
+            client._internal_stac_service = stub
+        return client
+
+
+def use_fake_credentials(nsl_id: str = FAKE_NSL_ID) -> AuthInfo:
+    """
+    register credentials that never authenticate against NSL, valid for every region. Use them with fake servers
+    :param nsl_id: the NSL_ID to register
+    :return: AuthInfo
+    """
+    auth_info = bearer_auth.get_credentials(nsl_id=nsl_id)
+    if auth_info is not None and auth_info.skip_authorization:
+        return auth_info
+
+    auth_info = AuthInfo(nsl_id=nsl_id, nsl_secret='fake-nsl-secret')
+    auth_info.skip_authorization = True
+    auth_info.token = 'fake-token'
+    auth_info.contract = Contract(balance=0, region=1, type='fake')
+    bearer_auth._auth_info_map[nsl_id] = auth_info
+    if bearer_auth.default_nsl_id is None:
+        bearer_auth._default_nsl_id = nsl_id
+    return auth_info
+
+
+class _AssetHTTPServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops the connections that many concurrent clients open at once, which then wait
+    # out a SYN retransmit
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class _AssetRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeAssetServer'
+    # headers and body are separate writes. without TCP_NODELAY, keep-alive clients wait on delayed ACKs between them
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.asset_server._record_connection()
+
+    def do_HEAD(self):
+        self._respond(b_body=False)
+
+    def do_GET(self):
+        self._respond(b_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, b_body: bool):
+        asset_server = self.server.asset_server
+        path = unquote(urlparse(self.path).path)
+        asset_server._record_request()
+        if asset_server.latency > 0:
+            time.sleep(asset_server.latency)
+
+        if asset_server.require_auth and not self.headers.get('authorization', '').startswith('Bearer '):
+            self._send_empty(403)
+            return
+        if path in asset_server.missing:
+            self._send_empty(404)
+            return
+
+        body = asset_server.content(path)
+        start, end = 0, len(body) - 1
+        status = 200
+        range_header = self.headers.get('range')
+        if range_header and asset_server.accept_ranges:
+            match = RANGE_REGEX.match(range_header.strip())
+            if match is None or (not match.group(1) and not match.group(2)):
+                self._send_empty(416, {'Content-Range': 'bytes */{}'.format(len(body))})
+                return
+            if not match.group(1):
+                start = max(len(body) - int(match.group(2)), 0)
+            else:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), len(body) - 1)
+            if start >= len(body) or start > end:
+                self._send_empty(416, {'Content-Range': 'bytes */{}'.format(len(body))})
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', self.headers.get('content-type') or 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', '"{}"'.format(hashlib.md5(body).hexdigest()))
+        if asset_server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, len(body)))
+        self.end_headers()
+        if b_body:
+            with asset_server._lock:
+                cut_after = asset_server.interrupt.get(path)
+                if cut_after is not None and end - start + 1 > cut_after:
+                    del asset_server.interrupt[path]
+                    end = start + cut_after - 1
+                    self.close_connection = True
+                if asset_server.corrupt.get(path):
+                    asset_server.corrupt[path] -= 1
+                    body = bytes([body[0] ^ 0xff]) + body[1:]
+            # recorded first so the count is current once the client has the bytes
+            asset_server._record_bytes(end - start + 1)
+            self.wfile.write(memoryview(body)[start:end + 1])
+
+    def _send_empty(self, status: int, headers: Dict[str, str] = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeAssetServer:
+    """
+    A local HTTP server for asset hrefs. Every path serves deterministic synthetic bytes whose size is picked by
+    file extension, with ETag, Content-Length, HEAD and single-range `Range` support. Point a SyntheticCorpus at it
+    with `SyntheticCorpus(asset_host=server.url)`.
+    """
+
+    def __init__(self,
+                 host: str = 'localhost',
+                 port: int = 0,
+                 sizes: Dict[str, int] = None,
+                 default_size: int = 64 * 1024,
+                 latency: float = 0.0,
+                 require_auth: bool = False,
+                 accept_ranges: bool = True):
+        """
+        :param host: interface to listen on
+        :param port: port to listen on. 0 picks a free port
+        :param sizes: content size in bytes per file extension (e.g. {'.tif': 1048576}). defaults to
+        DEFAULT_ASSET_SIZES
+        :param default_size: content size for extensions not in sizes
+        :param latency: seconds to wait before answering each request
+        :param require_auth: answer 403 to requests without a bearer authorization header
+        :param accept_ranges: honor `Range` requests. if False, ranges are ignored and full content is returned
+        """
+        self.sizes = dict(DEFAULT_ASSET_SIZES if sizes is None else sizes)
+        self.default_size = default_size
+        self.latency = latency
+        self.require_auth = require_auth
+        self.accept_ranges = accept_ranges
+        # paths that answer 404
+        self.missing = set()
+        # path -> bytes served for the path instead of synthetic content, e.g. a synthetic_cog
+        self.files = {}
+        # path -> body bytes sent before the connection is dropped. each entry cuts off the next response for the path
+        # that is longer than that, then is removed
+        self.interrupt = {}
+        # path -> number of the next responses for the path whose first byte is flipped, with the ETag of the correct
+        # content
+        self.corrupt = {}
+        self._host = host
+        self._port = port
+        self._httpd = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections = 0
+        self._bytes_sent = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return "http://{0}:{1}".format(self._host, self._port)
+
+    @property
+    def requests(self) -> int:
+        """number of requests received"""
+        with self._lock:
+            return self._requests
+
+    @property
+    def connections(self) -> int:
+        """number of connections accepted"""
+        with self._lock:
+            return self._connections
+
+    @property
+    def bytes_sent(self) -> int:
+        """number of body bytes sent"""
+        with self._lock:
+            return self._bytes_sent
+
+    def content(self, path: str) -> bytes:
+        """
+        the bytes served for a url path
+        :param path: url path, e.g. '/download/capture/Published/REGION_0/item.tif'
+        :return: bytes
+        """
+        if path in self.files:
+            return self.files[path]
+        size = self.sizes.get(os.path.splitext(path)[1].lower(), self.default_size)
+        block = hashlib.sha256(path.encode('utf-8')).digest() * 128
+        return (block * (size // len(block) + 1))[:size]
+
+    def start(self) -> 'FakeAssetServer':
+        self._httpd = _AssetHTTPServer((self._host, self._port), _AssetRequestHandler)
+        self._httpd.asset_server = self
+        self._port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def _record_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def _record_connection(self):
+        with self._lock:
+            self._connections += 1
+
+    def _record_bytes(self, count: int):
+        with self._lock:
+            self._bytes_sent += count
+
+
+def synthetic_pixel(row: int, col: int, sample: int) -> int:
+    """the value of a full resolution pixel sample of a synthetic_cog"""
+    return (row * 7 + col * 3 + sample * 50) % 256
+
+
+def synthetic_cog(width: int = 600,
+                  height: int = 500,
+                  samples: int = 3,
+                  tile_size: int = 128,
+                  overviews: int = 2,
+                  compression: int = 8,
+                  predictor: int = 1,
+                  bigtiff: bool = False,
+                  origin: Tuple[float, float] = (600000.0, 3300000.0),
+                  pixel_size: float = 0.5) -> bytes:
+    """
+    A small tiled, 8 bit, cloud optimized GeoTIFF: every IFD and tag value first, then the tiles. Pixel values are
+    synthetic_pixel(row, col, sample) of the full resolution pixel; overview n is every 2**n th pixel of every 2**n th
+    row.
+    :param width: full resolution width
+    :param height: full resolution height
+    :param samples: samples per pixel
+    :param tile_size: tile width and height
+    :param overviews: number of overviews
+    :param compression: 1 (none) or 8 (deflate)
+    :param predictor: 1 (none) or 2 (horizontal differencing)
+    :param bigtiff: write a BigTIFF
+    :param origin: x and y of the top left corner of the top left pixel
+    :param pixel_size: full resolution pixel width and height, in the units of the origin
+    :return: the file's bytes
+    """
+    byte_order = '<'
+    offset_format, offset_type = ('Q', 16) if bigtiff else ('I', 4)
+    levels = []
+    for level in range(overviews + 1):
+        scale = 2 ** level
+        level_width, level_height = -(-width // scale), -(-height // scale)
+        tiles = []
+        for tile_row in range(0, level_height, tile_size):
+            for tile_col in range(0, level_width, tile_size):
+                data = bytearray()
+                for row in range(tile_row, tile_row + tile_size):
+                    previous = [0] * samples
+                    for col in range(tile_col, tile_col + tile_size):
+                        for sample in range(samples):
+                            inside = row < level_height and col < level_width
+                            value = synthetic_pixel(row * scale, col * scale, sample) if inside else 0
+                            if predictor == 2:
+                                value, previous[sample] = (value - previous[sample]) % 256, value
+                            data.append(value)
+                tiles.append(zlib.compress(bytes(data)) if compression == 8 else bytes(data))
+
+        tags = [(254, 4, [0 if level == 0 else 1]),
+                (256, 4, [level_width]),
+                (257, 4, [level_height]),
+                (258, 3, [8] * samples),
+                (259, 3, [compression]),
+                (262, 3, [2 if samples == 3 else 1]),
+                (277, 3, [samples]),
+                (284, 3, [1]),
+                (317, 3, [predictor]),
+                (322, 3, [tile_size]),
+                (323, 3, [tile_size]),
+                (324, offset_type, [0] * len(tiles)),
+                (325, 4, [len(tile) for tile in tiles]),
+                (339, 3, [1] * samples)]
+        if level == 0:
+            tags += [(33550, 12, [pixel_size, pixel_size, 0.0]),
+                     (33922, 12, [0.0, 0.0, 0.0, origin[0], origin[1], 0.0])]
+        levels.append((tags, tiles))
+
+    type_formats = {3: 'H', 4: 'I', 12: 'd', 16: 'Q'}
+    inline_size = 8 if bigtiff else 4
+
+    def ifd_bytes(tags, position: int, next_ifd: int) -> bytes:
+        entry_format = byte_order + ('HHQ' if bigtiff else 'HHI')
+        count_format = byte_order + ('Q' if bigtiff else 'H')
+        entries_size = struct.calcsize(count_format) + len(tags) * (struct.calcsize(entry_format) + inline_size) + \
+            struct.calcsize(byte_order + offset_format)
+        entries, values = b'', b''
+        for tag, tag_type, tag_values in tags:
+            value = struct.pack(byte_order + type_formats[tag_type] * len(tag_values), *tag_values)
+            entries += struct.pack(entry_format, tag, tag_type, len(tag_values))
+            if len(value) <= inline_size:
+                entries += value.ljust(inline_size, b'\0')
+            else:
+                entries += struct.pack(byte_order + offset_format, position + entries_size + len(values))
+                values += value
+        return struct.pack(count_format, len(tags)) + entries + \
+            struct.pack(byte_order + offset_format, next_ifd) + values
+
+    header = b'II' + (struct.pack('<HHHQ', 43, 8, 0, 16) if bigtiff else struct.pack('<HI', 42, 8))
+    # IFD sizes don't depend on the tile offsets, so lay them out once to find where the tiles start
+    sizes = [len(ifd_bytes(tags, 0, 0)) for tags, _ in levels]
+    tile_offset = len(header) + sum(sizes)
+    for tags, tiles in levels:
+        offsets = []
+        for tile in tiles:
+            offsets.append(tile_offset)
+            tile_offset += len(tile)
+        tags[11] = (324, offset_type, offsets)
+
+    content = bytearray(header)
+    for i, (tags, _) in enumerate(levels):
+        next_ifd = len(content) + sizes[i] if i < len(levels) - 1 else 0
+        content += ifd_bytes(tags, len(content), next_ifd)
+    for _, tiles in levels:
+        for tile in tiles:
+            content += tile
+    return bytes(content)
@@ -0,0 +1,121 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from google.cloud import storage
+
+from nsl.stac import gcs_storage_client
+
+__all__ = ['GCSMetadataCache', 'gcs_metadata_cache']
+
+# seconds a blob's metadata is reused for. a blob overwritten within that time is downloaded with its old generation,
+# which fails (and is then looked up again) rather than mixing versions
+METADATA_TTL = float(os.getenv('NSL_GCS_METADATA_TTL', 60))
+# blob metadata kept, least recently fetched dropped first
+MAX_BLOBS = int(os.getenv('NSL_GCS_MAX_BLOBS', 10000))
+# concurrent requests of a batch lookup
+MAX_LOOKUP_WORKERS = int(os.getenv('NSL_GCS_MAX_LOOKUP_WORKERS', 16))
+
+
+class GCSMetadataCache:
+    def __init__(self, ttl: float = METADATA_TTL, max_blobs: int = MAX_BLOBS, client: storage.Client = None):
+        """
+        Thread safe cache of GCS bucket handles and blob metadata. Bucket handles are made locally, with no request,
+        so a blob lookup costs one request instead of two, and none while its metadata is cached.
+        :param ttl: seconds blob metadata is cached for. 0 disables blob caching
+        :param max_blobs: blobs cached at most
+        :param client: defaults to gcs_storage_client.client
+        """
+        self.ttl = ttl
+        self.max_blobs = max_blobs
+        self._client = client
+        self._buckets: Dict[str, storage.Bucket] = {}
+        # (bucket, blob name) -> (expiry, blob). dicts keep insertion order, so the first key is the oldest fetch
+        self._blobs: Dict[Tuple[str, str], Tuple[float, storage.Blob]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> storage.Client:
+        client = self._client if self._client is not None else gcs_storage_client.client
+        if client is None:
+            raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable not set")
+        return client
+
+    def bucket(self, bucket: str) -> storage.Bucket:
+        """a handle of the bucket. unlike client.get_bucket, no request is made"""
+        with self._lock:
+            if bucket not in self._buckets:
+                self._buckets[bucket] = self.client.bucket(bucket)
+            return self._buckets[bucket]
+
+    def blob(self, bucket: str, blob_name: str, refresh: bool = False) -> Optional[storage.Blob]:
+        """
+        the metadata of a blob, from the cache if it was fetched less than ttl seconds ago
+        :param bucket: bucket name
+        :param blob_name: complete blob name (doesn't include bucket name)
+        :param refresh: fetch it even if it's cached
+        :return: Blob, or None if it doesn't exist. a missing blob isn't cached
+        """
+        key = (bucket, blob_name.strip('/'))
+        if not refresh:
+            with self._lock:
+                cached = self._blobs.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+
+        blob = self.bucket(bucket).get_blob(blob_name=key[1])
+        with self._lock:
+            self._blobs.pop(key, None)
+            if blob is not None and self.ttl > 0:
+                self._blobs[key] = (time.monotonic() + self.ttl, blob)
+                while len(self._blobs) > self.max_blobs:
+                    del self._blobs[next(iter(self._blobs))]
+        return blob
+
+    def blobs(self,
+              locations: Iterable[Tuple[str, str]],
+              max_workers: int = MAX_LOOKUP_WORKERS) -> List[Optional[storage.Blob]]:
+        """
+        the metadata of many blobs, fetching the ones that aren't cached concurrently
+        :param locations: (bucket, blob name) pairs
+        :param max_workers: concurrent requests
+        :return: a Blob, or None if it doesn't exist, per location in the order of locations
+        """
+        locations = list(locations)
+        if len(locations) <= 1 or max_workers <= 1:
+            return [self.blob(bucket, blob_name) for bucket, blob_name in locations]
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(locations))) as executor:
+            return list(executor.map(lambda location: self.blob(*location), locations))
+
+    def invalidate(self, bucket: str, blob_name: str):
+        """forget a blob's metadata, e.g. after it's overwritten"""
+        with self._lock:
+            self._blobs.pop((bucket, blob_name.strip('/')), None)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._blobs.clear()
+
+
+gcs_metadata_cache = GCSMetadataCache()
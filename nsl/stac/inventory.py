@@ -0,0 +1,191 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from nsl.stac import Asset, StacItem, utils
+from nsl.stac.connections import ConnectionPool, http_connection_pool
+from nsl.stac.enum import AssetType, CloudPlatform
+from nsl.stac.gcs import GCSMetadataCache, gcs_metadata_cache
+from nsl.stac.s3 import S3TransferEngine, s3_transfer_engine
+
+__all__ = ['AssetChecker', 'AssetStatus', 'check_assets']
+
+# concurrent metadata requests. each is small, so this is well above the number of concurrent downloads
+DEFAULT_MAX_WORKERS = int(os.getenv('NSL_CHECK_MAX_WORKERS', 32))
+
+
+class AssetStatus:
+    def __init__(self,
+                 asset: Asset,
+                 asset_key: str = "",
+                 stac_id: str = "",
+                 exists: bool = False,
+                 size: int = None,
+                 last_modified: datetime = None,
+                 error: Exception = None):
+        """
+        whether an asset exists, and its size and last modification, as its storage reports them
+        :param error: the exception raised by the check, if it failed. exists is False then, though the asset may exist
+        """
+        self.asset = asset
+        self.asset_key = asset_key
+        self.stac_id = stac_id
+        self.exists = exists
+        self.size = size
+        self.last_modified = last_modified
+        self.error = error
+
+    def as_dict(self) -> Dict:
+        """a row of the check's table, e.g. for pandas.DataFrame([status.as_dict() for status in statuses])"""
+        return {'stac_id': self.stac_id,
+                'asset_key': self.asset_key,
+                'exists': self.exists,
+                'size': self.size,
+                'last_modified': self.last_modified,
+                'error': repr(self.error) if self.error is not None else None}
+
+    def __repr__(self):
+        status = "error: {!r}".format(self.error) if self.error is not None else \
+            ("{} bytes".format(self.size) if self.exists else "missing")
+        return "<AssetStatus {0} {1} {2}>".format(self.stac_id, self.asset_key, status)
+
+
+class AssetChecker:
+    def __init__(self,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 s3_engine: S3TransferEngine = None,
+                 gcs_cache: GCSMetadataCache = None,
+                 pool: ConnectionPool = None):
+        """
+        Checks the existence, size and last modification of many assets concurrently: GCS blob lookups, S3 head_object
+        requests and href HEAD requests, with the shared clients and connection pool
+        :param max_workers: concurrent requests
+        :param s3_engine: defaults to s3.s3_transfer_engine
+        :param gcs_cache: defaults to gcs.gcs_metadata_cache. cached blob metadata is reused for its ttl
+        :param pool: defaults to connections.http_connection_pool
+        """
+        self.max_workers = max_workers
+        self.s3_engine = s3_engine if s3_engine is not None else s3_transfer_engine
+        self.gcs_cache = gcs_cache if gcs_cache is not None else gcs_metadata_cache
+        self.pool = pool if pool is not None else http_connection_pool
+
+    def check(self,
+              asset: Asset,
+              asset_key: str = "",
+              stac_id: str = "",
+              from_bucket: bool = True,
+              requester_pays: bool = False,
+              nsl_id: str = None,
+              profile_name: str = None) -> AssetStatus:
+        """
+        check one asset
+        :param from_bucket: check the GCS or S3 object. if False, or if the asset isn't on either, its href is checked
+        :param requester_pays: authorize requester pays S3 requests
+        :param nsl_id: ADVANCED ONLY. see utils.download_asset
+        :param profile_name: ADVANCED ONLY. see utils.download_asset
+        :return: AssetStatus. errors are recorded in it rather than raised
+        """
+        status = AssetStatus(asset, asset_key=asset_key, stac_id=stac_id)
+        try:
+            if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+                blob = self.gcs_cache.blob(asset.bucket, asset.object_path)
+                if blob is not None:
+                    status.exists, status.size, status.last_modified = True, blob.size, blob.updated
+            elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+                head = self.s3_engine.head(asset.bucket, asset.object_path, requester_pays=requester_pays)
+                if head is not None:
+                    status.exists, status.size, status.last_modified = \
+                        True, head['ContentLength'], head.get('LastModified')
+            elif asset.href:
+                self._check_href(status, nsl_id, profile_name)
+            else:
+                raise ValueError("cloud platform {0} of asset {1} not supported"
+                                 .format(CloudPlatform(asset.cloud_platform).name, asset))
+        except Exception as e:
+            status.error = e
+        return status
+
+    def check_items(self,
+                    stac_items: Iterable,
+                    asset_type: AssetType = None,
+                    from_bucket: bool = True,
+                    requester_pays: bool = False,
+                    nsl_id: str = None,
+                    profile_name: str = None,
+                    max_pending: int = None) -> Iterator[AssetStatus]:
+        """
+        check the assets of many items concurrently. stac_items can be a search result stream, it's consumed only as
+        fast as checks complete
+        :param stac_items: StacItems and/or StacItemWraps
+        :param asset_type: only check assets of this type. defaults to all assets
+        :param max_pending: checks in progress or complete but not yet read at most. defaults to four times max_workers
+        :return: an AssetStatus per asset, in the order of stac_items and of their assets
+        """
+        max_pending = self.max_workers * 4 if max_pending is None else max_pending
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='nsl-check') as executor:
+            for stac_item in stac_items:
+                if not isinstance(stac_item, StacItem):
+                    stac_item = stac_item.stac_item
+                for asset_key in stac_item.assets:
+                    asset = stac_item.assets[asset_key]
+                    if asset_type is not None and not utils._asset_types_match(asset_type, asset.asset_type):
+                        continue
+                    pending.append(executor.submit(self.check, asset, asset_key, stac_item.id, from_bucket,
+                                                   requester_pays, nsl_id, profile_name))
+                    while len(pending) >= max_pending:
+                        yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _check_href(self, status: AssetStatus, nsl_id: Optional[str], profile_name: Optional[str]):
+        host, asset_url, headers = utils._href_request(status.asset, nsl_id=nsl_id, profile_name=profile_name)
+        with self.pool.request(method="HEAD", scheme=host.scheme, netloc=host.netloc,
+                               url=asset_url, headers=headers) as res:
+            res.read()
+            if res.status == 404:
+                return
+            utils._raise_for_href_status(res, status.asset.href)
+            content_length = res.getheader('content-length')
+            last_modified = res.getheader('last-modified')
+            status.exists = True
+            status.size = int(content_length) if content_length is not None else None
+            status.last_modified = parsedate_to_datetime(last_modified) if last_modified else None
+
+
+def check_assets(stac_items: Iterable,
+                 asset_type: AssetType = None,
+                 from_bucket: bool = True,
+                 requester_pays: bool = False,
+                 nsl_id: str = None,
+                 profile_name: str = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS) -> List[AssetStatus]:
+    """
+    check the existence, size and last modification of the assets of many items concurrently. see
+    AssetChecker.check_items
+    :return: an AssetStatus per asset, in the order of stac_items and of their assets
+    """
+    return list(AssetChecker(max_workers=max_workers).check_items(stac_items, asset_type=asset_type,
+                                                                  from_bucket=from_bucket,
+                                                                  requester_pays=requester_pays, nsl_id=nsl_id,
+                                                                  profile_name=profile_name))
@@ -0,0 +1,324 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from epl.protobuf.v1.stac_pb2 import StacRequest
+
+from nsl.stac import Asset, StacItem, utils
+from nsl.stac.enum import AssetType, Band, CloudPlatform
+from nsl.stac.transfer import DEFAULT_MAX_PER_HOST, DEFAULT_MAX_WORKERS, DownloadEngine, DownloadResult
+
+__all__ = ['DownloadJob', 'DownloadManifest', 'ManifestEntry']
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ManifestEntry:
+    def __init__(self,
+                 stac_id: str,
+                 asset_key: str,
+                 save_filename: str,
+                 status: str = PENDING,
+                 size: int = 0,
+                 md5: str = "",
+                 error: str = "",
+                 mtime: float = 0.0):
+        """one asset of a DownloadManifest"""
+        self.stac_id = stac_id
+        self.asset_key = asset_key
+        self.save_filename = save_filename
+        self.status = status
+        self.size = size
+        self.md5 = md5
+        self.error = error
+        self.mtime = mtime or 0.0
+
+    @property
+    def complete(self) -> bool:
+        """
+        downloaded, and the file is still there with the size and modification time, if recorded, it was downloaded
+        with. the file isn't read, see verify
+        """
+        if self.status != DONE or not os.path.exists(self.save_filename):
+            return False
+        stat = os.stat(self.save_filename)
+        return stat.st_size == self.size and (not self.mtime or stat.st_mtime == self.mtime)
+
+    def verify(self) -> bool:
+        """complete, and the file still has the md5, if recorded, it was downloaded with. reads the whole file"""
+        if not self.complete:
+            return False
+        return not self.md5 or utils._file_digest(self.save_filename, hashlib.md5()) == self.md5
+
+    def __repr__(self):
+        return "<ManifestEntry {0} {1} {2}>".format(self.stac_id, self.asset_key, self.status)
+
+
+class DownloadManifest:
+    _COLUMNS = ('stac_id', 'asset_key', 'save_filename', 'status', 'size', 'md5', 'error', 'mtime')
+
+    def __init__(self, path: str):
+        """
+        SQLite record of the assets of a download job: their item id, asset key, file, status, size, md5
+        and modification time. Every
+        change is committed as it's made, so the manifest survives a crash of the job.
+        :param path: the database file. created if it doesn't exist
+        """
+        self.path = path
+        self._db = sqlite3.connect(path)
+        # the write-ahead log makes the commit of every entry cheap
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS assets (stac_id TEXT, asset_key TEXT, save_filename TEXT, "
+                             "status TEXT, size INTEGER, md5 TEXT, error TEXT, updated REAL, mtime REAL, "
+                             "PRIMARY KEY (stac_id, asset_key))")
+            # manifests made before the modification time was recorded
+            if 'mtime' not in [row[1] for row in self._db.execute("PRAGMA table_info(assets)")]:
+                self._db.execute("ALTER TABLE assets ADD COLUMN mtime REAL")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def get_job(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM job WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_job(self, key: str, value: str):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO job VALUES (?, ?)", (key, value))
+
+    def get(self, stac_id: str, asset_key: str) -> Optional[ManifestEntry]:
+        row = self._db.execute("SELECT {} FROM assets WHERE stac_id = ? AND asset_key = ?"
+                               .format(", ".join(self._COLUMNS)), (stac_id, asset_key)).fetchone()
+        return ManifestEntry(*row) if row is not None else None
+
+    def put(self, entry: ManifestEntry):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO assets ({}, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                             .format(", ".join(self._COLUMNS)),
+                             (entry.stac_id, entry.asset_key, entry.save_filename, entry.status, entry.size,
+                              entry.md5, entry.error, entry.mtime, time.time()))
+
+    def entries(self, status: str = None) -> List[ManifestEntry]:
+        """every entry, or those with a status ('pending', 'done' or 'failed')"""
+        query = "SELECT {} FROM assets".format(", ".join(self._COLUMNS))
+        if status is None:
+            rows = self._db.execute(query + " ORDER BY rowid")
+        else:
+            rows = self._db.execute(query + " WHERE status = ? ORDER BY rowid", (status,))
+        return [ManifestEntry(*row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """number of entries per status"""
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM assets GROUP BY status").fetchall())
+
+
+class DownloadJob:
+    def __init__(self,
+                 manifest_path: str,
+                 save_directory: str,
+                 stac_request: StacRequest = None,
+                 stac_items: Iterable = None,
+                 client=None,
+                 asset_type: AssetType = None,
+                 cloud_platform: CloudPlatform = CloudPlatform.UNKNOWN_CLOUD_PLATFORM,
+                 eo_bands: Band = Band.UNKNOWN_BAND,
+                 asset_regex: Dict = None,
+                 asset_key: str = None,
+                 b_relaxed_types: bool = False,
+                 from_bucket: bool = False,
+                 nsl_id: str = None,
+                 profile_name: str = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 verify_complete: bool = False):
+        """
+        Downloads every selected asset of a search, or of a list of items, concurrently, keeping a DownloadManifest
+        so that a job that's interrupted, by a crash or otherwise, continues where it stopped when it's run again. The
+        search is made again on a rerun, so it must return the same items.
+        :param manifest_path: the SQLite manifest. a rerun of the job must use the same one
+        :param save_directory: the directory where the files should be downloaded
+        :param stac_request: the search whose items are downloaded, with auto pagination
+        :param stac_items: StacItems and/or StacItemWraps to download, instead of a stac_request
+        :param client: the NSLClient for stac_request. defaults to a new NSLClient
+        :param asset_type: asset selection, as in utils.get_assets. defaults to every asset
+        :param cloud_platform: asset selection, as in utils.get_assets
+        :param eo_bands: asset selection, as in utils.get_assets
+        :param asset_regex: asset selection, as in utils.get_assets
+        :param asset_key: asset selection, as in utils.get_assets
+        :param b_relaxed_types: asset selection, as in utils.get_assets
+        :param from_bucket: force download from bucket. if set to false downloads happen from href
+        :param nsl_id: ADVANCED ONLY. see utils.download_asset and NSLClient.search
+        :param profile_name: ADVANCED ONLY. see utils.download_asset and NSLClient.search
+        :param max_workers: number of simultaneous downloads
+        :param max_per_host: number of simultaneous downloads from one host
+        :param verify_complete: on a rerun, read every completed file back and compare its md5 with the one it was
+        downloaded with, rather than only its size and modification time
+        """
+        if (stac_request is None) == (stac_items is None):
+            raise ValueError("one of stac_request or stac_items must be set")
+        if not os.path.exists(save_directory):
+            raise ValueError("directory 'save_directory' doesn't exist")
+
+        self.save_directory = save_directory
+        self.stac_request = stac_request
+        self.stac_items = stac_items
+        self.client = client
+        self.selectors = dict(asset_type=asset_type, cloud_platform=cloud_platform, eo_bands=eo_bands,
+                              asset_regex=asset_regex, asset_key=asset_key, b_relaxed_types=b_relaxed_types)
+        self.from_bucket = from_bucket
+        self.nsl_id = nsl_id
+        self.profile_name = profile_name
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.verify_complete = verify_complete
+        self.manifest = DownloadManifest(manifest_path)
+        try:
+            self._check_job()
+        except ValueError:
+            self.manifest.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.manifest.close()
+
+    def run(self, on_result: Callable[[DownloadResult], Any] = None) -> Dict[str, int]:
+        """
+        download every selected asset that the manifest doesn't record as complete: new assets, assets that failed or
+        were still downloading when an earlier run stopped, and completed assets whose file is gone or changed. an item
+        without the asset_key selected is recorded as failed, and doesn't stop the job
+        :param on_result: called with the DownloadResult of every download, as it completes
+        :return: the number of assets downloaded ('done'), 'failed' and 'skipped' because they were already complete
+        """
+        summary = {DONE: 0, FAILED: 0, 'skipped': 0}
+        with DownloadEngine(max_workers=self.max_workers, max_per_host=self.max_per_host) as engine:
+            max_pending = self.max_workers * 2
+            # future -> its md5 hash object
+            pending = {}
+            assets = self._assets()
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    keyed_asset = next(assets, None)
+                    if keyed_asset is None:
+                        exhausted = True
+                        continue
+                    stac_id, asset_key, asset = keyed_asset
+                    if isinstance(asset, Exception):
+                        self.manifest.put(ManifestEntry(stac_id, asset_key, "", status=FAILED, error=repr(asset)))
+                        summary[FAILED] += 1
+                        continue
+                    entry = self.manifest.get(stac_id, asset_key)
+                    if entry is not None and (entry.verify() if self.verify_complete else entry.complete):
+                        summary['skipped'] += 1
+                        continue
+                    future, checksum = self._submit(engine, stac_id, asset_key, asset)
+                    pending[future] = checksum
+                if not pending:
+                    return summary
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    summary[self._record(result, pending.pop(future))] += 1
+                    if on_result is not None:
+                        on_result(result)
+
+    def _check_job(self):
+        # a manifest kept for one job mustn't mark the assets of another as complete
+        if self.stac_request is not None:
+            job = self.stac_request.SerializeToString(deterministic=True).hex()
+        else:
+            job = "items"
+        job = json.dumps({'job': job, 'save_directory': os.path.abspath(self.save_directory),
+                          'from_bucket': self.from_bucket,
+                          'selectors': {key: str(value) for key, value in self.selectors.items()}}, sort_keys=True)
+        existing = self.manifest.get_job('job')
+        if existing is None:
+            self.manifest.set_job('job', job)
+        elif existing != job:
+            raise ValueError("manifest {} was made for another job".format(self.manifest.path))
+
+    def _assets(self) -> Iterator[Tuple[str, str, Union[Asset, Exception]]]:
+        if self.stac_request is not None:
+            client = self.client
+            if client is None:
+                from nsl.stac.client import NSLClient
+                client = NSLClient()
+            stac_items = client.search(self.stac_request, auto_paginate=True, nsl_id=self.nsl_id,
+                                       profile_name=self.profile_name)
+        else:
+            stac_items = self.stac_items
+
+        for stac_item in stac_items:
+            if not isinstance(stac_item, StacItem):
+                stac_item = stac_item.stac_item
+            try:
+                selected = utils.get_assets(stac_item, **self.selectors)
+            except ValueError as e:
+                # the item has no asset with the selected asset_key
+                yield stac_item.id, self.selectors['asset_key'], e
+                continue
+            # get_assets doesn't return the keys of the assets
+            for asset_key in stac_item.assets:
+                if stac_item.assets[asset_key] in selected:
+                    yield stac_item.id, asset_key, stac_item.assets[asset_key]
+
+    def _submit(self, engine: DownloadEngine, stac_id: str, asset_key: str, asset: Asset) -> Tuple[Future, Any]:
+        save_filename = os.path.join(self.save_directory, os.path.basename(asset.object_path))
+        self.manifest.put(ManifestEntry(stac_id, asset_key, save_filename))
+        checksum = hashlib.md5()
+        # href downloads update the checksum as they're written, bucket downloads are read back once complete
+        future = engine.submit(asset, asset_key=asset_key, stac_id=stac_id, save_filename=save_filename,
+                               from_bucket=self.from_bucket, nsl_id=self.nsl_id, profile_name=self.profile_name,
+                               checksum=None if self.from_bucket else checksum)
+        return future, checksum
+
+    def _record(self, result: DownloadResult, checksum) -> str:
+        if result.ok:
+            md5 = utils._file_digest(result.save_filename, checksum) if self.from_bucket else checksum.hexdigest()
+            entry = ManifestEntry(result.stac_id, result.asset_key, result.save_filename, status=DONE,
+                                  size=os.path.getsize(result.save_filename), md5=md5,
+                                  mtime=os.path.getmtime(result.save_filename))
+        else:
+            entry = ManifestEntry(result.stac_id, result.asset_key,
+                                  os.path.join(self.save_directory, os.path.basename(result.asset.object_path)),
+                                  status=FAILED, error=repr(result.error))
+        self.manifest.put(entry)
+        return entry.status
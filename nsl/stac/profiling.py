@@ -0,0 +1,213 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+"""
+Opt-in cProfile hooks around the NSLClient public methods and the utils download functions.
+
+Profiling is off unless the NSL_PROFILE_DIR environment variable is set or a client is constructed with
+`NSLClient(profile_dir=...)`. Nothing is wrapped while it's off, so there is no per call overhead.
+
+With the default mode, 'call', every outermost profiled call writes `<name>.<pid>.<n>.prof` to the directory. With mode
+'aggregate' (NSL_PROFILE_MODE=aggregate) the stats of every call are summed per name and written to `<name>.prof` when
+`dump` is called and at exit. Either can be read with `python -m pstats` or snakeviz.
+"""
+
+import atexit
+import cProfile
+import functools
+import inspect
+import itertools
+import os
+import pstats
+import threading
+
+from typing import Callable, Dict, Optional
+
+__all__ = ['PROFILE_DIR', 'PROFILE_MODE', 'Profiler', 'get_profiler', 'profile_client', 'profile_downloads', 'reset']
+
+PROFILE_DIR = os.getenv('NSL_PROFILE_DIR')
+PROFILE_MODE = os.getenv('NSL_PROFILE_MODE', 'call')
+PROFILE_MODES = ('call', 'aggregate')
+DOWNLOAD_FUNCTIONS = ('download_gcs_object', 'download_s3_object', 'download_href_object',
+                      'download_asset', 'download_assets')
+
+
+class Profiler:
+    def __init__(self, directory: str, mode: str = 'call'):
+        """
+        Profiles wrapped functions to a directory
+        :param directory: directory the .prof files are written to. created if it doesn't exist
+        :param mode: 'call' writes one file per outermost call, 'aggregate' sums the stats of every call per name
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError("profile mode must be one of {0}, not {1}".format(PROFILE_MODES, mode))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._aggregated: Dict[str, pstats.Stats] = {}
+        self._local = threading.local()
+        if mode == 'aggregate':
+            atexit.register(self.dump)
+
+    def wrap(self, func: Callable, name: str) -> Callable:
+        """
+        wrap func so that each outermost call of it is profiled. calls made while another profiled call is running on
+        the same thread (e.g. download_asset calling download_href_object) are part of the outer call's profile.
+        generators are profiled across every step of their iteration.
+        :param func: function or bound method to wrap
+        :param name: name the profile is recorded under, e.g. 'NSLClient.search'
+        :return: wrapped function
+        """
+        if getattr(func, '_nsl_profiled', False):
+            return func
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self._profile_generator(func(*args, **kwargs), name)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                profile = self._start()
+                if profile is None:
+                    return func(*args, **kwargs)
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    self._stop(profile)
+                if inspect.isgenerator(result):
+                    return self._profile_generator(result, name, profile)
+                self._record(profile, name)
+                return result
+
+        wrapper._nsl_profiled = True
+        return wrapper
+
+    def dump(self):
+        """write the aggregated stats, one file per name. does nothing in 'call' mode"""
+        with self._lock:
+            for name, stats in self._aggregated.items():
+                stats.dump_stats(os.path.join(self.directory, "{}.prof".format(name)))
+
+    def _profile_generator(self, generator, name: str, profile: Optional[cProfile.Profile] = None):
+        try:
+            while True:
+                started = self._start(profile)
+                try:
+                    value = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    if started is not None:
+                        profile = started
+                        self._stop(profile)
+                yield value
+        finally:
+            generator.close()
+            if profile is not None:
+                self._record(profile, name)
+
+    def _start(self, profile: Optional[cProfile.Profile] = None) -> Optional[cProfile.Profile]:
+        if getattr(self._local, 'active', False):
+            return None
+        profile = cProfile.Profile() if profile is None else profile
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active (python 3.12+ only allows one at a time), run unprofiled
+            return None
+        self._local.active = True
+        return profile
+
+    def _stop(self, profile: cProfile.Profile):
+        profile.disable()
+        self._local.active = False
+
+    def _record(self, profile: cProfile.Profile, name: str):
+        if self.mode == 'call':
+            profile.dump_stats(os.path.join(self.directory,
+                                            "{0}.{1}.{2}.prof".format(name, os.getpid(), next(self._counter))))
+            return
+
+        with self._lock:
+            if name in self._aggregated:
+                self._aggregated[name].add(profile)
+            else:
+                self._aggregated[name] = pstats.Stats(profile)
+
+
+_profilers: Dict[str, Profiler] = {}
+_profilers_lock = threading.Lock()
+
+
+def get_profiler(directory: str = None, mode: str = None) -> Profiler:
+    """
+    get the profiler for a directory, creating it and wrapping the utils download functions the first time
+    :param directory: defaults to the NSL_PROFILE_DIR environment variable
+    :param mode: defaults to the NSL_PROFILE_MODE environment variable, or 'call'
+    :return: Profiler
+    """
+    directory = directory if directory is not None else PROFILE_DIR
+    if not directory:
+        raise ValueError("a profile directory must be supplied or set with the NSL_PROFILE_DIR environment variable")
+
+    with _profilers_lock:
+        directory = os.path.abspath(directory)
+        if directory not in _profilers:
+            _profilers[directory] = Profiler(directory, mode=mode if mode is not None else PROFILE_MODE)
+            profile_downloads(_profilers[directory])
+        return _profilers[directory]
+
+
+def profile_downloads(profiler: Profiler):
+    """
+    replace the utils download functions with profiled versions. the first profiler to do so is the one used.
+    code that imported a download function by name before this was called keeps the unprofiled function
+    :param profiler:
+    """
+    from nsl.stac import utils
+
+    for func_name in DOWNLOAD_FUNCTIONS:
+        setattr(utils, func_name, profiler.wrap(getattr(utils, func_name), "utils.{}".format(func_name)))
+
+
+def profile_client(client, profiler: Profiler):
+    """
+    wrap the public methods of one client instance. other instances, and the class itself, are untouched
+    :param client: NSLClient or subclass instance
+    :param profiler:
+    """
+    class_name = type(client).__name__
+    for attr_name, attr in inspect.getmembers(type(client)):
+        if attr_name.startswith('_') or isinstance(attr, property) or not callable(attr):
+            continue
+        setattr(client, attr_name, profiler.wrap(getattr(client, attr_name), "{0}.{1}".format(class_name, attr_name)))
+
+
+def reset():
+    """restore the unprofiled utils download functions and forget every profiler. wrapped clients stay wrapped"""
+    from nsl.stac import utils
+
+    with _profilers_lock:
+        for func_name in DOWNLOAD_FUNCTIONS:
+            func = getattr(utils, func_name)
+            if getattr(func, '_nsl_profiled', False):
+                setattr(utils, func_name, func.__wrapped__)
+        for profiler in _profilers.values():
+            atexit.unregister(profiler.dump)
+        _profilers.clear()
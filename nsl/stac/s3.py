@@ -0,0 +1,158 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, IO, Optional, Set
+
+import boto3
+import botocore.config
+import botocore.exceptions
+from boto3.s3.transfer import TransferConfig
+
+__all__ = ['S3Transfer', 'S3TransferEngine', 's3_transfer_engine']
+
+MB = 1024 * 1024
+# objects at least this big are downloaded in parts of MULTIPART_CHUNKSIZE, MAX_CONCURRENCY parts at a time
+MULTIPART_THRESHOLD = int(os.getenv('NSL_S3_MULTIPART_THRESHOLD', 8 * MB))
+MULTIPART_CHUNKSIZE = int(os.getenv('NSL_S3_MULTIPART_CHUNKSIZE', 8 * MB))
+MAX_CONCURRENCY = int(os.getenv('NSL_S3_MAX_CONCURRENCY', 10))
+# http connections kept by the shared client, across every concurrent transfer
+MAX_POOL_CONNECTIONS = int(os.getenv('NSL_S3_MAX_POOL_CONNECTIONS', 50))
+
+
+class S3Transfer:
+    def __init__(self, bucket: str, key: str, size: int = 0, seconds: float = 0.0):
+        """record of one completed transfer"""
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.seconds = seconds
+
+    @property
+    def throughput(self) -> float:
+        """bytes per second"""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return "<S3Transfer s3://{0}/{1} {2} bytes in {3:.3f}s, {4:.1f} MB/s>"\
+            .format(self.bucket, self.key, self.size, self.seconds, self.throughput / MB)
+
+
+class S3TransferEngine:
+    def __init__(self,
+                 config: TransferConfig = None,
+                 max_pool_connections: int = MAX_POOL_CONNECTIONS,
+                 session: boto3.session.Session = None):
+        """
+        Thread safe S3 client shared by every download, so that credentials are resolved and connections are opened
+        once rather than per call.
+        :param config: multipart threshold, chunk size and concurrency of downloads. defaults to the NSL_S3_*
+        environment variables
+        :param max_pool_connections: http connections kept by the client
+        :param session: defaults to a new session with the default credential chain
+        """
+        if config is None:
+            config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                                    multipart_chunksize=MULTIPART_CHUNKSIZE,
+                                    max_concurrency=MAX_CONCURRENCY)
+        self.config = config
+        self.max_pool_connections = max_pool_connections
+        # called with the S3Transfer of every completed download
+        self.on_transfer: Optional[Callable[[S3Transfer], Any]] = None
+        self._session = session
+        self._client = None
+        self._lock = threading.Lock()
+        self._requester_pays_buckets: Set[str] = set()
+
+    @property
+    def client(self):
+        """the shared boto3 s3 client. boto3 clients, unlike sessions, are safe to share between threads"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    session = self._session if self._session is not None else boto3.session.Session()
+                    self._client = session.client(
+                        's3', config=botocore.config.Config(max_pool_connections=self.max_pool_connections))
+        return self._client
+
+    def set_requester_pays(self, bucket: str, requester_pays: bool = True):
+        """
+        authorize (or stop authorizing) requester pays requests for every transfer from a bucket, so callers don't
+        have to pass requester_pays each time. this can be costly, so only enable it if you understand the implications
+        """
+        with self._lock:
+            if requester_pays:
+                self._requester_pays_buckets.add(bucket)
+            else:
+                self._requester_pays_buckets.discard(bucket)
+
+    def extra_args(self, bucket: str, requester_pays: bool = False) -> Dict[str, str]:
+        """the request arguments for a bucket: RequestPayer if requester_pays or if set_requester_pays was called"""
+        if requester_pays or bucket in self._requester_pays_buckets:
+            return {'RequestPayer': 'requester'}
+        return {}
+
+    def head(self, bucket: str, key: str, requester_pays: bool = False) -> Optional[dict]:
+        """
+        head_object
+        :return: the head_object response, or None if the object doesn't exist
+        """
+        try:
+            return self.client.head_object(Bucket=bucket, Key=key, **self.extra_args(bucket, requester_pays))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ("404", "NoSuchKey"):
+                return None
+            raise
+
+    def download(self,
+                 bucket: str,
+                 key: str,
+                 file_obj: IO[bytes] = None,
+                 save_filename: str = "",
+                 requester_pays: bool = False) -> S3Transfer:
+        """
+        download an object with the engine's TransferConfig, into file_obj if set, otherwise to save_filename
+        :return: S3Transfer with the size and duration of the download
+        """
+        transfer = S3Transfer(bucket, key)
+        lock = threading.Lock()
+
+        def callback(size: int):
+            # called from the transfer's worker threads
+            with lock:
+                transfer.size += size
+
+        extra_args = self.extra_args(bucket, requester_pays) or None
+        start = time.perf_counter()
+        if file_obj is not None:
+            self.client.download_fileobj(Bucket=bucket, Key=key, Fileobj=file_obj, ExtraArgs=extra_args,
+                                         Callback=callback, Config=self.config)
+        elif len(save_filename) > 0:
+            self.client.download_file(Bucket=bucket, Key=key, Filename=save_filename, ExtraArgs=extra_args,
+                                      Callback=callback, Config=self.config)
+        else:
+            raise ValueError("must provide filename or file_obj")
+        transfer.seconds = time.perf_counter() - start
+
+        if self.on_transfer is not None:
+            self.on_transfer(transfer)
+        return transfer
+
+
+s3_transfer_engine = S3TransferEngine()
@@ -0,0 +1,415 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import heapq
+import io
+import itertools
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from nsl.stac import Asset, utils
+from nsl.stac.enum import CloudPlatform
+from nsl.stac.transfer import DEFAULT_MAX_PER_HOST, DEFAULT_MAX_WORKERS, DownloadEngine, DownloadResult, _loaded
+
+__all__ = ['ClassStats', 'DownloadScheduler', 'TokenBucket', 'DEFAULT_CLASSES']
+
+# priority classes, most urgent first
+DEFAULT_CLASSES = ('interactive', 'default', 'backfill')
+# seconds of transferred bytes that ClassStats.throughput is averaged over
+THROUGHPUT_WINDOW = 5.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = None):
+        """
+        Thread safe token bucket of bytes: tokens accrue at rate per second, up to burst. A consumer that takes more
+        than there are leaves the bucket in debt, which later consumers wait out, so chunks of any size are allowed and
+        the average rate holds.
+        :param rate: bytes per second
+        :param burst: the most bytes that accrue while the bucket is unused. defaults to one second of rate
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        # priority -> number of consumers waiting with it
+        self._waiting: Dict[int, int] = {}
+        self._condition = threading.Condition()
+
+    def consume(self, size: int, priority: int = 0):
+        """
+        wait until size bytes may be transferred. a consumer waits while one with a more urgent (lower) priority is
+        waiting, so urgent transfers get the bandwidth first
+        """
+        with self._condition:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    self._refill()
+                    urgent = any(count for waiting, count in self._waiting.items() if waiting < priority)
+                    if self._tokens > 0 and not urgent:
+                        self._tokens -= size
+                        return
+                    # until the debt is paid, or until the urgent consumers take their share
+                    self._condition.wait(max(-self._tokens / self.rate, 0.01))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class ClassStats:
+    def __init__(self, name: str):
+        """queue depth and throughput of one priority class of a DownloadScheduler"""
+        self.name = name
+        # downloads waiting for a worker
+        self.queued = 0
+        # downloads in progress
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        # (time, bytes) of the chunks transferred in the last THROUGHPUT_WINDOW seconds
+        self._recent = deque()
+
+    @property
+    def throughput(self) -> float:
+        """bytes per second transferred over the last THROUGHPUT_WINDOW seconds"""
+        since = time.monotonic() - THROUGHPUT_WINDOW
+        return sum(size for at, size in list(self._recent) if at >= since) / THROUGHPUT_WINDOW
+
+    def _add(self, size: int):
+        now = time.monotonic()
+        self.bytes += size
+        self._recent.append((now, size))
+        self._expire(now)
+
+    def _expire(self, now: float):
+        while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+            self._recent.popleft()
+
+    def __repr__(self):
+        return "<ClassStats {0} queued={1} active={2} completed={3} failed={4} {5:.1f} MB/s>"\
+            .format(self.name, self.queued, self.active, self.completed, self.failed, self.throughput / 1024 / 1024)
+
+
+class DownloadScheduler(DownloadEngine):
+    def __init__(self,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 max_bytes_per_second: float = None,
+                 max_host_bytes_per_second: float = None,
+                 classes: Tuple[str, ...] = DEFAULT_CLASSES):
+        """
+        A DownloadEngine whose queued downloads run in order of priority class, so that interactive downloads skip
+        ahead of a backfill, with optional caps on the bandwidth of all downloads and of the downloads from one host.
+        Queued downloads of the same class run in the order they were submitted. A class's downloads also get the
+        capped bandwidth ahead of less urgent ones. The caps default to the NSL_MAX_BYTES_PER_SECOND and
+        NSL_MAX_HOST_BYTES_PER_SECOND environment variables, if set.
+        :param max_workers: number of simultaneous downloads
+        :param max_per_host: number of simultaneous downloads from one host
+        :param max_bytes_per_second: bandwidth of all downloads. None for no cap
+        :param max_host_bytes_per_second: bandwidth of the downloads from one host (href host or bucket). None for no
+        cap
+        :param classes: names of the priority classes, most urgent first
+        """
+        super().__init__(max_workers=max_workers, max_per_host=max_per_host)
+        if max_bytes_per_second is None and os.getenv('NSL_MAX_BYTES_PER_SECOND'):
+            max_bytes_per_second = float(os.getenv('NSL_MAX_BYTES_PER_SECOND'))
+        if max_host_bytes_per_second is None and os.getenv('NSL_MAX_HOST_BYTES_PER_SECOND'):
+            max_host_bytes_per_second = float(os.getenv('NSL_MAX_HOST_BYTES_PER_SECOND'))
+        self.classes = tuple(classes)
+        self.max_host_bytes_per_second = max_host_bytes_per_second
+        self._bucket = TokenBucket(max_bytes_per_second) if max_bytes_per_second else None
+        self._host_buckets: Dict[str, TokenBucket] = {}
+        # the scheduler's workers take downloads in order of priority. a download whose host has no free slot is
+        # parked, in order of priority, until one of the host's downloads finishes, rather than holding the worker
+        self._parked: Dict[str, List[tuple]] = {}
+        self._stats = {name: ClassStats(name) for name in self.classes}
+        self._stats_lock = threading.Lock()
+        self._queue = queue.PriorityQueue()
+        # submission order within a class
+        self._sequence = itertools.count()
+        self._workers = [threading.Thread(target=self._work, name='nsl-scheduled-download-{}'.format(i), daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def close(self, wait_for_downloads: bool = True):
+        if not wait_for_downloads:
+            # drop the queued downloads
+            while True:
+                try:
+                    _, _, item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+                    self._update(item[1], queued=-1)
+            with self._hosts_lock:
+                for parked in self._parked.values():
+                    for _, _, item in parked:
+                        item[0].cancel()
+                        self._update(item[1], queued=-1)
+                self._parked.clear()
+        for _ in self._workers:
+            # sorts after every download
+            self._queue.put((len(self.classes), next(self._sequence), None))
+        if wait_for_downloads:
+            for worker in self._workers:
+                worker.join()
+        super().close(wait_for_downloads=wait_for_downloads)
+
+    def submit(self, asset, asset_key: str = "", stac_id: str = "", priority: str = None,
+               **download_kwargs) -> Future:
+        """
+        queue one asset for download
+        :param asset: an Asset or an AssetWrap
+        :param asset_key: recorded in the result
+        :param stac_id: recorded in the result
+        :param priority: the name of a priority class. defaults to 'default', or the middle class
+        :param download_kwargs: as in DownloadEngine.submit. resumable doesn't apply to GCS and S3 downloads, whose
+        bytes are counted through a file object, and raises ValueError
+        :return: Future whose result is a DownloadResult. the future itself never raises the download's exception
+        """
+        if download_kwargs.get('resumable') and download_kwargs.get('from_bucket') and \
+                getattr(asset, 'cloud_platform', None) in (CloudPlatform.GCP, CloudPlatform.AWS):
+            raise ValueError("resumable GCS and S3 downloads can't be throttled by the scheduler")
+        if priority is None:
+            priority = 'default' if 'default' in self.classes else self.classes[len(self.classes) // 2]
+        if priority not in self.classes:
+            raise ValueError("unknown priority class {0}, must be one of {1}".format(priority, self.classes))
+        if not isinstance(asset, Asset):
+            # an AssetWrap's download doesn't take progress
+            asset = asset.asset
+
+        future = Future()
+        self._update(priority, queued=1)
+        self._queue.put((self.classes.index(priority), next(self._sequence),
+                         (future, priority, asset, asset_key, stac_id, download_kwargs)))
+        return future
+
+    def load_thumbnails(self,
+                        stac_items: Iterable,
+                        as_array: bool = False,
+                        from_bucket: bool = False,
+                        nsl_id: str = None,
+                        profile_name: str = None,
+                        max_pending: int = None,
+                        priority: str = None) -> Iterator[DownloadResult]:
+        """
+        as DownloadEngine.load_thumbnails, with the thumbnails queued like any other download
+        :param priority: the name of a priority class. see submit
+        """
+        return self._load_thumbnails(stac_items, as_array, dict(from_bucket=from_bucket, nsl_id=nsl_id,
+                                                                profile_name=profile_name, priority=priority),
+                                     max_pending)
+
+    def _submit_load(self, asset: Asset, asset_key: str, stac_id: str, as_array: bool,
+                     download_kwargs: dict) -> Future:
+        buffer = io.BytesIO()
+        future = self.submit(asset, asset_key=asset_key, stac_id=stac_id, file_obj=buffer, **download_kwargs)
+        loaded = Future()
+
+        def done(_):
+            if future.cancelled():
+                loaded.cancel()
+            elif future.exception() is not None:
+                loaded.set_exception(future.exception())
+            else:
+                loaded.set_result(_loaded(future.result(), buffer, as_array))
+
+        future.add_done_callback(done)
+        return loaded
+
+    def stats(self) -> Dict[str, ClassStats]:
+        """queue depth and throughput of each priority class, by name"""
+        return self._stats
+
+    def _update(self, priority: str, **changes):
+        stats = self._stats[priority]
+        with self._stats_lock:
+            for name, change in changes.items():
+                setattr(stats, name, getattr(stats, name) + change)
+
+    def _work(self):
+        while True:
+            entry = self._queue.get()
+            item = entry[2]
+            if item is None:
+                return
+            future, priority, asset, asset_key, stac_id, download_kwargs = item
+            if future.cancelled():
+                self._update(priority, queued=-1)
+                continue
+            host = self._host(asset, download_kwargs.get('from_bucket', False))
+            with self._hosts_lock:
+                if self._host_active.get(host, 0) >= self.max_per_host:
+                    heapq.heappush(self._parked.setdefault(host, []), entry)
+                    continue
+                self._host_active[host] = self._host_active.get(host, 0) + 1
+            try:
+                self._run(future, priority, asset, asset_key, stac_id, download_kwargs)
+            finally:
+                with self._hosts_lock:
+                    self._host_active[host] -= 1
+                    parked = self._parked.get(host)
+                    if parked:
+                        # back in the queue, where it's taken in order of priority again
+                        self._queue.put(heapq.heappop(parked))
+                        if not parked:
+                            del self._parked[host]
+
+    def _run(self, future: Future, priority: str, asset: Asset, asset_key: str, stac_id: str, download_kwargs: dict):
+        self._update(priority, queued=-1)
+        if not future.set_running_or_notify_cancel():
+            return
+        self._update(priority, active=1)
+        try:
+            result = self._throttled_download(asset, asset_key, stac_id, priority, download_kwargs)
+        except BaseException as e:
+            self._update(priority, active=-1, failed=1)
+            future.set_exception(e)
+            return
+        self._update(priority, active=-1, **{'completed' if result.ok else 'failed': 1})
+        future.set_result(result)
+
+    def _throttled_download(self, asset: Asset, asset_key: str, stac_id: str, priority: str,
+                            download_kwargs: dict) -> DownloadResult:
+        """download with a hook that waits for bandwidth and counts the bytes of every chunk"""
+        buckets = [bucket for bucket in (self._bucket, self._host_bucket(asset, download_kwargs.get('from_bucket')))
+                   if bucket is not None]
+        rank = self.classes.index(priority)
+        stats = self._stats[priority]
+
+        def transferred(size: int):
+            with self._stats_lock:
+                stats._add(size)
+            for bucket in buckets:
+                bucket.consume(size, rank)
+
+        download_kwargs = dict(download_kwargs)
+        if not download_kwargs.get('from_bucket') or \
+                asset.cloud_platform not in (CloudPlatform.GCP, CloudPlatform.AWS):
+            progress = download_kwargs.get('progress')
+            last = [0]
+
+            def throttled_progress(written: int, total: Optional[int]):
+                # written restarts from 0 when a resumable download starts over
+                transferred(max(written - last[0], 0))
+                last[0] = written
+                if progress is not None:
+                    progress(written, total)
+
+            download_kwargs['progress'] = throttled_progress
+            return self._download(asset, asset_key, stac_id, download_kwargs)
+
+        # the GCS and S3 clients report no progress, so the bytes are counted as they're written instead. a file
+        # download is written through a file object, to a temporary file that replaces the file once complete
+        if download_kwargs.get('file_obj') is not None:
+            download_kwargs['file_obj'] = _ThrottledFile(download_kwargs['file_obj'], transferred)
+            return self._download(asset, asset_key, stac_id, download_kwargs)
+
+        try:
+            save_filename = self._save_filename(asset, download_kwargs)
+            skip_unchanged = download_kwargs.pop('skip_unchanged', False)
+            if skip_unchanged and self._unchanged(asset, save_filename, download_kwargs):
+                return DownloadResult(asset, asset_key=asset_key, stac_id=stac_id, save_filename=save_filename)
+        except Exception as e:
+            return DownloadResult(asset, asset_key=asset_key, stac_id=stac_id, error=e)
+        for name in ('save_filename', 'save_directory', 'resumable'):
+            download_kwargs.pop(name, None)
+
+        fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(save_filename)), suffix='.tmp')
+        os.close(fd)
+        try:
+            with open(temp_filename, 'wb') as f:
+                result = self._download(asset, asset_key, stac_id, dict(download_kwargs,
+                                                                        file_obj=_ThrottledFile(f, transferred)))
+            if result.ok:
+                os.replace(temp_filename, save_filename)
+                result.save_filename = save_filename
+            else:
+                result.save_filename = ""
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        return result
+
+    @staticmethod
+    def _unchanged(asset: Asset, save_filename: str, download_kwargs: dict) -> bool:
+        # skip_unchanged, as in utils.download_asset
+        if not os.path.exists(save_filename):
+            return False
+        size, md5, crc32c = utils.remote_checksums(asset, from_bucket=True,
+                                                   requester_pays=download_kwargs.get('requester_pays', False),
+                                                   nsl_id=download_kwargs.get('nsl_id'),
+                                                   profile_name=download_kwargs.get('profile_name'))
+        if not utils.file_matches(save_filename, size=size, md5=md5, crc32c=crc32c):
+            return False
+        if download_kwargs.get('checksum') is not None:
+            utils._file_digest(save_filename, download_kwargs['checksum'])
+        return True
+
+    def _host_bucket(self, asset: Asset, from_bucket: bool) -> Optional[TokenBucket]:
+        if not self.max_host_bytes_per_second:
+            return None
+        host = self._host(asset, from_bucket)
+        with self._stats_lock:
+            if host not in self._host_buckets:
+                self._host_buckets[host] = TokenBucket(self.max_host_bytes_per_second)
+            return self._host_buckets[host]
+
+    @staticmethod
+    def _save_filename(asset: Asset, download_kwargs: dict) -> str:
+        save_filename = download_kwargs.get('save_filename', "")
+        save_directory = download_kwargs.get('save_directory', "")
+        if len(save_filename) == 0 and len(save_directory) > 0:
+            if not os.path.exists(save_directory):
+                raise ValueError("directory 'save_directory' doesn't exist")
+            save_filename = os.path.join(save_directory, os.path.basename(asset.object_path))
+        if len(save_filename) == 0:
+            raise ValueError("must provide filename or file_obj")
+        return save_filename
+
+
+class _ThrottledFile:
+    def __init__(self, file_obj, transferred):
+        """file object whose writes are counted and throttled"""
+        self._file_obj = file_obj
+        self._transferred = transferred
+        if "name" in getattr(file_obj, '__dict__', {}):
+            self.name = file_obj.name
+
+    def write(self, data) -> int:
+        self._transferred(len(data))
+        return self._file_obj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file_obj, name)
@@ -0,0 +1,557 @@
+# Copyright 2019-20 Near Space Labs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# for additional information, contact:
+#   info@nearspacelabs.com
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from nsl.stac import Asset, StacItem, gcs_storage_client, utils
+from nsl.stac.connections import http_connection_pool
+from nsl.stac.enum import AssetType, CloudPlatform
+from nsl.stac.s3 import s3_transfer_engine
+
+__all__ = ['DownloadResult', 'DownloadEngine', 'download_many', 'download_segmented', 'load_thumbnails']
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_SEGMENT_WORKERS = 8
+
+
+class DownloadResult:
+    def __init__(self,
+                 asset,
+                 asset_key: str = "",
+                 stac_id: str = "",
+                 save_filename: str = "",
+                 error: Optional[BaseException] = None,
+                 seconds: float = 0.0,
+                 data=None):
+        """
+        the outcome of downloading one asset
+        :param asset: the Asset or AssetWrap that was downloaded
+        :param asset_key: key of the asset in its StacItem, if known
+        :param stac_id: id of the asset's StacItem, if known
+        :param save_filename: the filename returned by the download. empty for file objects that aren't files
+        :param error: the exception raised by the download, if it failed
+        :param seconds: time spent downloading, excluding time waiting for a worker or a host slot
+        :param data: the bytes, or decoded NumPy array, of a download into memory (see load_thumbnails)
+        """
+        self.asset = asset
+        self.asset_key = asset_key
+        self.stac_id = stac_id
+        self.save_filename = save_filename
+        self.error = error
+        self.seconds = seconds
+        self.data = data
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else "error: {!r}".format(self.error)
+        return "DownloadResult({0}, {1}, {2})".format(self.stac_id or getattr(self.asset, 'href', ''), self.asset_key,
+                                                      status)
+
+
+class DownloadEngine:
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_per_host: int = DEFAULT_MAX_PER_HOST):
+        """
+        Concurrent asset downloads with a bounded number of workers and of simultaneous downloads from any one host.
+        A download waits for a slot of its host before it's given to a worker, so downloads from a busy host never hold
+        workers that downloads from other hosts could use. Failed downloads don't stop the others, they're reported in
+        each DownloadResult.
+        :param max_workers: number of simultaneous downloads
+        :param max_per_host: number of simultaneous downloads from one host (the href host, or the bucket for
+        from_bucket downloads)
+        """
+        if max_workers < 1 or max_per_host < 1:
+            raise ValueError("max_workers and max_per_host must be at least 1")
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='nsl-download')
+        # host -> downloads running, and the downloads waiting for one of them to finish
+        self._host_active: Dict[str, int] = {}
+        self._host_waiting: Dict[str, deque] = {}
+        self._hosts_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self, wait_for_downloads: bool = True):
+        if not wait_for_downloads:
+            with self._hosts_lock:
+                for waiting in self._host_waiting.values():
+                    for future, _, _ in waiting:
+                        future.cancel()
+        self._executor.shutdown(wait=wait_for_downloads)
+
+    def submit(self, asset, asset_key: str = "", stac_id: str = "", **download_kwargs) -> Future:
+        """
+        queue one asset for download
+        :param asset: an Asset (downloaded with utils.download_asset) or an AssetWrap (with AssetWrap.download)
+        :param asset_key: recorded in the result
+        :param stac_id: recorded in the result
+        :param download_kwargs: from_bucket, file_obj, save_filename, save_directory, requester_pays, nsl_id,
+        profile_name, skip_unchanged. as in utils.download_asset
+        :return: Future whose result is a DownloadResult. the future itself never raises the download's exception
+        """
+        return self._submit_to_host(self._host(asset, download_kwargs.get('from_bucket', False)),
+                                    self._download, asset, asset_key, stac_id, download_kwargs)
+
+    def download(self, assets: Iterable, **download_kwargs) -> List[DownloadResult]:
+        """
+        download assets concurrently
+        :param assets: Assets and/or AssetWraps
+        :param download_kwargs: as in `submit`. a shared file_obj or save_filename makes no sense here, use
+        save_directory
+        :return: a DownloadResult per asset, in the order of assets
+        """
+        futures = [self.submit(asset, **download_kwargs) for asset in assets]
+        return [future.result() for future in futures]
+
+    def download_assets(self,
+                        stac_item: StacItem,
+                        save_directory: str,
+                        asset_type: AssetType = None,
+                        from_bucket: bool = False,
+                        nsl_id: str = None,
+                        profile_name: str = None,
+                        skip_unchanged: bool = False) -> List[DownloadResult]:
+        """
+        download the assets of a StacItem concurrently. the concurrent version of utils.download_assets
+        :param stac_item: StacItem or StacItemWrap
+        :param save_directory: the directory where the files should be downloaded
+        :param asset_type: only download assets of this type. defaults to all assets
+        :param from_bucket: force download from bucket. if set to false downloads happen from href
+        :param nsl_id: ADVANCED ONLY. see utils.download_asset
+        :param profile_name: ADVANCED ONLY. see utils.download_asset
+        :param skip_unchanged: don't download files that match the remote checksums. see utils.download_asset
+        :return: a DownloadResult per asset
+        """
+        futures = self._submit_item(stac_item, asset_type, save_directory=save_directory, from_bucket=from_bucket,
+                                    nsl_id=nsl_id, profile_name=profile_name, skip_unchanged=skip_unchanged)
+        return [future.result() for future in futures]
+
+    def download_items(self,
+                       stac_items: Iterable,
+                       save_directory: str,
+                       asset_type: AssetType = None,
+                       from_bucket: bool = False,
+                       nsl_id: str = None,
+                       profile_name: str = None,
+                       skip_unchanged: bool = False) -> Iterator[DownloadResult]:
+        """
+        download the assets of many StacItems concurrently. stac_items can be a search result stream, it's consumed
+        only as fast as downloads complete so that a long search doesn't queue every item up front.
+        :param stac_items: StacItems and/or StacItemWraps
+        :param save_directory: the directory where the files should be downloaded
+        :param asset_type: only download assets of this type, e.g. AssetType.GEOTIFF. defaults to all assets
+        :param from_bucket: force download from bucket. if set to false downloads happen from href
+        :param nsl_id: ADVANCED ONLY. see utils.download_asset
+        :param profile_name: ADVANCED ONLY. see utils.download_asset
+        :param skip_unchanged: don't download files that match the remote checksums, so that a rerun of an interrupted
+        job only downloads what's missing or changed. see utils.download_asset
+        :return: DownloadResults, in the order downloads complete
+        """
+        max_pending = self.max_workers * 2
+        pending = set()
+        stac_items = iter(stac_items)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                stac_item = next(stac_items, None)
+                if stac_item is None:
+                    exhausted = True
+                else:
+                    pending.update(self._submit_item(stac_item, asset_type, save_directory=save_directory,
+                                                     from_bucket=from_bucket, nsl_id=nsl_id,
+                                                     profile_name=profile_name, skip_unchanged=skip_unchanged))
+            if not pending:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def load_thumbnails(self,
+                        stac_items: Iterable,
+                        as_array: bool = False,
+                        from_bucket: bool = False,
+                        nsl_id: str = None,
+                        profile_name: str = None,
+                        max_pending: int = None) -> Iterator[DownloadResult]:
+        """
+        download the THUMBNAIL asset of many StacItems concurrently into memory, with no temporary files. stac_items can
+        be a search result stream, it's consumed only as fast as results are read
+        :param stac_items: StacItems and/or StacItemWraps
+        :param as_array: decode each thumbnail into a NumPy array (rows, columns, bands). needs Pillow and NumPy
+        :param from_bucket: download from the bucket instead of the href
+        :param nsl_id: ADVANCED ONLY. see utils.download_asset
+        :param profile_name: ADVANCED ONLY. see utils.download_asset
+        :param max_pending: thumbnails downloading or downloaded but not yet read at most. defaults to twice max_workers
+        :return: a DownloadResult per item, in the order of stac_items, with the thumbnail in `data`. an item without a
+        thumbnail has a ValueError in `error`
+        """
+        return self._load_thumbnails(stac_items, as_array,
+                                     dict(from_bucket=from_bucket, nsl_id=nsl_id, profile_name=profile_name),
+                                     max_pending)
+
+    def _load_thumbnails(self, stac_items: Iterable, as_array: bool, download_kwargs: dict,
+                         max_pending: Optional[int]) -> Iterator[DownloadResult]:
+        max_pending = self.max_workers * 2 if max_pending is None else max_pending
+        pending = deque()
+        for stac_item in stac_items:
+            pending.append(self._submit_thumbnail(stac_item, as_array, download_kwargs))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _submit_thumbnail(self, stac_item, as_array: bool, download_kwargs: dict) -> Future:
+        if not isinstance(stac_item, StacItem):
+            stac_item = stac_item.stac_item
+        asset_keys = [asset_key for asset_key in stac_item.assets
+                      if stac_item.assets[asset_key].asset_type == AssetType.THUMBNAIL]
+        if not download_kwargs['from_bucket']:
+            asset_keys = [asset_key for asset_key in asset_keys if stac_item.assets[asset_key].href]
+        if not asset_keys:
+            future = Future()
+            future.set_result(DownloadResult(None, stac_id=stac_item.id,
+                                             error=ValueError("no thumbnail asset for {}".format(stac_item.id))))
+            return future
+
+        return self._submit_load(stac_item.assets[asset_keys[0]], asset_keys[0], stac_item.id, as_array,
+                                 download_kwargs)
+
+    def _submit_load(self, asset: Asset, asset_key: str, stac_id: str, as_array: bool,
+                     download_kwargs: dict) -> Future:
+        # download an asset into memory
+        return self._submit_to_host(self._host(asset, download_kwargs['from_bucket']), self._load_thumbnail,
+                                    asset, asset_key, stac_id, as_array, download_kwargs)
+
+    def _load_thumbnail(self, asset: Asset, asset_key: str, stac_id: str, as_array: bool,
+                        download_kwargs: dict) -> DownloadResult:
+        buffer = io.BytesIO()
+        return _loaded(self._download(asset, asset_key, stac_id, dict(download_kwargs, file_obj=buffer)), buffer,
+                       as_array)
+
+    def _submit_item(self, stac_item, asset_type: Optional[AssetType], **download_kwargs) -> List[Future]:
+        if isinstance(stac_item, StacItem):
+            keyed_assets = [(asset_key, stac_item.assets[asset_key]) for asset_key in stac_item.assets]
+        else:
+            keyed_assets = [(asset_wrap.asset_key, asset_wrap) for asset_wrap in stac_item.get_assets()]
+
+        return [self.submit(asset, asset_key=asset_key, stac_id=stac_item.id, **download_kwargs)
+                for asset_key, asset in keyed_assets
+                if asset_type is None or utils._asset_types_match(asset_type, asset.asset_type)]
+
+    @staticmethod
+    def _host(asset, from_bucket: bool) -> str:
+        if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+            return "gs://{}".format(asset.bucket)
+        elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+            return "s3://{}".format(asset.bucket)
+        return urlparse(asset.href).netloc
+
+    def _submit_to_host(self, host: str, fn: Callable, *args) -> Future:
+        # given to a worker straight away if the host has a free slot, otherwise queued until one of its downloads
+        # finishes
+        future = Future()
+        with self._hosts_lock:
+            if self._host_active.get(host, 0) < self.max_per_host:
+                self._host_active[host] = self._host_active.get(host, 0) + 1
+            else:
+                self._host_waiting.setdefault(host, deque()).append((future, fn, args))
+                return future
+        self._executor.submit(self._run_host, host, future, fn, args)
+        return future
+
+    def _run_host(self, host: str, future: Future, fn: Callable, args: Tuple):
+        # the worker keeps the host's slot for the host's next waiting download, if any, rather than submitting it
+        # again, which an executor that's shutting down would refuse
+        while True:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._hosts_lock:
+                waiting = self._host_waiting.get(host)
+                if not waiting:
+                    self._host_active[host] -= 1
+                    self._host_waiting.pop(host, None)
+                    return
+                future, fn, args = waiting.popleft()
+
+    def _download(self, asset, asset_key: str, stac_id: str, download_kwargs: dict) -> DownloadResult:
+        result = DownloadResult(asset, asset_key=asset_key, stac_id=stac_id)
+        start = time.perf_counter()
+        try:
+            if isinstance(asset, Asset):
+                result.save_filename = utils.download_asset(asset=asset, **download_kwargs)
+            else:
+                result.save_filename = asset.download(**download_kwargs)
+        except Exception as e:
+            result.error = e
+        finally:
+            result.seconds = time.perf_counter() - start
+        return result
+
+
+def download_many(assets: Iterable,
+                  save_directory: str,
+                  max_workers: int = DEFAULT_MAX_WORKERS,
+                  max_per_host: int = DEFAULT_MAX_PER_HOST,
+                  **download_kwargs) -> List[DownloadResult]:
+    """
+    download assets concurrently into a directory with a short-lived DownloadEngine
+    :param assets: Assets and/or AssetWraps
+    :param save_directory: the directory where the files should be downloaded
+    :param max_workers: number of simultaneous downloads
+    :param max_per_host: number of simultaneous downloads from one host
+    :param download_kwargs: from_bucket, requester_pays, nsl_id, profile_name. as in utils.download_asset
+    :return: a DownloadResult per asset, in the order of assets
+    """
+    with DownloadEngine(max_workers=max_workers, max_per_host=max_per_host) as engine:
+        return engine.download(assets, save_directory=save_directory, **download_kwargs)
+
+
+def load_thumbnails(stac_items: Iterable,
+                    as_array: bool = False,
+                    max_workers: int = DEFAULT_MAX_WORKERS,
+                    max_per_host: int = DEFAULT_MAX_PER_HOST,
+                    **load_kwargs) -> Iterator[DownloadResult]:
+    """
+    download the thumbnails of many StacItems concurrently into memory. see DownloadEngine.load_thumbnails
+    :param stac_items: StacItems and/or StacItemWraps
+    :param as_array: decode each thumbnail into a NumPy array
+    :param max_workers: number of simultaneous downloads
+    :param max_per_host: number of simultaneous downloads from one host
+    :param load_kwargs: from_bucket, nsl_id, profile_name, max_pending. as in DownloadEngine.load_thumbnails
+    :return: a DownloadResult per item, in the order of stac_items, with the thumbnail in `data`
+    """
+    with DownloadEngine(max_workers=max_workers, max_per_host=max_per_host) as engine:
+        yield from engine.load_thumbnails(stac_items, as_array=as_array, **load_kwargs)
+
+
+def _loaded(result: DownloadResult, buffer: io.BytesIO, as_array: bool) -> DownloadResult:
+    # set the data of a download into memory
+    if result.ok:
+        try:
+            result.data = _decode_image(buffer.getvalue()) if as_array else buffer.getvalue()
+        except Exception as e:
+            result.error = e
+    return result
+
+
+def _decode_image(data: bytes):
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        raise ImportError("decoding thumbnails needs NumPy and Pillow (pip install numpy Pillow)")
+
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image)
+
+
+def download_segmented(asset: Asset,
+                       save_filename: str = "",
+                       save_directory: str = "",
+                       from_bucket: bool = False,
+                       segment_size: int = DEFAULT_SEGMENT_SIZE,
+                       max_workers: int = DEFAULT_SEGMENT_WORKERS,
+                       requester_pays: bool = False,
+                       nsl_id: str = None,
+                       profile_name: str = None,
+                       verify: bool = True) -> str:
+    """
+    download one large asset as byte ranges fetched in parallel, each written at its offset into a preallocated
+    save_filename + '.part' that is renamed to save_filename once every range is complete. a failed range is retried on
+    its own. an href server that ignores Range requests gets a single stream instead. an empty asset is an empty file
+    :param asset: The asset to download
+    :param save_filename: absolute or relative path filename to save asset to
+    :param save_directory: directory to save asset in, if save_filename isn't set. filename is the basename of the
+    object_path
+    :param from_bucket: download from the asset's GCS or S3 bucket instead of its href
+    :param segment_size: bytes per range
+    :param max_workers: ranges fetched at once
+    :param requester_pays: authorize a requester pays download from S3
+    :param nsl_id: ADVANCED ONLY. see utils.download_asset
+    :param profile_name: ADVANCED ONLY. see utils.download_asset
+    :param verify: check the complete file against the md5 (or crc32c) reported by the storage, if any. the ranges
+    arrive out of order, so the file is read once more. a mismatch deletes it and raises utils.ChecksumError
+    :return: save_filename. ValueError if the asset doesn't exist
+    """
+    if segment_size < 1 or max_workers < 1:
+        raise ValueError("segment_size and max_workers must be at least 1")
+    if len(save_filename) == 0:
+        if len(save_directory) == 0 or not os.path.exists(save_directory):
+            raise ValueError("must provide save_filename or an existing save_directory")
+        save_filename = os.path.join(save_directory, os.path.basename(asset.object_path))
+
+    part_filename = save_filename + ".part"
+    if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+        size, fetch_range, retry_errors, checksums = _gcs_ranges(asset)
+    elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+        size, fetch_range, retry_errors, checksums = _s3_ranges(asset, requester_pays)
+    else:
+        size, fetch_range, retry_errors, checksums = _href_ranges(asset, part_filename, nsl_id, profile_name,
+                                                                  verify)
+        if size is None:
+            # the server doesn't do ranges, and the whole asset has already been written to the part file
+            os.replace(part_filename, save_filename)
+            return save_filename
+
+    with open(part_filename, "wb") as file_obj:
+        file_obj.truncate(size)
+
+    def fetch_segment(start: int, end: int):
+        for attempt in Retrying(reraise=True,
+                                stop=stop_after_attempt(utils.RESUME_ATTEMPTS),
+                                wait=wait_exponential(multiplier=0.5, max=10),
+                                retry=retry_if_exception_type(retry_errors)):
+            with attempt:
+                with open(part_filename, "r+b") as segment_obj:
+                    segment_obj.seek(start)
+                    fetch_range(start, end, segment_obj)
+                    if segment_obj.tell() != end + 1:
+                        raise ValueError("range {0}-{1} of {2} returned {3} bytes"
+                                         .format(start, end, asset.href, segment_obj.tell() - start))
+
+    segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, max(len(segments), 1))) as executor:
+        futures = [executor.submit(fetch_segment, start, end) for start, end in segments]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    if verify:
+        try:
+            _check_file(part_filename, *checksums, description=asset.href or asset.object_path)
+        except utils.ChecksumError:
+            os.remove(part_filename)
+            raise
+    os.replace(part_filename, save_filename)
+    return save_filename
+
+
+def _check_file(filename: str, md5: Optional[str], crc32c: Optional[str], description: str):
+    # the md5 if known, then the crc32c if google-crc32c is installed
+    if md5 is not None:
+        digest, expected = hashlib.md5(), md5
+    elif crc32c is not None:
+        try:
+            import google_crc32c
+        except ImportError:
+            return
+        digest, expected = google_crc32c.Checksum(), crc32c
+    else:
+        return
+    if utils._file_digest(filename, digest) != expected:
+        raise utils.ChecksumError("checksum mismatch for {}".format(description))
+
+
+def _href_ranges(asset: Asset, part_filename: str, nsl_id: str, profile_name: str, verify: bool = True) \
+        -> Tuple[Optional[int], Callable[[int, int, object], None], Tuple, Tuple[Optional[str], Optional[str]]]:
+    host, asset_url, headers = utils._href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+
+    def request(range_header: str):
+        return http_connection_pool.request(method="GET", scheme=host.scheme, netloc=host.netloc, url=asset_url,
+                                            headers={**headers, "range": range_header})
+
+    # a one byte range tells us the size, and whether ranges are supported at all
+    with request("bytes=0-0") as res:
+        if res.status == 416 and utils._content_range_total(res.getheader("content-range")) == 0:
+            # an empty asset has no first byte
+            res.read()
+            return 0, None, (), (None, None)
+        utils._raise_for_href_status(res, asset.href)
+        if res.status == 200:
+            digest, expected = utils._response_digest(res) if verify else (None, None)
+            try:
+                with open(part_filename, "wb") as file_obj:
+                    utils._write_response(res, file_obj, asset.href, utils.DOWNLOAD_CHUNK_SIZE, digest=digest)
+                utils._check_digest(digest, expected, asset.href)
+            except utils.ChecksumError:
+                os.remove(part_filename)
+                raise
+            return None, None, (), (None, None)
+        res.read()
+        size = utils._content_range_total(res.getheader("content-range"))
+        if size is None:
+            raise ValueError("no content size for {}".format(asset.href))
+        # a 206 response's checksums are of the complete object
+        checksums = utils._response_checksums(res)
+
+    def fetch_range(start: int, end: int, file_obj):
+        with request("bytes={0}-{1}".format(start, end)) as range_res:
+            utils._raise_for_href_status(range_res, asset.href)
+            if range_res.status != 206:
+                raise ValueError("range request for {} answered with the whole asset".format(asset.href))
+            utils._write_response(range_res, file_obj, asset.href, utils.DOWNLOAD_CHUNK_SIZE)
+
+    return size, fetch_range, utils.HREF_RETRY_ERRORS, checksums
+
+
+def _gcs_ranges(asset: Asset) \
+        -> Tuple[int, Callable[[int, int, object], None], Tuple, Tuple[Optional[str], Optional[str]]]:
+    blob = utils.get_blob_metadata(bucket=asset.bucket, blob_name=asset.object_path)
+    if blob is None:
+        raise ValueError("not found error for gs://{0}/{1}".format(asset.bucket, asset.object_path))
+
+    def fetch_range(start: int, end: int, file_obj):
+        blob.download_to_file(file_obj=file_obj, client=gcs_storage_client.client, start=start, end=end)
+
+    checksums = (base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None,
+                 base64.b64decode(blob.crc32c).hex() if blob.crc32c else None)
+    return blob.size, fetch_range, utils.GCS_RETRY_ERRORS, checksums
+
+
+def _s3_ranges(asset: Asset, requester_pays: bool) \
+        -> Tuple[int, Callable[[int, int, object], None], Tuple, Tuple[Optional[str], Optional[str]]]:
+    request_args = {'Bucket': asset.bucket, 'Key': asset.object_path,
+                    **s3_transfer_engine.extra_args(asset.bucket, requester_pays)}
+    head = s3_transfer_engine.head(asset.bucket, asset.object_path, requester_pays=requester_pays)
+    if head is None:
+        raise ValueError("not found error for s3://{0}/{1}".format(asset.bucket, asset.object_path))
+
+    def fetch_range(start: int, end: int, file_obj):
+        res = s3_transfer_engine.client.get_object(Range="bytes={0}-{1}".format(start, end), IfMatch=head['ETag'],
+                                                   **request_args)
+        for chunk in res['Body'].iter_chunks(utils.DOWNLOAD_CHUNK_SIZE):
+            file_obj.write(chunk)
+
+    return head['ContentLength'], fetch_range, utils.S3_RETRY_ERRORS, (utils._etag_md5(head.get('ETag')), None)
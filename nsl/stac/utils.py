@@ -16,47 +16,76 @@
 #   info@nearspacelabs.com
 
 import base64
+import hashlib
+import io
 import os
 import datetime
 import http.client
 import re
-from urllib.parse import urlparse
-from typing import List, IO, Union, Dict, Any, Optional
+from urllib.parse import ParseResult, urlparse
+from typing import Callable, Iterable, List, IO, Union, Dict, Any, Optional, Tuple
 from warnings import warn
 
-import boto3
 import botocore
 import botocore.exceptions
 import botocore.client
+import google.api_core.exceptions
+import google.resumable_media.common
+import requests
 from google.cloud import storage
 from google.protobuf import timestamp_pb2, duration_pb2
-from tenacity import retry, stop_after_delay, wait_fixed
+from tenacity import Retrying, retry, retry_if_exception_type, stop_after_attempt, stop_after_delay, wait_exponential, \
+    wait_fixed
 
 from epl.protobuf.v1.stac_pb2 import epl_dot_protobuf_dot_v1_dot_query__pb2 as query
 from nsl.stac import gcs_storage_client, bearer_auth, \
     StacItem, StacRequest, Asset, TimestampFilter, DatetimeRange, Eo, FloatFilter, enum
+from nsl.stac.connections import http_connection_pool
 from nsl.stac.enum import Band, CloudPlatform, FilterRelationship, SortDirection, AssetType
+from nsl.stac.gcs import MAX_LOOKUP_WORKERS, gcs_metadata_cache
+from nsl.stac.s3 import s3_transfer_engine
 
 DEFAULT_RGB = [Band.RED, Band.GREEN, Band.BLUE, Band.NIR]
 RASTER_TYPES = [AssetType.CO_GEOTIFF, AssetType.GEOTIFF, AssetType.MRF]
+# bytes read from an href response and written to the destination at a time
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# attempts made by a resumable download, each continuing from where the last stopped
+RESUME_ATTEMPTS = int(os.getenv('NSL_RESUME_ATTEMPTS', 5))
+# attempts made by a download to a file whose checksum doesn't match the one the server reported
+VERIFY_ATTEMPTS = int(os.getenv('NSL_VERIFY_ATTEMPTS', 2))
+
+HREF_RETRY_ERRORS = (OSError, http.client.HTTPException)
+GCS_RETRY_ERRORS = (OSError, requests.exceptions.RequestException, google.api_core.exceptions.ServerError)
+S3_RETRY_ERRORS = (OSError, botocore.exceptions.BotoCoreError)
 UNSUPPORTED_TIME_FILTERS = [FilterRelationship.IN,
                             FilterRelationship.NOT_IN,
                             FilterRelationship.LIKE,
                             FilterRelationship.NOT_LIKE]
 
 
-def get_blob_metadata(bucket: str, blob_name: str) -> storage.Blob:
+class ChecksumError(ValueError):
+    """the bytes downloaded don't match the checksum reported by the server"""
+
+
+def get_blob_metadata(bucket: str, blob_name: str, refresh: bool = False) -> storage.Blob:
     """
     get metadata/interface for one asset in google cloud storage
     :param bucket: bucket name
     :param blob_name: complete blob name of item (doesn't include bucket name)
-    :return: Blob interface item
+    :param refresh: fetch the metadata even if it's cached
+    :return: Blob interface item, or None if it doesn't exist. see nsl.stac.gcs for how long metadata is cached
     """
-    if gcs_storage_client.client is None:
-        raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable not set")
+    return gcs_metadata_cache.blob(bucket, blob_name, refresh=refresh)
 
-    bucket = gcs_storage_client.client.get_bucket(bucket)
-    return bucket.get_blob(blob_name=blob_name.strip('/'))
+
+def get_blobs_metadata(assets: Iterable[Asset], max_workers: int = MAX_LOOKUP_WORKERS) -> List[Optional[storage.Blob]]:
+    """
+    get metadata for many assets in google cloud storage, concurrently
+    :param assets: GCP assets
+    :param max_workers: concurrent requests
+    :return: a Blob, or None if it doesn't exist, per asset in the order of assets
+    """
+    return gcs_metadata_cache.blobs([(asset.bucket, asset.object_path) for asset in assets], max_workers=max_workers)
 
 
 @retry(reraise=True, stop=stop_after_delay(3), wait=wait_fixed(0.5))
@@ -64,7 +93,9 @@ def download_gcs_object(bucket: str,
                         blob_name: str,
                         file_obj: IO[bytes] = None,
                         save_filename: str = "",
-                        make_dir=True) -> str:
+                        make_dir=True,
+                        resumable: bool = False,
+                        verify: bool = True) -> str:
     """
     download a specific blob from Google Cloud Storage (GCS) to a file object handle
     :param make_dir: if directory doesn't exist create
@@ -72,6 +103,10 @@ def download_gcs_object(bucket: str,
     :param blob_name: the full prefix to a specific asset in GCS. Does not include bucket name
     :param file_obj: file object (or BytesIO string_buffer) where data should be written
     :param save_filename: the filename to save the file to
+    :param resumable: save_filename downloads only. download to save_filename + '.part', continuing from the end of the
+    part file when a download fails, and check the blob's size and md5 before renaming it to save_filename
+    :param verify: check the md5 (or crc32c) of the bytes, as they're written, against the blob's. a mismatch raises
+    ChecksumError, and deletes save_filename
     :return: returns path to downloaded file if applicable
     """
     if make_dir and save_filename != "":
@@ -82,7 +117,15 @@ def download_gcs_object(bucket: str,
     blob = get_blob_metadata(bucket=bucket, blob_name=blob_name)
 
     if file_obj is not None:
-        blob.download_to_file(file_obj=file_obj, client=gcs_storage_client.client)
+        try:
+            blob.download_to_file(file_obj=file_obj, client=gcs_storage_client.client,
+                                  checksum="auto" if verify else None)
+        except google.api_core.exceptions.NotFound:
+            # the cached metadata is of a generation that's since been replaced. the retry looks it up again
+            gcs_metadata_cache.invalidate(bucket, blob_name)
+            raise
+        except google.resumable_media.common.DataCorruption as e:
+            raise ChecksumError("checksum mismatch for gs://{0}/{1}".format(bucket, blob_name)) from e
         if "name" in file_obj.__dict__:
             save_filename = file_obj.name
         else:
@@ -93,9 +136,27 @@ def download_gcs_object(bucket: str,
             pass
 
         return save_filename
+    elif len(save_filename) > 0 and resumable:
+        def fetch(part_file: _PartFile) -> int:
+            part_file.size = blob.size
+            if part_file.offset < blob.size:
+                try:
+                    blob.download_to_file(file_obj=part_file, client=gcs_storage_client.client, start=part_file.offset)
+                except google.api_core.exceptions.NotFound:
+                    gcs_metadata_cache.invalidate(bucket, blob_name)
+                    raise
+            return blob.size
+
+        expected_md5 = base64.b64decode(blob.md5_hash).hex() if blob.md5_hash and verify else None
+        return _download_resumable(save_filename, fetch, description="gs://{0}/{1}".format(bucket, blob_name),
+                                   retry_errors=GCS_RETRY_ERRORS, expected_md5=expected_md5)
     elif len(save_filename) > 0:
-        with open(save_filename, "w+b") as file_obj:
-            download_gcs_object(bucket, blob_name, file_obj=file_obj)
+        try:
+            with open(save_filename, "w+b") as file_obj:
+                download_gcs_object(bucket, blob_name, file_obj=file_obj, verify=verify)
+        except ChecksumError:
+            os.remove(save_filename)
+            raise
         return save_filename
     else:
         raise ValueError("must provide filename or file_obj")
@@ -105,15 +166,55 @@ def download_s3_object(bucket: str,
                        blob_name: str,
                        file_obj: IO = None,
                        save_filename: str = "",
-                       requester_pays: bool = False) -> str:
-    extra_args = None
-    if requester_pays:
-        extra_args = {'RequestPayer': 'requester'}
-
-    s3 = boto3.client('s3')
+                       requester_pays: bool = False,
+                       resumable: bool = False,
+                       verify: bool = True) -> str:
+    """
+    download an object from S3 with the shared s3_transfer_engine (see nsl.stac.s3)
+    :param bucket: bucket name
+    :param blob_name: object key
+    :param file_obj: file object where data should be written
+    :param save_filename: the filename to save the file to
+    :param requester_pays: authorize a requester pays download
+    :param resumable: save_filename downloads only. download to save_filename + '.part', continuing from the end of the
+    part file when a download fails, and check the object's size and md5 (if its ETag is one) before renaming it
+    :param verify: if the object's ETag is its md5 (it wasn't a multipart upload), check the md5 of the bytes, as
+    they're written, against it. a mismatch raises ChecksumError, and deletes save_filename. costs a head_object request
+    :return: returns path to downloaded file if applicable
+    """
     try:
+        if file_obj is None and len(save_filename) > 0 and resumable:
+            request_args = {'Bucket': bucket, 'Key': blob_name, **s3_transfer_engine.extra_args(bucket, requester_pays)}
+            head = s3_transfer_engine.client.head_object(**request_args)
+            size = head['ContentLength']
+
+            def fetch(part_file: _PartFile) -> int:
+                part_file.size = size
+                if part_file.offset < size:
+                    # IfMatch fails the request, rather than mixing bytes of two versions, if the object has changed
+                    res = s3_transfer_engine.client.get_object(Range="bytes={}-".format(part_file.offset),
+                                                               IfMatch=head['ETag'], **request_args)
+                    for chunk in res['Body'].iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                        part_file.write(chunk)
+                return size
+
+            return _download_resumable(save_filename, fetch, description="s3://{0}/{1}".format(bucket, blob_name),
+                                       retry_errors=S3_RETRY_ERRORS,
+                                       expected_md5=_etag_md5(head['ETag']) if verify else None)
+
+        expected_md5 = None
+        if verify and (file_obj is not None or len(save_filename) > 0):
+            head = s3_transfer_engine.head(bucket, blob_name, requester_pays=requester_pays)
+            expected_md5 = _etag_md5(head['ETag']) if head is not None else None
+        description = "s3://{0}/{1}".format(bucket, blob_name)
+
         if file_obj is not None:
-            s3.download_fileobj(Bucket=bucket, Key=blob_name, Fileobj=file_obj, ExtraArgs=extra_args)
+            if expected_md5 is not None:
+                writer = _HashingWriter(file_obj, hashlib.md5())
+                s3_transfer_engine.download(bucket, blob_name, file_obj=writer, requester_pays=requester_pays)
+                _check_digest(writer.digests[0], expected_md5, description)
+            else:
+                s3_transfer_engine.download(bucket, blob_name, file_obj=file_obj, requester_pays=requester_pays)
             if "name" in file_obj.__dict__:
                 save_filename = file_obj.name
             else:
@@ -121,8 +222,18 @@ def download_s3_object(bucket: str,
             file_obj.seek(0)
 
             return save_filename
+        elif len(save_filename) > 0 and expected_md5 is not None:
+            try:
+                with open(save_filename, "wb") as f:
+                    writer = _HashingWriter(f, hashlib.md5())
+                    s3_transfer_engine.download(bucket, blob_name, file_obj=writer, requester_pays=requester_pays)
+                _check_digest(writer.digests[0], expected_md5, description)
+            except ChecksumError:
+                os.remove(save_filename)
+                raise
+            return save_filename
         elif len(save_filename) > 0:
-            s3.download_file(Bucket=bucket, Key=blob_name, Filename=save_filename, ExtraArgs=extra_args)
+            s3_transfer_engine.download(bucket, blob_name, save_filename=save_filename, requester_pays=requester_pays)
             return save_filename
         else:
             raise ValueError("must provide filename or file_obj")
@@ -137,7 +248,12 @@ def download_href_object(asset: Asset,
                          file_obj: IO = None,
                          save_filename: str = "",
                          nsl_id: str = None,
-                         profile_name: str = None) -> str:
+                         profile_name: str = None,
+                         chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                         progress: Callable[[int, Optional[int]], Any] = None,
+                         checksum=None,
+                         resumable: bool = False,
+                         verify: bool = True) -> str:
     """
     download the href of an asset
     :param asset: The asset to download
@@ -149,14 +265,90 @@ def download_href_object(asset: Asset,
         are not set, you must use `NSLClient.set_credentials` to add at least one set of credentials.
     :param profile_name: ADVANCED ONLY. Only necessary if more than one NSL profile has been defined with the
         `set_credentials` method. Specifies which NSL profile to use for downloading.
+    :param chunk_size: the response is written to the destination this many bytes at a time, so no more than this is
+    held in memory
+    :param progress: called after every chunk with the bytes written so far and the total size (None if the server
+    didn't send a content-length)
+    :param checksum: a hashlib hash object (e.g. hashlib.md5()) updated with every chunk written
+    :param resumable: save_filename downloads only. download to save_filename + '.part' and, when the connection fails,
+    continue from the end of the part file with a Range request. see _download_resumable
+    :param verify: if the response has a checksum (an md5 or crc32c x-goog-hash header, a content-md5 header or an ETag
+    that's an md5), check the bytes, as they're written, against it. a mismatch raises ChecksumError, and deletes
+    save_filename
     :return: returns the save_filename. if BinaryIO is not a FileIO object type, save_filename returned is an
     empty string
     """
     if not asset.href:
         raise ValueError("no href on asset")
+    if len(save_filename) == 0 and file_obj is None:
+        raise ValueError("must provide filename or file_obj")
 
+    host, asset_url, headers = _href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+    if resumable and file_obj is None:
+        def fetch(part_file: _PartFile) -> int:
+            range_headers = dict(headers)
+            if part_file.offset > 0:
+                range_headers["range"] = "bytes={}-".format(part_file.offset)
+            with http_connection_pool.request(method="GET", scheme=host.scheme, netloc=host.netloc,
+                                              url=asset_url, headers=range_headers) as res:
+                if res.status == 416 and part_file.offset > 0:
+                    # nothing left to download if the part file already has every byte
+                    res.read()
+                    return _content_range_total(res.getheader('content-range'))
+                _raise_for_href_status(res, asset.href)
+                if res.status == 206:
+                    content_range = res.getheader('content-range')
+                    if _content_range_start(content_range) != part_file.offset:
+                        # appending another range would corrupt the file. the retry starts over
+                        part_file.restart()
+                        raise http.client.HTTPException("range {0} of {1} doesn't start at byte {2}"
+                                                        .format(content_range, asset.href, part_file.offset))
+                    total = _content_range_total(content_range)
+                else:
+                    if part_file.offset > 0:
+                        # the server ignored the range, start over
+                        part_file.restart()
+                    content_length = res.getheader('content-length')
+                    total = int(content_length) if content_length is not None else None
+                part_file.size = total
+                if verify and part_file.expected_md5 is None:
+                    # a 206 response's checksums are of the complete object, like a 200's
+                    part_file.expected_md5 = _response_checksums(res)[0]
+                _write_response(res, part_file, asset.href, chunk_size)
+                return part_file.offset if total is None else total
+
+        return _download_resumable(save_filename, fetch, description=asset.href, progress=progress,
+                                   checksum=checksum, expected_md5=None, retry_errors=HREF_RETRY_ERRORS)
+
+    with http_connection_pool.request(method="GET", scheme=host.scheme, netloc=host.netloc,
+                                      url=asset_url, headers=headers) as res:
+        _raise_for_href_status(res, asset.href)
+        digest, expected = _response_digest(res) if verify else (None, None)
+
+        if len(save_filename) > 0:
+            try:
+                with open(save_filename, mode='wb') as f:
+                    _write_response(res, f, asset.href, chunk_size, progress, checksum, digest)
+                _check_digest(digest, expected, asset.href)
+            except ChecksumError:
+                os.remove(save_filename)
+                raise
+        else:
+            _write_response(res, file_obj, asset.href, chunk_size, progress, checksum, digest)
+            _check_digest(digest, expected, asset.href)
+            if "name" in file_obj.__dict__:
+                save_filename = file_obj.name
+            else:
+                save_filename = ""
+            file_obj.seek(0)
+
+    return save_filename
+
+
+def _href_request(asset: Asset,
+                  nsl_id: str = None,
+                  profile_name: str = None) -> Tuple[ParseResult, str, Dict[str, str]]:
     host = urlparse(asset.href)
-    conn = http.client.HTTPConnection(host.netloc)
 
     headers = {}
     asset_url = host.path
@@ -166,34 +358,348 @@ def download_href_object(asset: Asset,
 
     if len(asset.type) > 0:
         headers["content-type"] = asset.type
-    conn.request(method="GET", url=asset_url, headers=headers)
+    return host, asset_url, headers
 
-    res = conn.getresponse()
+
+def _raise_for_href_status(res: http.client.HTTPResponse, href: str):
     if res.status == 404:
-        raise ValueError("not found error for {path}".format(path=asset.href))
+        raise ValueError("not found error for {path}".format(path=href))
     elif res.status == 403:
-        raise ValueError("auth error for asset {asset}".format(asset=asset.href))
+        raise ValueError("auth error for asset {asset}".format(asset=href))
     elif res.status == 402:
-        raise ValueError("not enough credits for downloading asset {asset}".format(asset=asset.href))
-    elif res.status != 200:
-        raise ValueError("error code {code} for asset: {asset}".format(code=res.status, asset=asset.href))
-
-    if len(save_filename) > 0:
-        with open(save_filename, mode='wb') as f:
-            f.write(res.read())
-    elif file_obj is not None:
-        file_obj.write(res.read())
-        if "name" in file_obj.__dict__:
-            save_filename = file_obj.name
-        else:
-            save_filename = ""
-        file_obj.seek(0)
-    else:
-        raise ValueError("must provide filename or file_obj")
-
+        raise ValueError("not enough credits for downloading asset {asset}".format(asset=href))
+    elif res.status not in (200, 206):
+        raise ValueError("error code {code} for asset: {asset}".format(code=res.status, asset=href))
+
+
+def _content_range_total(content_range: Optional[str]) -> Optional[int]:
+    # 'bytes 0-99/1234' or 'bytes */1234'
+    if content_range is None or '/' not in content_range or content_range.endswith('/*'):
+        return None
+    return int(content_range.rsplit('/', 1)[1])
+
+
+def _content_range_start(content_range: Optional[str]) -> Optional[int]:
+    # 'bytes 100-199/1234'
+    match = re.match(r"bytes (\d+)-", content_range or "")
+    return int(match.group(1)) if match is not None else None
+
+
+def _write_response(res: http.client.HTTPResponse,
+                    file_obj: IO,
+                    href: str,
+                    chunk_size: int,
+                    progress: Callable[[int, Optional[int]], Any] = None,
+                    checksum=None,
+                    digest=None) -> int:
+    content_length = res.getheader('content-length')
+    total = int(content_length) if content_length is not None else None
+    written = 0
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        size = res.readinto(buffer)
+        if size == 0:
+            break
+        file_obj.write(view[:size])
+        if checksum is not None:
+            checksum.update(view[:size])
+        if digest is not None:
+            digest.update(view[:size])
+        written += size
+        if progress is not None:
+            progress(written, total)
+
+    if total is not None and written != total:
+        # the connection closed early
+        raise http.client.IncompleteRead(b"", total - written)
+    return written
+
+
+class _PartFile:
+    def __init__(self, filename: str, checksum=None):
+        """
+        the .part file a resumable download is written to. if one was left by an earlier attempt, writing continues at
+        its end. keeps an md5 of everything written, and updates checksum, if set, with the bytes of the file from its
+        start. the bytes of a left part file are only added to checksum once writing continues after them, so a restart
+        doesn't leave them in it
+        """
+        self.filename = filename + ".part"
+        self.size = None
+        self.progress = None
+        self.md5 = hashlib.md5()
+        self.checksum = checksum
+        # hex md5 of the complete object, if the server reported it
+        self.expected_md5 = None
+        mode = "r+b" if os.path.exists(self.filename) else "w+b"
+        self._file = open(self.filename, mode)
+        while True:
+            chunk = self._file.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.md5.update(chunk)
+        self.offset = self._file.tell()
+        # bytes of the file added to checksum
+        self._hashed = 0
+        # after a restart, the md5 of the bytes already added to checksum, and of the new bytes that replace them
+        self._hashed_md5 = None
+        self._rehashed_md5 = None
+
+    def write(self, data) -> int:
+        if self.checksum is not None:
+            self._update_checksum(data)
+        self._file.write(data)
+        self.md5.update(data)
+        self.offset += len(data)
+        if self.progress is not None:
+            self.progress(self.offset, self.size)
+        return len(data)
+
+    def restart(self):
+        self._file.seek(0)
+        self._file.truncate()
+        if self._rehashed_md5 is not None:
+            self._rehashed_md5 = hashlib.md5()
+        elif self._hashed > 0:
+            # a hash object can't be reset. the bytes written again have to match the ones already in checksum
+            self._hashed_md5 = self.md5.digest()
+            self._rehashed_md5 = hashlib.md5()
+        self.md5 = hashlib.md5()
+        self.offset = 0
+
+    def finish(self):
+        """add the bytes of the file that aren't in checksum yet, e.g. a complete part file left before"""
+        if self.checksum is not None:
+            self._update_checksum(b"")
+            if self._rehashed_md5 is not None:
+                raise ChecksumError("{} changed during the download, its checksum can't be taken back"
+                                    .format(self.filename))
+
+    def close(self):
+        self._file.close()
+
+    def _update_checksum(self, data):
+        if self.offset > self._hashed:
+            # writing continues after a left part file, add it first
+            self._file.seek(self._hashed)
+            while self._file.tell() < self.offset:
+                self.checksum.update(self._file.read(min(DOWNLOAD_CHUNK_SIZE, self.offset - self._file.tell())))
+            self._hashed = self.offset
+
+        end = self.offset + len(data)
+        if self._rehashed_md5 is not None:
+            overlap = min(end, self._hashed) - self.offset
+            self._rehashed_md5.update(data[:overlap])
+            if end >= self._hashed:
+                if self._rehashed_md5.digest() != self._hashed_md5:
+                    raise ChecksumError("{} changed during the download, its checksum can't be taken back"
+                                        .format(self.filename))
+                self._hashed_md5, self._rehashed_md5 = None, None
+            data = data[overlap:]
+        self.checksum.update(data)
+        self._hashed = max(self._hashed, end)
+
+
+def _download_resumable(save_filename: str,
+                        fetch: Callable[[_PartFile], Optional[int]],
+                        description: str,
+                        retry_errors: Tuple,
+                        progress: Callable[[int, Optional[int]], Any] = None,
+                        checksum=None,
+                        expected_md5: str = None) -> str:
+    """
+    download to save_filename + '.part', calling fetch until the part file is complete, then verify and atomically
+    rename it to save_filename. a part file left by a failed call is picked up by the next one
+    :param save_filename: final filename
+    :param fetch: writes the object from part_file.offset to its end into part_file. returns the object size, if known
+    :param description: used in error messages
+    :param retry_errors: exceptions that are retried, from the part file's current offset
+    :param progress: called with the bytes in the part file and the total size (if known) after every chunk
+    :param checksum: a hashlib hash object updated with the complete file
+    :param expected_md5: hex md5 of the object, if known. a mismatch deletes the part file and raises ValueError
+    :return: save_filename
+    """
+    part_file = _PartFile(save_filename, checksum)
+    part_file.progress = progress
+    try:
+        size = None
+        for attempt in Retrying(reraise=True,
+                                stop=stop_after_attempt(RESUME_ATTEMPTS),
+                                wait=wait_exponential(multiplier=0.5, max=10),
+                                retry=retry_if_exception_type(retry_errors)):
+            with attempt:
+                size = fetch(part_file)
+        part_file.finish()
+    finally:
+        part_file.close()
+
+    if size is not None and part_file.offset != size:
+        if part_file.offset > size:
+            # left by a different version of the object
+            os.remove(part_file.filename)
+        raise ValueError("incomplete download of {0}, {1} of {2} bytes".format(description, part_file.offset, size))
+    expected_md5 = expected_md5 or part_file.expected_md5
+    if expected_md5 is not None and part_file.md5.hexdigest() != expected_md5:
+        os.remove(part_file.filename)
+        raise ChecksumError("checksum mismatch for {}".format(description))
+
+    os.replace(part_file.filename, save_filename)
     return save_filename
 
 
+def _etag_md5(etag: Optional[str]) -> Optional[str]:
+    # an S3 ETag is the md5 of the object, unless it was a multipart upload ('<md5>-<part count>'). other servers' ETags
+    # are only md5s if they look like one
+    if etag is None:
+        return None
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        # weak ETags don't identify the bytes
+        return None
+    etag = etag.strip('"').lower()
+    return etag if re.fullmatch(r"[0-9a-f]{32}", etag) else None
+
+
+def _response_checksums(res) -> Tuple[Optional[str], Optional[str]]:
+    # hex md5 and crc32c of the complete object from the headers of a 200 or 206 response: GCS's x-goog-hash, then
+    # content-md5 (200 only, it's of the body), then an ETag that's an md5
+    md5, crc32c = None, None
+    for value in (res.getheader('x-goog-hash') or "").split(','):
+        name, _, encoded = value.strip().partition('=')
+        if name in ('md5', 'crc32c') and encoded:
+            try:
+                decoded = base64.b64decode(encoded).hex()
+            except ValueError:
+                continue
+            if name == 'md5':
+                md5 = decoded
+            else:
+                crc32c = decoded
+    if md5 is None and res.status == 200 and res.getheader('content-md5'):
+        try:
+            md5 = base64.b64decode(res.getheader('content-md5')).hex()
+        except ValueError:
+            pass
+    if md5 is None:
+        md5 = _etag_md5(res.getheader('etag'))
+    return md5, crc32c
+
+
+def _response_digest(res) -> Tuple[Any, Optional[str]]:
+    # a hash object for the body of a 200 response and the hex digest it should end with, or (None, None) if the
+    # response has no checksum that can be computed
+    if res.status != 200:
+        return None, None
+    md5, crc32c = _response_checksums(res)
+    if md5 is not None:
+        return hashlib.md5(), md5
+    if crc32c is not None:
+        try:
+            import google_crc32c
+        except ImportError:
+            return None, None
+        return google_crc32c.Checksum(), crc32c
+    return None, None
+
+
+def _check_digest(digest, expected: Optional[str], description: str):
+    if digest is not None and expected is not None and digest.digest().hex() != expected:
+        raise ChecksumError("checksum mismatch for {}".format(description))
+
+
+class _HashingWriter:
+    def __init__(self, file_obj: IO[bytes], *digests):
+        """
+        writes through to file_obj, updating digests with every write. it isn't seekable, so that a multipart S3
+        download writes its parts in order
+        """
+        self._file_obj = file_obj
+        self.digests = digests
+
+    def write(self, data) -> int:
+        for digest in self.digests:
+            digest.update(data)
+        return self._file_obj.write(data)
+
+    def seekable(self) -> bool:
+        return False
+
+    def flush(self):
+        self._file_obj.flush()
+
+
+def _file_digest(filename: str, digest) -> str:
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest().hex()
+
+
+def remote_checksums(asset: Asset,
+                     from_bucket: bool = False,
+                     requester_pays: bool = False,
+                     nsl_id: str = None,
+                     profile_name: str = None) -> Tuple[Optional[int], Optional[str], Optional[str]]:
+    """
+    the size and checksums of an asset as its storage reports them, with one metadata request and no download: the GCS
+    blob metadata, an S3 head_object or a HEAD request of the href.
+    :param asset: The asset
+    :param from_bucket: as in download_asset
+    :param requester_pays: as in download_asset
+    :param nsl_id: as in download_asset
+    :param profile_name: as in download_asset
+    :return: size in bytes, hex md5 and hex crc32c. each is None if it isn't known, e.g. the md5 of a composite GCS
+    object, of a multipart S3 upload or of an href whose ETag isn't an md5. all are None if the object wasn't found
+    """
+    if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+        blob = get_blob_metadata(bucket=asset.bucket, blob_name=asset.object_path, refresh=True)
+        if blob is None:
+            return None, None, None
+        md5 = base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None
+        crc32c = base64.b64decode(blob.crc32c).hex() if blob.crc32c else None
+        return blob.size, md5, crc32c
+    elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+        head = s3_transfer_engine.head(asset.bucket, asset.object_path, requester_pays=requester_pays)
+        if head is None:
+            return None, None, None
+        return head['ContentLength'], _etag_md5(head.get('ETag')), None
+
+    host, asset_url, headers = _href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+    with http_connection_pool.request(method="HEAD", scheme=host.scheme, netloc=host.netloc,
+                                      url=asset_url, headers=headers) as res:
+        res.read()
+        if res.status != 200:
+            return None, None, None
+        content_length = res.getheader('content-length')
+        return int(content_length) if content_length is not None else None, _etag_md5(res.getheader('etag')), None
+
+
+def file_matches(filename: str, size: int = None, md5: str = None, crc32c: str = None) -> bool:
+    """
+    whether a local file has the size and checksum of a remote object (see remote_checksums). the md5 is used if
+    known, then the crc32c (if google-crc32c is installed). the size alone doesn't decide: an object changed in place
+    can keep its size, and e.g. the ETag of a multipart S3 upload isn't an md5
+    :param filename: local file
+    :param size: expected size in bytes
+    :param md5: expected hex md5
+    :param crc32c: expected hex crc32c
+    :return: False if the file doesn't exist, differs, or there's no checksum to compare it with
+    """
+    if md5 is None and crc32c is None:
+        return False
+    if not os.path.isfile(filename):
+        return False
+    if size is not None and os.path.getsize(filename) != size:
+        return False
+    if md5 is not None:
+        return _file_digest(filename, hashlib.md5()) == md5
+    try:
+        import google_crc32c
+    except ImportError:
+        return False
+    return _file_digest(filename, google_crc32c.Checksum()) == crc32c
+
+
 def download_asset(asset: Asset,
                    from_bucket: bool = False,
                    file_obj: IO[Union[Union[str, bytes], Any]] = None,
@@ -201,7 +707,13 @@ def download_asset(asset: Asset,
                    save_directory: str = "",
                    requester_pays: bool = False,
                    nsl_id: str = None,
-                   profile_name: str = None) -> str:
+                   profile_name: str = None,
+                   progress: Callable[[int, Optional[int]], Any] = None,
+                   checksum=None,
+                   resumable: bool = False,
+                   cache=None,
+                   skip_unchanged: bool = False,
+                   verify: bool = True) -> str:
     """
     download an asset. Defaults to downloading from cloud storage. save the data to a BinaryIO file object, a filename
     on your filesystem, or to a directory on your filesystem (the filename will be chosen from the basename of the
@@ -220,6 +732,20 @@ def download_asset(asset: Asset,
         are not set, you must use `NSLClient.set_credentials` to add at least one set of credentials.
     :param profile_name: ADVANCED ONLY. Only necessary if more than one NSL profile has been defined with the
         `set_credentials` method. Specifies which NSL profile to use for downloading.
+    :param progress: href downloads only. see download_href_object
+    :param checksum: href downloads only. see download_href_object
+    :param resumable: save_filename and save_directory downloads only. download to a '.part' file that a failed
+    download continues from, and rename it to the filename once complete. see download_href_object,
+    download_gcs_object and download_s3_object
+    :param cache: an nsl.stac.cache.AssetCache to get the asset from, downloading it only if it isn't cached. entries
+    are of the asset's current remote version, which costs one metadata request. defaults to the cache set by the
+    NSL_CACHE_DIR environment variable, if any. False to never use a cache. not used when checksum is set
+    :param skip_unchanged: save_filename and save_directory downloads only. if the file already exists, compare it with
+    the remote size and md5 or crc32c (see remote_checksums) and only download it if it differs, or if the storage
+    reports no checksum of it. costs one metadata request per asset
+    :param verify: check the bytes against the md5 or crc32c reported by the server, if any, as they're written. a
+    save_filename or save_directory download that doesn't match is made again, up to VERIFY_ATTEMPTS times, then raises
+    ChecksumError. see download_href_object, download_gcs_object and download_s3_object
     :return:
     """
     if len(save_directory) > 0 and file_obj is None and len(save_filename) == 0:
@@ -228,29 +754,213 @@ def download_asset(asset: Asset,
         else:
             raise ValueError("directory 'save_directory' doesn't exist")
 
-    if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
-        return download_gcs_object(bucket=asset.bucket,
-                                   blob_name=asset.object_path,
-                                   file_obj=file_obj,
-                                   save_filename=save_filename)
-    elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
-        return download_s3_object(bucket=asset.bucket,
-                                  blob_name=asset.object_path,
-                                  file_obj=file_obj,
-                                  save_filename=save_filename,
-                                  requester_pays=requester_pays)
-    else:
-        return download_href_object(asset=asset,
-                                    file_obj=file_obj,
-                                    save_filename=save_filename,
-                                    nsl_id=nsl_id,
-                                    profile_name=profile_name)
+    if skip_unchanged and file_obj is None and len(save_filename) > 0:
+        size, md5, crc32c = remote_checksums(asset, from_bucket=from_bucket, requester_pays=requester_pays,
+                                             nsl_id=nsl_id, profile_name=profile_name)
+        if file_matches(save_filename, size=size, md5=md5, crc32c=crc32c):
+            if checksum is not None:
+                _file_digest(save_filename, checksum)
+            return save_filename
+
+    if cache is None:
+        from nsl.stac.cache import default_cache
+        cache = default_cache()
+    if cache and checksum is None:
+        return cache.get(asset,
+                         from_bucket=from_bucket,
+                         file_obj=file_obj,
+                         save_filename=save_filename,
+                         requester_pays=requester_pays,
+                         nsl_id=nsl_id,
+                         profile_name=profile_name,
+                         progress=progress,
+                         resumable=resumable,
+                         verify=verify)
+
+    # a file that doesn't match is deleted, so it can be downloaded again. bytes written to a file object or to a
+    # checksum can't be taken back
+    attempts = VERIFY_ATTEMPTS if verify and file_obj is None and checksum is None else 1
+    for attempt in Retrying(reraise=True, stop=stop_after_attempt(attempts),
+                            retry=retry_if_exception_type(ChecksumError)):
+        with attempt:
+            if from_bucket and asset.cloud_platform == CloudPlatform.GCP:
+                return download_gcs_object(bucket=asset.bucket,
+                                           blob_name=asset.object_path,
+                                           file_obj=file_obj,
+                                           save_filename=save_filename,
+                                           resumable=resumable,
+                                           verify=verify)
+            elif from_bucket and asset.cloud_platform == CloudPlatform.AWS:
+                return download_s3_object(bucket=asset.bucket,
+                                          blob_name=asset.object_path,
+                                          file_obj=file_obj,
+                                          save_filename=save_filename,
+                                          requester_pays=requester_pays,
+                                          resumable=resumable,
+                                          verify=verify)
+            else:
+                return download_href_object(asset=asset,
+                                            file_obj=file_obj,
+                                            save_filename=save_filename,
+                                            nsl_id=nsl_id,
+                                            profile_name=profile_name,
+                                            progress=progress,
+                                            checksum=checksum,
+                                            resumable=resumable,
+                                            verify=verify)
+
+
+def download_asset_into(asset: Asset,
+                        buffer,
+                        from_bucket: bool = False,
+                        requester_pays: bool = False,
+                        nsl_id: str = None,
+                        profile_name: str = None,
+                        progress: Callable[[int, Optional[int]], Any] = None,
+                        checksum=None,
+                        cache=None) -> int:
+    """
+    download an asset into a preallocated, writable buffer, with the semantics of readinto. buffer can be a bytearray,
+    memoryview, mmap or anything else exposing the buffer protocol (e.g. a NumPy array, or the buf of a
+    multiprocessing.shared_memory.SharedMemory), so the asset lands where it's used without being copied out of a file
+    object. an href download is read from the connection straight into the buffer
+    :param asset: The asset to download
+    :param buffer: C-contiguous writable buffer, at least as big as the asset. written from its start
+    :param from_bucket: force the download to occur from cloud storage instead of href endpoint
+    :param requester_pays: authorize a requester pays download. see download_asset
+    :param nsl_id: ADVANCED ONLY. see download_asset
+    :param profile_name: ADVANCED ONLY. see download_asset
+    :param progress: href downloads only. see download_href_object
+    :param checksum: href downloads only. see download_href_object
+    :param cache: as in download_asset. a cached asset is read from its file into the buffer
+    :return: the number of bytes written. ValueError if the asset is bigger than buffer, in which case the buffer holds
+    a part of it
+    """
+    view = memoryview(buffer).cast('B')
+    if view.readonly:
+        raise ValueError("buffer isn't writable")
+
+    if cache is None:
+        from nsl.stac.cache import default_cache
+        cache = default_cache()
+    if cache and checksum is None:
+        with cache.open(asset, from_bucket=from_bucket, requester_pays=requester_pays, nsl_id=nsl_id,
+                        profile_name=profile_name, progress=progress) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > view.nbytes:
+                raise ValueError("buffer of {0} bytes is too small for {1} bytes".format(view.nbytes, size))
+            return f.readinto(view[:size])
+
+    if from_bucket and asset.cloud_platform in (CloudPlatform.GCP, CloudPlatform.AWS):
+        writer = _BufferWriter(view)
+        download_asset(asset, from_bucket=True, file_obj=writer, requester_pays=requester_pays, cache=False)
+        return writer.written
+
+    return download_href_into(asset, view, nsl_id=nsl_id, profile_name=profile_name, progress=progress,
+                              checksum=checksum)
+
+
+def download_href_into(asset: Asset,
+                       buffer,
+                       nsl_id: str = None,
+                       profile_name: str = None,
+                       chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                       progress: Callable[[int, Optional[int]], Any] = None,
+                       checksum=None,
+                       verify: bool = True) -> int:
+    """
+    download the href of an asset by reading the response directly into buffer. see download_asset_into
+    :param chunk_size: bytes read at most between calls of progress
+    :param verify: check the bytes against the checksum of the response, if any. see download_href_object
+    :return: the number of bytes written
+    """
+    if not asset.href:
+        raise ValueError("no href on asset")
+    view = memoryview(buffer).cast('B')
+
+    host, asset_url, headers = _href_request(asset, nsl_id=nsl_id, profile_name=profile_name)
+    with http_connection_pool.request(method="GET", scheme=host.scheme, netloc=host.netloc,
+                                      url=asset_url, headers=headers) as res:
+        _raise_for_href_status(res, asset.href)
+        digest, expected = _response_digest(res) if verify else (None, None)
+        content_length = res.getheader('content-length')
+        total = int(content_length) if content_length is not None else None
+        if total is not None and total > view.nbytes:
+            # read the response, so the connection can be reused
+            res.read()
+            raise ValueError("buffer of {0} bytes is too small for {1} bytes".format(view.nbytes, total))
+
+        written = 0
+        while written < view.nbytes:
+            size = res.readinto(view[written:written + chunk_size])
+            if size == 0:
+                break
+            if checksum is not None:
+                checksum.update(view[written:written + size])
+            if digest is not None:
+                digest.update(view[written:written + size])
+            written += size
+            if progress is not None:
+                progress(written, total)
+
+        if total is not None and written != total:
+            # the connection closed early
+            raise http.client.IncompleteRead(b"", total - written)
+        if total is None and written == view.nbytes and res.read(1):
+            res.read()
+            raise ValueError("buffer of {} bytes is too small".format(view.nbytes))
+    _check_digest(digest, expected, asset.href)
+    return written
+
+
+class _BufferWriter(io.RawIOBase):
+    def __init__(self, view: memoryview):
+        """
+        writable, seekable file object over a preallocated buffer, for the GCS and S3 clients, which only download to
+        file objects
+        """
+        super().__init__()
+        self._view = view
+        self._position = 0
+        # end of the furthest write, the size of the download
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.written
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self._position = offset
+        return self._position
+
+    def write(self, data) -> int:
+        data = memoryview(data).cast('B')
+        end = self._position + data.nbytes
+        if end > self._view.nbytes:
+            raise ValueError("buffer of {0} bytes is too small for {1} bytes".format(self._view.nbytes, end))
+        self._view[self._position:end] = data
+        self._position = end
+        self.written = max(self.written, end)
+        return data.nbytes
 
 
 def download_assets(stac_item: StacItem,
                     save_directory: str,
                     from_bucket: bool = False,
-                    nsl_id: str = None) -> List[str]:
+                    nsl_id: str = None,
+                    max_workers: int = 1,
+                    skip_unchanged: bool = False) -> List[str]:
     """
     Download all the assets for a StacItem into a directory
     :param nsl_id: ADVANCED ONLY. Only necessary if more than one nsl_id and nsl_secret have been defined with
@@ -259,15 +969,31 @@ def download_assets(stac_item: StacItem,
     :param stac_item: StacItem containing assets to download
     :param save_directory: the directory where the files should be downloaded
     :param from_bucket: force download from bucket. if set to false downloads happen from href. defaults to False
+    :param max_workers: number of assets downloaded at once. if more than 1, every download is attempted before the
+    first error is raised. for per asset results and errors use nsl.stac.transfer.DownloadEngine
+    :param skip_unchanged: don't download files already in save_directory that match the remote checksums. see
+    download_asset
     :return:
     """
+    if max_workers > 1:
+        from nsl.stac.transfer import DownloadEngine
+
+        with DownloadEngine(max_workers=max_workers, max_per_host=max_workers) as engine:
+            results = engine.download_assets(stac_item, save_directory=save_directory, from_bucket=from_bucket,
+                                             nsl_id=nsl_id, skip_unchanged=skip_unchanged)
+        for result in results:
+            if not result.ok:
+                raise result.error
+        return [result.save_filename for result in results]
+
     filenames = []
     for asset_key in stac_item.assets:
         asset = stac_item.assets[asset_key]
         filenames.append(download_asset(asset=asset,
                                         from_bucket=from_bucket,
                                         save_directory=save_directory,
-                                        nsl_id=nsl_id))
+                                        nsl_id=nsl_id,
+                                        skip_unchanged=skip_unchanged))
     return filenames
 
 
@@ -614,3 +1340,30 @@ def eval_float_filter(float_filter: FloatFilter, val: float) -> bool:
         return val < float_filter.value
     else:
         raise ValueError(f"not currently evaluating float filters of type: {query.FilterRelationship.Name(rel)}")
+
+
+def eval_timestamp_filter(timestamp_filter: TimestampFilter, val: timestamp_pb2.Timestamp) -> bool:
+    rel = timestamp_filter.rel_type
+    seconds = val.seconds + val.nanos / 1e9
+
+    def to_seconds(ts: timestamp_pb2.Timestamp) -> float:
+        return ts.seconds + ts.nanos / 1e9
+
+    if rel == enum.FilterRelationship.EQ:
+        return seconds == to_seconds(timestamp_filter.value)
+    elif rel == enum.FilterRelationship.NEQ:
+        return seconds != to_seconds(timestamp_filter.value)
+    elif rel == enum.FilterRelationship.BETWEEN:
+        return to_seconds(timestamp_filter.start) <= seconds <= to_seconds(timestamp_filter.end)
+    elif rel == enum.FilterRelationship.NOT_BETWEEN:
+        return seconds < to_seconds(timestamp_filter.start) or seconds > to_seconds(timestamp_filter.end)
+    elif rel == enum.FilterRelationship.GTE:
+        return seconds >= to_seconds(timestamp_filter.value)
+    elif rel == enum.FilterRelationship.GT:
+        return seconds > to_seconds(timestamp_filter.value)
+    elif rel == enum.FilterRelationship.LTE:
+        return seconds <= to_seconds(timestamp_filter.value)
+    elif rel == enum.FilterRelationship.LT:
+        return seconds < to_seconds(timestamp_filter.value)
+    else:
+        raise ValueError(f"not currently evaluating timestamp filters of type: {query.FilterRelationship.Name(rel)}")
@@ -43,7 +43,7 @@ kwargs = {
         'epl.geometry',
         # third-party
         'boto3',
-        'google-cloud-storage',
+        'google-cloud-storage>=1.32.0',
         'grpcio-tools==1.33.*',
         'protobuf~=3.19.0',
         'requests',
@@ -0,0 +1,110 @@
+import asyncio
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from urllib.parse import urlparse
+
+from nsl.stac import utils
+from nsl.stac.aio import AsyncConnectionPool, AsyncDownloader, AsyncResponse, download_asset, stream_asset
+from nsl.stac.enum import AssetType
+from nsl.stac.fake import FakeAssetServer, SyntheticCorpus, use_fake_credentials
+
+
+class TestAsyncDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=256 * 1024, latency=0.1).start()
+        cls.corpus = SyntheticCorpus(size=8, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.assets = [utils.get_asset(self.corpus[i], asset_type=AssetType.THUMBNAIL) for i in range(8)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def content(self, asset) -> bytes:
+        return self.asset_server.content(urlparse(asset.href).path)
+
+    def test_stream(self):
+        async def stream():
+            return [chunk async for chunk in stream_asset(self.assets[0], chunk_size=64 * 1024,
+                                                          pool=AsyncConnectionPool())]
+
+        chunks = asyncio.run(stream())
+        self.assertEqual(self.content(self.assets[0]), b''.join(chunks))
+        self.assertTrue(all(len(chunk) <= 64 * 1024 for chunk in chunks))
+
+    def test_download_many(self):
+        async def download_all(max_per_host: int):
+            downloader = AsyncDownloader(max_concurrency=8, max_per_host=max_per_host, pool=AsyncConnectionPool())
+            return await downloader.download_many(self.assets, save_directory=self.directory.name)
+
+        connections_before = self.asset_server.connections
+        start = time.perf_counter()
+        results = asyncio.run(download_all(max_per_host=2))
+        limited = time.perf_counter() - start
+        self.assertEqual([asset.href for asset in self.assets], [result.asset.href for result in results])
+        for result in results:
+            self.assertTrue(result.ok)
+            with open(result.save_filename, 'rb') as file_obj:
+                self.assertEqual(self.content(result.asset), file_obj.read())
+        # 8 downloads of 0.1 seconds, 2 at a time, on 2 keep-alive connections
+        self.assertGreaterEqual(limited, 0.4)
+        self.assertEqual(2, self.asset_server.connections - connections_before)
+
+        start = time.perf_counter()
+        asyncio.run(download_all(max_per_host=8))
+        self.assertLess(time.perf_counter() - start, limited)
+
+    def test_file_obj(self):
+        file_obj = io.BytesIO()
+        self.assertEqual("", asyncio.run(download_asset(self.assets[1], file_obj=file_obj,
+                                                        pool=AsyncConnectionPool())))
+        self.assertEqual(self.content(self.assets[1]), file_obj.read())
+
+    def test_missing(self):
+        self.asset_server.missing.add(urlparse(self.assets[2].href).path)
+        try:
+            result = asyncio.run(AsyncDownloader(pool=AsyncConnectionPool())
+                                 .download(self.assets[2], save_directory=self.directory.name))
+            self.assertIsInstance(result.error, ValueError)
+            self.assertEqual([], os.listdir(self.directory.name))
+        finally:
+            self.asset_server.missing.clear()
+
+    def test_cancel(self):
+        pool = AsyncConnectionPool()
+
+        async def cancel():
+            task = asyncio.ensure_future(download_asset(self.assets[3], save_directory=self.directory.name,
+                                                        pool=pool))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        # no partial file, and the connection wasn't returned to the pool
+        self.assertEqual([], os.listdir(self.directory.name))
+        self.assertEqual(0, pool.idle_count('http', urlparse(self.asset_server.url).netloc))
+
+
+class TestAsyncResponse(unittest.TestCase):
+    def test_chunked(self):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\ntrailer: x\r\n\r\nnext response')
+            res = AsyncResponse(reader, 200, {'transfer-encoding': 'chunked'}, 'GET')
+            body = await res.read()
+            return body, res.complete, await reader.read(13)
+
+        self.assertEqual((b'hello, world', True, b'next response'), asyncio.run(read()))
@@ -0,0 +1,132 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from urllib.parse import urlparse
+
+from nsl.stac import utils
+from nsl.stac.cache import AssetCache
+from nsl.stac.enum import AssetType
+from nsl.stac.fake import FakeAssetServer, SyntheticCorpus, use_fake_credentials
+
+
+class TestAssetCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=1024, latency=0.05).start()
+        cls.corpus = SyntheticCorpus(size=10, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = AssetCache(os.path.join(self.directory.name, 'cache'))
+        self.bytes_sent = self.asset_server.bytes_sent
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def asset(self, i: int):
+        return utils.get_asset(self.corpus[i], asset_type=AssetType.THUMBNAIL)
+
+    def content(self, asset) -> bytes:
+        return self.asset_server.content(urlparse(asset.href).path)
+
+    def downloads(self) -> int:
+        # lookups of the version of an asset are HEAD requests, with no body
+        return (self.asset_server.bytes_sent - self.bytes_sent) // 1024
+
+    def test_hit(self):
+        asset = self.asset(0)
+        first = utils.download_asset(asset, save_directory=self.directory.name, cache=self.cache)
+        second = utils.download_asset(asset, save_filename=os.path.join(self.directory.name, 'copy.png'),
+                                      cache=self.cache)
+        self.assertEqual(1, self.downloads())
+        self.assertTrue(self.cache.contains(asset))
+        for filename in (first, second):
+            with open(filename, 'rb') as file_obj:
+                self.assertEqual(self.content(asset), file_obj.read())
+        # hard linked to the cache entry
+        self.assertEqual(os.stat(self.cache.entry_path(asset)).st_ino, os.stat(second).st_ino)
+
+        file_obj = io.BytesIO()
+        utils.download_asset(asset, file_obj=file_obj, cache=self.cache)
+        self.assertEqual(self.content(asset), file_obj.read())
+        self.assertEqual(1, self.downloads())
+
+    def test_copy(self):
+        asset = self.asset(1)
+        filename = self.cache.get(asset, save_directory=self.directory.name, link=False)
+        self.assertNotEqual(os.stat(self.cache.entry_path(asset)).st_ino, os.stat(filename).st_ino)
+        with self.cache.open(asset) as file_obj:
+            self.assertEqual(self.content(asset), file_obj.read())
+
+    def test_versions(self):
+        asset = self.asset(2)
+        self.cache.get(asset, version='1')
+        self.assertFalse(self.cache.contains(asset))
+        self.assertFalse(self.cache.contains(asset, version='2'))
+        self.assertTrue(self.cache.contains(asset, version='1'))
+
+    def test_overwritten(self):
+        asset = self.asset(7)
+        path = urlparse(asset.href).path
+        self.cache.get(asset)
+        self.asset_server.files[path] = b'overwritten'
+        try:
+            with self.cache.open(asset) as file_obj:
+                self.assertEqual(b'overwritten', file_obj.read())
+        finally:
+            del self.asset_server.files[path]
+        with self.cache.open(asset) as file_obj:
+            self.assertEqual(self.content(asset), file_obj.read())
+        self.assertEqual(1, self.downloads())
+
+    def test_resumable(self):
+        asset = self.asset(8)
+        filename = os.path.join(self.directory.name, 'a.png')
+        utils.download_asset(asset, save_filename=filename, resumable=True, cache=self.cache)
+        self.assertTrue(self.cache.contains(asset))
+        self.assertEqual([], [name for _, _, names in os.walk(self.cache.directory) for name in names
+                              if name.endswith('.part')])
+
+    def test_eviction(self):
+        cache = AssetCache(self.cache.directory, max_bytes=2 * 1024)
+        assets = [self.asset(i) for i in range(3, 6)]
+        cache.get(assets[0])
+        cache.get(assets[1])
+        # the second entry is the least recently used, even with coarse mtimes
+        os.utime(cache.entry_path(assets[1]), (0, 0))
+        cache.get(assets[0])
+        cache.get(assets[2])
+        self.assertEqual([True, False, True], [cache.contains(asset) for asset in assets])
+        self.assertLessEqual(cache.size, 2 * 1024)
+
+        cache.clear()
+        self.assertEqual(0, cache.size)
+
+    def test_single_download(self):
+        asset = self.asset(6)
+        errors = []
+
+        def get(i: int):
+            try:
+                filename = os.path.join(self.directory.name, '{}.png'.format(i))
+                self.cache.get(asset, save_filename=filename)
+                with open(filename, 'rb') as file_obj:
+                    self.assertEqual(self.content(asset), file_obj.read())
+            except BaseException as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=get, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(1, self.downloads())
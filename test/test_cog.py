@@ -0,0 +1,165 @@
+import random
+import unittest
+
+from urllib.parse import urlparse
+
+import numpy as np
+
+from nsl.stac import Asset, utils
+from nsl.stac.cog import COGReader, _coalesce, _lzw_decode, read_chips, read_window
+from nsl.stac.enum import AssetType
+from nsl.stac.fake import FakeAssetServer, SyntheticCorpus, synthetic_cog, synthetic_pixel, use_fake_credentials
+
+WIDTH, HEIGHT, TILE_SIZE = 600, 500, 128
+ORIGIN, PIXEL_SIZE = (600000.0, 3300000.0), 0.5
+
+
+def expected(col_off: int, row_off: int, width: int, height: int, scale: int = 1) -> np.ndarray:
+    rows = np.arange(row_off, row_off + height)[:, None, None] * scale
+    cols = np.arange(col_off, col_off + width)[None, :, None] * scale
+    samples = np.arange(3)[None, None, :]
+    return ((rows * 7 + cols * 3 + samples * 50) % 256).astype(np.uint8)
+
+
+def lzw_encode(data: bytes) -> bytes:
+    # the TIFF LZW encoder that _lzw_decode reverses, with a clear code whenever the table fills up
+    def reset():
+        return {bytes([i]): i for i in range(256)}, 258, 9
+
+    table, next_code, width = reset()
+    codes, current = [(256, width)], b''
+    for byte in data:
+        candidate = current + bytes([byte])
+        if candidate in table:
+            current = candidate
+            continue
+        codes.append((table[current], width))
+        table[candidate] = next_code
+        next_code += 1
+        if next_code == 4094:
+            codes.append((256, width))
+            table, next_code, width = reset()
+        elif next_code >= 1 << width:
+            width += 1
+        current = bytes([byte])
+    codes.append((table[current], width))
+    if next_code + 1 >= 1 << width and width < 12:
+        width += 1
+    codes.append((257, width))
+
+    bits = ''.join(format(code, '0{}b'.format(code_width)) for code, code_width in codes)
+    bits += '0' * (-len(bits) % 8)
+    return bytes(int(bits[i:i + 8], 2) for i in range(0, len(bits), 8))
+
+
+class TestCOGReader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer().start()
+        corpus = SyntheticCorpus(size=2, asset_host=cls.asset_server.url, asset_types=(AssetType.CO_GEOTIFF,))
+        cls.asset = utils.get_asset(corpus[0], asset_type=AssetType.CO_GEOTIFF)
+        cls.big_asset = utils.get_asset(corpus[1], asset_type=AssetType.CO_GEOTIFF)
+        cls.cog = synthetic_cog(WIDTH, HEIGHT, tile_size=TILE_SIZE, origin=ORIGIN, pixel_size=PIXEL_SIZE)
+        cls.asset_server.files[urlparse(cls.asset.href).path] = cls.cog
+        cls.asset_server.files[urlparse(cls.big_asset.href).path] = \
+            synthetic_cog(WIDTH, HEIGHT, tile_size=TILE_SIZE, predictor=2, bigtiff=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def test_levels(self):
+        reader = COGReader(self.asset)
+        self.assertEqual([(600, 500), (300, 250), (150, 125)], [(lvl.width, lvl.height) for lvl in reader.levels])
+        self.assertEqual((ORIGIN[0], PIXEL_SIZE, 0.0, ORIGIN[1], 0.0, -PIXEL_SIZE), reader.geotransform)
+        self.assertEqual(0, reader.overview_level(0.1))
+        self.assertEqual(0, reader.overview_level(0.9))
+        self.assertEqual(1, reader.overview_level(1.0))
+        self.assertEqual(2, reader.overview_level(10.0))
+
+    def test_window(self):
+        reader = COGReader(self.asset)
+        bytes_before = self.asset_server.bytes_sent
+        window = reader.read(window=(100, 50, 40, 30), as_array=True)
+        np.testing.assert_array_equal(expected(100, 50, 40, 30), window)
+        # one tile, not the whole file
+        self.assertLess(self.asset_server.bytes_sent - bytes_before, len(self.cog) / 10)
+
+        # across four tiles, returned as bytes
+        data = reader.read(window=(120, 120, 20, 10))
+        self.assertEqual(expected(120, 120, 20, 10).tobytes(), data)
+
+        # clipped to the image
+        np.testing.assert_array_equal(expected(590, 490, 10, 10),
+                                      reader.read(window=(590, 490, 50, 50), as_array=True))
+        with self.assertRaises(ValueError):
+            reader.read(window=(700, 0, 10, 10))
+
+    def test_bbox(self):
+        minx, maxy = ORIGIN[0] + 200 * PIXEL_SIZE, ORIGIN[1] - 100 * PIXEL_SIZE
+        bbox = (minx, maxy - 16 * PIXEL_SIZE, minx + 32 * PIXEL_SIZE, maxy)
+        np.testing.assert_array_equal(expected(200, 100, 32, 16), read_window(self.asset, bbox=bbox, as_array=True))
+        # the first overview, at twice the pixel size
+        np.testing.assert_array_equal(expected(100, 50, 16, 8, scale=2),
+                                      read_window(self.asset, bbox=bbox, resolution=1.0, as_array=True))
+
+    def test_bigtiff_predictor(self):
+        reader = COGReader(self.big_asset, header_size=256)
+        self.assertEqual(3, len(reader.levels))
+        np.testing.assert_array_equal(expected(0, 0, WIDTH, HEIGHT), reader.read(as_array=True))
+        np.testing.assert_array_equal(expected(10, 20, 30, 40, scale=4),
+                                      reader.read(window=(40, 80, 120, 160), level=2, as_array=True))
+
+    def test_lzw(self):
+        data = bytes(synthetic_pixel(row, col, 0) for row in range(64) for col in range(128)) + bytes(range(256)) * 40
+        self.assertEqual(data, _lzw_decode(lzw_encode(data)))
+        # enough distinct strings to fill the table and clear it
+        noise = random.Random(1)
+        data = bytes(noise.getrandbits(8) for _ in range(20000))
+        self.assertEqual(data, _lzw_decode(lzw_encode(data)))
+
+    def test_chips(self):
+        windows = [(col, row, 24, 24) for col in range(0, 560, 40) for row in (10, 60, 300)]
+        chips = [(asset, window) for window in windows for asset in (self.asset, self.big_asset)]
+        full_resolution = COGReader(self.asset).levels[0]
+        tiles = sum(len(full_resolution.tiles(*window)) for window in windows)
+        requests_before = self.asset_server.requests
+        results = read_chips(chips, pixel_windows=True, as_array=True)
+        for (_, (col, row, width, height)), chip in zip(chips, results):
+            self.assertTrue(chip.ok)
+            np.testing.assert_array_equal(expected(col, row, width, height), chip.data)
+        # a header read per asset, then a few coalesced ranges instead of a request per tile
+        self.assertLess(self.asset_server.requests - requests_before, tiles / 4)
+
+        # by bbox, from the first overview
+        minx, maxy = ORIGIN[0] + 200 * PIXEL_SIZE, ORIGIN[1] - 100 * PIXEL_SIZE
+        bbox = (minx, maxy - 16 * PIXEL_SIZE, minx + 32 * PIXEL_SIZE, maxy)
+        self.assertEqual([expected(100, 50, 16, 8, scale=2).tobytes()],
+                         [chip.data for chip in read_chips([(self.asset, bbox)], resolution=1.0)])
+
+    def test_chip_errors(self):
+        missing = Asset()
+        missing.CopyFrom(self.asset)
+        missing.href = self.asset.href.replace('.tif', '_missing.tif')
+        missing.object_path = self.asset.object_path.replace('.tif', '_missing.tif')
+        self.asset_server.missing.add(urlparse(missing.href).path)
+        chips = [(self.asset, (0, 0, 16, 16)), (missing, (0, 0, 16, 16)), (self.asset, (700, 0, 10, 10)),
+                 (self.big_asset, (16, 16, 16, 16))]
+        results = read_chips(chips, pixel_windows=True, as_array=True)
+        # the missing asset and the window outside the image don't discard the chips that were read
+        self.assertEqual([True, False, False, True], [chip.ok for chip in results])
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertIsNone(results[1].data)
+        np.testing.assert_array_equal(expected(0, 0, 16, 16), results[0].data)
+        np.testing.assert_array_equal(expected(16, 16, 16, 16), results[3].data)
+
+    def test_coalesce(self):
+        ranges = [(300, 399, 'c'), (0, 99, 'a'), (100, 199, 'b'), (250, 260, 'x'), (10000, 10099, 'd')]
+        merged = _coalesce(ranges, max_gap=100, max_range_size=1000)
+        self.assertEqual([(0, 399), (10000, 10099)], [(start, end) for start, end, _ in merged])
+        self.assertEqual(['a', 'b', 'x', 'c'], [key for _, _, key in merged[0][2]])
+        # no gaps, and no range over 250 bytes
+        merged = _coalesce(ranges, max_gap=0, max_range_size=250)
+        self.assertEqual([(0, 199), (250, 260), (300, 399), (10000, 10099)], [(start, end) for start, end, _ in merged])
@@ -0,0 +1,194 @@
+import io
+import json
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from google.api_core.exceptions import Forbidden
+
+from nsl.stac import Asset, StacItem
+from nsl.stac.destinations import AWSDestination, DestinationDecoder, GCPDestination
+from nsl.stac.destinations.aws import MIN_PART_SIZE
+from nsl.stac.enum import AssetType, CloudPlatform
+
+
+class _Source:
+    def open(self, mode: str):
+        return io.BytesIO(b'streamed')
+
+
+class _Target:
+    """stands in for the target Blob, recording rewrite calls and uploads"""
+
+    def __init__(self, rewrites: int = 2, forbidden: bool = False):
+        self.rewrites = rewrites
+        self.forbidden = forbidden
+        self.tokens = []
+        self.uploaded = None
+
+    def rewrite(self, source, token=None, client=None):
+        if self.forbidden:
+            raise Forbidden('no access to the target bucket')
+        self.tokens.append(token)
+        token = 'token-{}'.format(len(self.tokens)) if len(self.tokens) < self.rewrites else None
+        return token, 0, 0
+
+    def upload_from_file(self, file_obj, client=None):
+        self.uploaded = file_obj.read()
+
+
+class _Destination(GCPDestination):
+    def __init__(self, target: _Target, cloud_platform: CloudPlatform = CloudPlatform.GCP):
+        super().__init__(bucket='target', region='us-central1')
+        self.target = target
+        self.src_asset = Asset(asset_type=AssetType.GEOTIFF, cloud_platform=cloud_platform, bucket='source',
+                               object_path='a.tif')
+
+    def asset(self, stac_item):
+        return self.src_asset
+
+    def src_blob(self, stac_item):
+        return _Source()
+
+    def target_blob(self, stac_item):
+        return self.target
+
+
+@mock.patch('nsl.stac.destinations.gcp.gcs_storage_client', mock.Mock(client=None))
+class TestGCPDestination(unittest.TestCase):
+    def test_server_side_copy(self):
+        target = _Target(rewrites=3)
+        _Destination(target).deliver('nsl_id', 'sub_id', StacItem(id='item'))
+        # the rewrite is continued until it's complete, and nothing is streamed
+        self.assertEqual([None, 'token-1', 'token-2'], target.tokens)
+        self.assertIsNone(target.uploaded)
+
+    def test_forbidden(self):
+        # streaming with the same credentials would fail too, the rewrite's error is raised
+        target = _Target(forbidden=True)
+        with self.assertRaises(Forbidden):
+            _Destination(target).deliver('nsl_id', 'sub_id', StacItem(id='item'))
+        self.assertIsNone(target.uploaded)
+
+    @mock.patch('nsl.stac.destinations.base.get_blob_metadata', return_value=None)
+    @mock.patch.object(_Destination, 'src_blob', GCPDestination.src_blob)
+    def test_missing(self, _):
+        with self.assertRaisesRegex(ValueError, 'not found error for gs://source/a.tif'):
+            _Destination(_Target()).deliver('nsl_id', 'sub_id', StacItem(id='item'))
+        with mock.patch('nsl.stac.destinations.base.default_cache', return_value=None), \
+                self.assertRaisesRegex(ValueError, 'not found error'):
+            _Destination(_Target(), cloud_platform=CloudPlatform.AWS).deliver('nsl_id', 'sub_id', StacItem(id='item'))
+
+    def test_streamed(self):
+        with mock.patch('nsl.stac.destinations.base.default_cache', return_value=None):
+            target = _Target()
+            _Destination(target, cloud_platform=CloudPlatform.AWS).deliver('nsl_id', 'sub_id', StacItem(id='item'))
+            self.assertEqual([], target.tokens)
+            self.assertEqual(b'streamed', target.uploaded)
+
+
+class _Blob:
+    """stands in for the source Blob"""
+
+    generation = 1
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.size = len(content)
+
+    def download_as_bytes(self, client=None, start=None, end=None, if_generation_match=None):
+        # long enough for concurrent parts to overlap
+        time.sleep(0.02)
+        return self.content[start:end + 1]
+
+
+class _S3Client:
+    """stands in for the S3 client, recording multipart uploads"""
+
+    def __init__(self, fail_part: int = None):
+        self.fail_part = fail_part
+        self.lock = threading.Lock()
+        self.parts = {}
+        self.active = 0
+        self.max_active = 0
+        self.objects = {}
+        self.aborted = False
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {'UploadId': 'upload'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if PartNumber == self.fail_part:
+            raise OSError('upload failed')
+        self.parts[PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = MultipartUpload['Parts']
+        self.objects[Key] = b''.join(self.parts[part['PartNumber']] for part in parts)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+
+class _AWSDestination(AWSDestination):
+    def __init__(self, content: bytes, client: _S3Client, **kwargs):
+        super().__init__(role_arn='role', bucket='target', region='us-east-1', **kwargs)
+        self.src = _Blob(content)
+        self.client = client
+
+    def asset(self, stac_item):
+        return Asset(asset_type=AssetType.GEOTIFF, cloud_platform=CloudPlatform.GCP, bucket='source',
+                     object_path='a.tif')
+
+    def src_blob(self, stac_item):
+        return self.src
+
+    @property
+    def s3(self):
+        return mock.Mock(meta=mock.Mock(client=self.client),
+                         Object=lambda bucket, key: mock.Mock(bucket_name=bucket, key=key))
+
+
+@mock.patch('nsl.stac.destinations.aws.gcs_storage_client', mock.Mock(client=None))
+@mock.patch('nsl.stac.destinations.aws.default_cache', mock.Mock(return_value=None))
+class TestAWSDestination(unittest.TestCase):
+    def test_multipart(self):
+        content = bytes(range(256)) * (MIN_PART_SIZE // 256) * 5 + b'last'
+        client = _S3Client()
+        destination = _AWSDestination(content, client, part_size=1, max_concurrency=3)
+        destination.deliver('nsl_id', 'sub_id', StacItem(id='item'))
+        self.assertEqual(content, client.objects['/item.tif'])
+        # parts are raised to the S3 minimum, and uploaded concurrently
+        self.assertEqual(6, len(client.parts))
+        self.assertEqual(3, client.max_active)
+
+    def test_small(self):
+        client = _S3Client()
+        _AWSDestination(b'small', client).deliver('nsl_id', 'sub_id', StacItem(id='item'))
+        self.assertEqual({'/item.tif': b'small'}, client.objects)
+
+    def test_abort(self):
+        client = _S3Client(fail_part=2)
+        with self.assertRaises(OSError):
+            destination = _AWSDestination(b'0' * MIN_PART_SIZE * 3, client, part_size=MIN_PART_SIZE)
+            destination.deliver('nsl_id', 'sub_id', StacItem(id='item'))
+        self.assertTrue(client.aborted)
+        self.assertEqual({}, client.objects)
+
+    def test_json(self):
+        destination = AWSDestination(role_arn='role', bucket='target', region='us-east-1',
+                                     part_size=MIN_PART_SIZE * 2, max_concurrency=3)
+        decoded = json.loads(destination.to_json_str(), cls=DestinationDecoder)
+        self.assertEqual((MIN_PART_SIZE * 2, 3), (decoded.part_size, decoded.max_concurrency))
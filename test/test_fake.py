@@ -0,0 +1,167 @@
+import http.client
+import io
+import os
+import tempfile
+import unittest
+
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from nsl.stac import StacRequest, CollectionRequest, EoRequest, FloatFilter, utils
+from nsl.stac.enum import AssetType, FilterRelationship, Platform
+from nsl.stac.experimental import NSLClientEx, StacRequestWrap
+from nsl.stac.fake import SyntheticCorpus, FakeAssetServer, FakeStacService, FakeStacServer
+
+
+class TestSyntheticCorpus(unittest.TestCase):
+    def test_deterministic(self):
+        corpus_1 = SyntheticCorpus(size=1000000, seed=7)
+        corpus_2 = SyntheticCorpus(size=1000000, seed=7)
+        self.assertEqual(1000000, len(corpus_1))
+        self.assertEqual(corpus_1[999999], corpus_2.item(999999))
+        self.assertNotEqual(corpus_1[0], SyntheticCorpus(size=1000000, seed=8)[0])
+        self.assertEqual(999999, corpus_1.index_of(corpus_1[-1].id))
+        self.assertIsNone(corpus_1.index_of("20190822T183518Z_746_POM1_ST2_P"))
+
+    def test_items(self):
+        corpus = SyntheticCorpus(size=10, asset_host='http://localhost:8080')
+        stac_item = corpus[3]
+        self.assertEqual(2, len(stac_item.assets))
+        asset = utils.get_asset(stac_item, asset_type=AssetType.GEOTIFF)
+        self.assertTrue(asset.href.startswith('http://localhost:8080/download/'))
+        self.assertEqual('REGION_0', utils.item_region(stac_item))
+        self.assertLess(corpus[3].observed.seconds, corpus[4].observed.seconds)
+        self.assertTrue(stac_item.HasField('geometry'))
+
+
+class TestFakeStacServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = FakeStacService(SyntheticCorpus(size=250), max_page_size=40)
+        cls.server = FakeStacServer(cls.service).start()
+        cls.client = cls.server.client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_search_paging(self):
+        self.assertEqual(10, len(list(self.client.search(StacRequest()))))
+        self.assertEqual(40, len(list(self.client.search(StacRequest(limit=100)))))
+        ids = [stac_item.id for stac_item in self.client.search(StacRequest(), auto_paginate=True, page_size=40)]
+        self.assertEqual(250, len(ids))
+        self.assertEqual(250, len(set(ids)))
+
+    def test_search_one_and_count(self):
+        stac_item = self.service.corpus[17]
+        self.assertEqual(stac_item, self.client.search_one(StacRequest(id=stac_item.id)))
+        self.assertEqual('', self.client.search_one(StacRequest(id='missing_0')).id)
+        self.assertEqual(250, self.client.count(StacRequest()))
+        self.assertEqual(125, self.client.count(StacRequest(platform_enum=Platform.SWIFT_3)))
+
+    def test_filters(self):
+        cloud_filter = FloatFilter(rel_type=FilterRelationship.LTE, value=0.1)
+        stac_request = StacRequest(eo=EoRequest(cloud_cover=cloud_filter))
+        expected = sum(1 for stac_item in self.service.corpus if stac_item.eo.cloud_cover.value <= 0.1)
+        self.assertEqual(expected, self.client.count(stac_request))
+
+        d_start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        d_end = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        stac_request = StacRequest(observed=utils.pb_timestampfield(FilterRelationship.BETWEEN,
+                                                                    start=d_start, end=d_end))
+        for stac_item in self.client.search(stac_request, auto_paginate=True):
+            observed = datetime.fromtimestamp(stac_item.observed.seconds, tz=timezone.utc)
+            self.assertTrue(d_start <= observed <= d_end)
+
+    def test_wrapped_client(self):
+        client_ex = self.server.client(NSLClientEx)
+        request_wrapped = StacRequestWrap()
+        request_wrapped.limit = 5
+        self.assertEqual(5, len(list(client_ex.search_ex(request_wrapped))))
+        collections = list(client_ex.search_collections(CollectionRequest()))
+        self.assertEqual(['NSL_SCENE_REGION_0'], [collection.id for collection in collections])
+        self.assertGreater(self.service.calls['SearchItems'], 0)
+
+
+class _RecordingService(FakeStacService):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the limit of every SearchItems request
+        self.limits = []
+
+    def SearchItems(self, request: StacRequest, context):
+        self.limits.append(request.limit)
+        return super().SearchItems(request, context)
+
+
+class TestAutoPaginate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = _RecordingService(SyntheticCorpus(size=250))
+        cls.server = FakeStacServer(cls.service).start()
+        cls.client = cls.server.client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.service.limits.clear()
+
+    def test_limit_over_page_size(self):
+        # pages of page_size, until the limit
+        stac_request = StacRequest(limit=100)
+        ids = [stac_item.id for stac_item in self.client.search(stac_request, auto_paginate=True, page_size=40)]
+        self.assertEqual([self.service.corpus[i].id for i in range(100)], ids)
+        self.assertEqual([40, 40, 20], self.service.limits)
+        self.assertEqual((100, 0), (stac_request.limit, stac_request.offset))
+
+    def test_limit_under_page_size(self):
+        ids = [stac_item.id for stac_item in self.client.search(StacRequest(limit=15), auto_paginate=True,
+                                                                page_size=40)]
+        self.assertEqual([self.service.corpus[i].id for i in range(15)], ids)
+        self.assertEqual([15], self.service.limits)
+
+    def test_no_limit(self):
+        self.assertEqual(250, len(list(self.client.search(StacRequest(), auto_paginate=True, page_size=100))))
+        # the last page is empty
+        self.assertEqual([100, 100, 100, 100], self.service.limits)
+
+
+class TestFakeAssetServer(unittest.TestCase):
+    def test_download(self):
+        with FakeAssetServer(sizes={'.tif': 100000, '.png': 1000}, require_auth=True) as asset_server, \
+                FakeStacServer(FakeStacService(SyntheticCorpus(size=5, asset_host=asset_server.url))) as server:
+            client = server.client()
+            stac_item = client.search_one(StacRequest())
+            asset = utils.get_asset(stac_item, asset_type=AssetType.GEOTIFF)
+            b = io.BytesIO()
+            utils.download_asset(asset=asset, file_obj=b)
+            expected = asset_server.content(urlparse(asset.href).path)
+            self.assertEqual(100000, len(expected))
+            self.assertEqual(expected, b.read())
+
+            with tempfile.TemporaryDirectory() as d:
+                asset = utils.get_asset(stac_item, asset_type=AssetType.THUMBNAIL)
+                file_path = utils.download_asset(asset=asset, save_directory=d)
+                self.assertEqual(1000, os.path.getsize(file_path))
+
+            asset_server.missing.add(urlparse(asset.href).path)
+            self.assertRaises(ValueError, utils.download_asset, asset=asset, file_obj=io.BytesIO())
+
+    def test_range(self):
+        with FakeAssetServer(default_size=1000) as asset_server:
+            conn = http.client.HTTPConnection(urlparse(asset_server.url).netloc)
+            conn.request('GET', '/a.bin', headers={'range': 'bytes=100-199'})
+            res = conn.getresponse()
+            self.assertEqual(206, res.status)
+            self.assertEqual(asset_server.content('/a.bin')[100:200], res.read())
+            conn.request('GET', '/a.bin', headers={'range': 'bytes=-10'})
+            res = conn.getresponse()
+            self.assertEqual(asset_server.content('/a.bin')[-10:], res.read())
+            conn.request('GET', '/a.bin', headers={'range': 'bytes=1000-'})
+            res = conn.getresponse()
+            res.read()
+            self.assertEqual(416, res.status)
+            conn.close()
+            self.assertEqual(3, asset_server.requests)
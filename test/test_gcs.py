@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from nsl.stac.gcs import GCSMetadataCache
+
+
+class _Bucket:
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+
+    def get_blob(self, blob_name: str):
+        with self.client.lock:
+            self.client.lookups.append((self.name, blob_name))
+        # long enough for concurrent lookups to overlap
+        time.sleep(0.05)
+        if blob_name.startswith('missing'):
+            return None
+        return object()
+
+
+class _Client:
+    """stands in for storage.Client, recording get_blob calls"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lookups = []
+        self.buckets = 0
+
+    def bucket(self, name: str) -> _Bucket:
+        self.buckets += 1
+        return _Bucket(self, name)
+
+
+class TestGCSMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.client = _Client()
+        self.cache = GCSMetadataCache(ttl=60, max_blobs=3, client=self.client)
+
+    def test_cached(self):
+        blob = self.cache.blob('bucket', '/a.tif')
+        self.assertIs(blob, self.cache.blob('bucket', 'a.tif'))
+        self.assertEqual([('bucket', 'a.tif')], self.client.lookups)
+        self.assertIsNot(blob, self.cache.blob('bucket', 'a.tif', refresh=True))
+        self.cache.invalidate('bucket', 'a.tif')
+        self.cache.blob('bucket', 'a.tif')
+        self.assertEqual(3, len(self.client.lookups))
+        # one bucket handle, made without a request
+        self.assertEqual(1, self.client.buckets)
+
+    def test_missing_not_cached(self):
+        self.assertIsNone(self.cache.blob('bucket', 'missing.tif'))
+        self.assertIsNone(self.cache.blob('bucket', 'missing.tif'))
+        self.assertEqual(2, len(self.client.lookups))
+
+    def test_expiry(self):
+        cache = GCSMetadataCache(ttl=0.01, client=self.client)
+        cache.blob('bucket', 'a.tif')
+        time.sleep(0.02)
+        cache.blob('bucket', 'a.tif')
+        self.assertEqual(2, len(self.client.lookups))
+
+    def test_max_blobs(self):
+        for name in ('a', 'b', 'c', 'd'):
+            self.cache.blob('bucket', name)
+        self.cache.blob('bucket', 'd')
+        self.cache.blob('bucket', 'a')
+        # 'a' was the oldest, so it was dropped when 'd' was added
+        self.assertEqual(5, len(self.client.lookups))
+
+    def test_blobs(self):
+        self.cache.blob('bucket', 'a')
+        locations = [('bucket', name) for name in ('a', 'b', 'missing', 'c')]
+        start = time.perf_counter()
+        blobs = self.cache.blobs(locations, max_workers=4)
+        elapsed = time.perf_counter() - start
+        self.assertEqual([True, True, False, True], [blob is not None for blob in blobs])
+        self.assertIs(self.cache.blob('bucket', 'a'), blobs[0])
+        # 'a' was cached and the other three were looked up at once
+        self.assertEqual(4, len(self.client.lookups))
+        self.assertLess(elapsed, 0.15)
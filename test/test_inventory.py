@@ -0,0 +1,111 @@
+import time
+import unittest
+
+from datetime import datetime, timezone
+from unittest import mock
+from urllib.parse import urlparse
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.stub import Stubber
+
+from nsl.stac import Asset, StacItem, experimental
+from nsl.stac.enum import AssetType, CloudPlatform
+from nsl.stac.fake import FakeAssetServer, SyntheticCorpus, use_fake_credentials
+from nsl.stac.gcs import GCSMetadataCache
+from nsl.stac.inventory import AssetChecker
+from nsl.stac.s3 import S3TransferEngine
+
+UPDATED = datetime(2020, 5, 1, tzinfo=timezone.utc)
+
+
+class _Blob:
+    size = 100
+    updated = UPDATED
+
+
+class _Bucket:
+    def get_blob(self, blob_name: str):
+        return None if blob_name.startswith('missing') else _Blob()
+
+
+class _Client:
+    def bucket(self, name: str) -> _Bucket:
+        return _Bucket()
+
+
+class TestAssetChecker(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={'.tif': 4096, '.png': 1024}, latency=0.05).start()
+        cls.corpus = SyntheticCorpus(size=20, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def test_hrefs(self):
+        missing = self.corpus[3].assets['THUMBNAIL_RGB']
+        self.asset_server.missing.add(urlparse(missing.href).path)
+        try:
+            start = time.perf_counter()
+            statuses = list(AssetChecker(max_workers=20).check_items(
+                (self.corpus[i] for i in range(20)), from_bucket=False, max_pending=10))
+            elapsed = time.perf_counter() - start
+        finally:
+            self.asset_server.missing.clear()
+
+        self.assertEqual([(self.corpus[i].id, asset_key) for i in range(20) for asset_key in self.corpus[i].assets],
+                         [(status.stac_id, status.asset_key) for status in statuses])
+        self.assertTrue(all(status.error is None for status in statuses))
+        self.assertEqual([False], [status.exists for status in statuses if status.asset.href == missing.href])
+        self.assertEqual({4096, 1024}, {status.size for status in statuses if status.exists})
+        # 40 HEAD requests of 0.05 seconds, 10 at a time
+        self.assertLess(elapsed, 40 * 0.05 / 2)
+
+        geotiffs = AssetChecker().check_items([self.corpus[0]], asset_type=AssetType.GEOTIFF, from_bucket=False)
+        self.assertEqual(['GEOTIFF_RGB'], [status.asset_key for status in geotiffs])
+
+    def test_buckets(self):
+        session = boto3.session.Session(aws_access_key_id='fake', aws_secret_access_key='fake',
+                                        region_name='us-east-1')
+        s3_engine = S3TransferEngine(config=TransferConfig(use_threads=False), session=session)
+        checker = AssetChecker(max_workers=1, s3_engine=s3_engine, gcs_cache=GCSMetadataCache(client=_Client()))
+        stac_item = StacItem(id='item')
+        stac_item.assets['gcp'].CopyFrom(Asset(cloud_platform=CloudPlatform.GCP, bucket='b', object_path='a.tif'))
+        stac_item.assets['gcp_missing'].CopyFrom(Asset(cloud_platform=CloudPlatform.GCP, bucket='b',
+                                                       object_path='missing.tif'))
+        stac_item.assets['aws'].CopyFrom(Asset(cloud_platform=CloudPlatform.AWS, bucket='b', object_path='a.tif'))
+        stac_item.assets['unknown'].CopyFrom(Asset(bucket='b', object_path='a.tif'))
+
+        with Stubber(s3_engine.client) as stubber:
+            stubber.add_response('head_object', {'ContentLength': 200, 'LastModified': UPDATED},
+                                 {'Bucket': 'b', 'Key': 'a.tif', 'RequestPayer': 'requester'})
+            statuses = {status.asset_key: status for status in checker.check_items([stac_item], requester_pays=True)}
+
+        self.assertEqual((True, 100, UPDATED), (statuses['gcp'].exists, statuses['gcp'].size,
+                                                statuses['gcp'].last_modified))
+        self.assertFalse(statuses['gcp_missing'].exists)
+        self.assertEqual({'stac_id': 'item', 'asset_key': 'aws', 'exists': True, 'size': 200,
+                          'last_modified': UPDATED, 'error': None}, statuses['aws'].as_dict())
+        self.assertIsInstance(statuses['unknown'].error, ValueError)
+
+
+class TestCheckAssetsExist(unittest.TestCase):
+    def setUp(self):
+        self.stac_item = StacItem(id='item')
+        self.stac_item.assets['a'].CopyFrom(Asset(cloud_platform=CloudPlatform.GCP, bucket='b', object_path='a.tif'))
+        self.stac_item.assets['missing'].CopyFrom(Asset(cloud_platform=CloudPlatform.GCP, bucket='b',
+                                                        object_path='missing.tif'))
+
+    @mock.patch.object(experimental, '_asset_checker', AssetChecker(gcs_cache=GCSMetadataCache(client=_Client())))
+    def test_b_raise(self):
+        self.assertEqual(['a', 'missing'], experimental._check_assets_exist(self.stac_item, b_raise=False))
+        with self.assertRaises(ValueError):
+            experimental._check_assets_exist(self.stac_item, b_raise=True)
+
+        # assets on no supported cloud platform raise, even with an href
+        self.stac_item.assets['href'].CopyFrom(Asset(href='https://example.com/a.tif', object_path='a.tif'))
+        with self.assertRaises(ValueError):
+            experimental._check_assets_exist(self.stac_item, b_raise=False)
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from urllib.parse import urlparse
+
+from epl.protobuf.v1.stac_pb2 import StacRequest
+
+from nsl.stac.enum import AssetType
+from nsl.stac.experimental import StacItemWrap
+from nsl.stac.fake import FakeAssetServer, FakeStacServer, FakeStacService, SyntheticCorpus, use_fake_credentials
+from nsl.stac.jobs import DownloadJob, DownloadManifest
+
+
+class _Crash(Exception):
+    pass
+
+
+class TestDownloadJob(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=8 * 1024).start()
+        cls.corpus = SyntheticCorpus(size=12, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.directory.name, 'manifest.db')
+        self.save_directory = os.path.join(self.directory.name, 'assets')
+        os.mkdir(self.save_directory)
+        self.stac_items = [self.corpus[i] if i % 2 else StacItemWrap(self.corpus[i]) for i in range(6)]
+
+    def tearDown(self):
+        self.asset_server.missing.clear()
+        self.directory.cleanup()
+
+    def job(self, **kwargs) -> DownloadJob:
+        kwargs.setdefault('stac_items', self.stac_items)
+        return DownloadJob(self.manifest_path, self.save_directory, max_workers=2, **kwargs)
+
+    def test_resume(self):
+        missing = self.corpus[1].assets['THUMBNAIL_RGB']
+        self.asset_server.missing.add(urlparse(missing.href).path)
+        completed = []
+
+        def crash(result):
+            completed.append(result)
+            if len(completed) == 5:
+                raise _Crash()
+
+        with self.job() as job, self.assertRaises(_Crash):
+            job.run(on_result=crash)
+
+        self.asset_server.missing.clear()
+        requests_before = self.asset_server.requests
+        with self.job() as job:
+            summary = job.run()
+            # the downloads completed before the crash, apart from the failed one, aren't repeated
+            failed = 1 if any(not result.ok for result in completed) else 0
+            self.assertEqual({'done': 12 - 5 + failed, 'failed': 0, 'skipped': 5 - failed}, summary)
+            self.assertEqual(12 - 5 + failed, self.asset_server.requests - requests_before)
+            self.assertEqual({'done': 12}, job.manifest.counts())
+            for entry in job.manifest.entries():
+                with open(entry.save_filename, 'rb') as file_obj:
+                    content = file_obj.read()
+                self.assertEqual(len(content), entry.size)
+
+        with self.job() as job:
+            self.assertEqual({'done': 0, 'failed': 0, 'skipped': 12}, job.run())
+            # a file that's gone is downloaded again
+            os.remove(job.manifest.entries()[0].save_filename)
+            self.assertEqual({'done': 1, 'failed': 0, 'skipped': 11}, job.run())
+            # as is one that changed, even with the same size
+            entry = job.manifest.entries()[1]
+            with open(entry.save_filename, 'r+b') as file_obj:
+                file_obj.write(b'\0')
+            os.utime(entry.save_filename, (entry.mtime + 1, entry.mtime + 1))
+            self.assertEqual({'done': 1, 'failed': 0, 'skipped': 11}, job.run())
+
+            # a change that kept the size and modification time is only found by reading the file
+            entry = job.manifest.entries()[2]
+            with open(entry.save_filename, 'r+b') as file_obj:
+                file_obj.write(b'\0')
+            os.utime(entry.save_filename, (entry.mtime, entry.mtime))
+            self.assertEqual({'done': 0, 'failed': 0, 'skipped': 12}, job.run())
+        with self.job(verify_complete=True) as job:
+            self.assertEqual({'done': 1, 'failed': 0, 'skipped': 11}, job.run())
+
+    def test_missing_asset_key(self):
+        stac_items = [StacItemWrap(self.corpus[i]) for i in range(3)]
+        del stac_items[1].stac_item.assets['THUMBNAIL_RGB']
+        with self.job(stac_items=stac_items, asset_key='THUMBNAIL_RGB') as job:
+            self.assertEqual({'done': 2, 'failed': 1, 'skipped': 0}, job.run())
+            entry = job.manifest.get(self.corpus[1].id, 'THUMBNAIL_RGB')
+        self.assertEqual('failed', entry.status)
+        self.assertIn('not found', entry.error)
+
+    def test_manifest(self):
+        thumbnail = self.corpus[0].assets['THUMBNAIL_RGB']
+        with self.job(asset_type=AssetType.THUMBNAIL) as job:
+            self.assertEqual({'done': 6, 'failed': 0, 'skipped': 0}, job.run())
+            entry = job.manifest.get(self.corpus[0].id, 'THUMBNAIL_RGB')
+        self.assertTrue(entry.complete)
+        self.assertEqual(os.path.join(self.save_directory, os.path.basename(thumbnail.object_path)),
+                         entry.save_filename)
+        self.assertEqual(hashlib.md5(self.asset_server.content(urlparse(thumbnail.href).path)).hexdigest(),
+                         entry.md5)
+
+        # another selection of assets is another job
+        with self.assertRaises(ValueError):
+            self.job(asset_type=AssetType.GEOTIFF)
+        with DownloadManifest(self.manifest_path) as manifest:
+            self.assertEqual(6, len(manifest.entries(status='done')))
+
+    def test_stac_request(self):
+        corpus = SyntheticCorpus(size=30, asset_host=self.asset_server.url)
+        with FakeStacServer(FakeStacService(corpus, max_page_size=10)) as server:
+            with self.job(stac_items=None, stac_request=StacRequest(limit=25), client=server.client(),
+                          asset_type=AssetType.GEOTIFF) as job:
+                self.assertEqual({'done': 25, 'failed': 0, 'skipped': 0}, job.run())
+        self.assertEqual(25, len(os.listdir(self.save_directory)))
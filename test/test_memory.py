@@ -0,0 +1,49 @@
+import unittest
+
+from benchmarks.memory import traced, workloads
+from nsl.stac.experimental import NSLClientEx
+from nsl.stac.fake import FakeAssetServer, FakeStacServer, FakeStacService, SyntheticCorpus
+
+SMALL = 100
+LARGE = 300
+PAGE_SIZE = 25
+# allowed growth of peak traced allocations for each additional item searched. streaming paths should hold about one
+# page at a time no matter how long the search, while a feature collection keeps every feature
+MAX_BYTES_PER_ITEM = {'search': 2 * 1024, 'wrap': 2 * 1024, 'download': 2 * 1024, 'feature': 16 * 1024}
+
+
+class TestMemoryPerItem(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.asset_server = FakeAssetServer(sizes={'.png': 16 * 1024}).start()
+        cls.server = FakeStacServer(FakeStacService(SyntheticCorpus(size=LARGE,
+                                                                    asset_host=cls.asset_server.url))).start()
+        client_ex = cls.server.client(NSLClientEx)
+        cls.small = workloads(client_ex, SMALL, PAGE_SIZE)
+        cls.large = workloads(client_ex, LARGE, PAGE_SIZE)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.asset_server.stop()
+
+    def assert_per_item(self, path: str):
+        # warm up caches (descriptor pools, connections) so they don't count against the smaller run
+        self.small[path]()
+        small_peak = traced(self.small[path])['traced_peak_bytes']
+        large_peak = traced(self.large[path])['traced_peak_bytes']
+        per_item = (large_peak - small_peak) / (LARGE - SMALL)
+        self.assertLess(per_item, MAX_BYTES_PER_ITEM[path],
+                        "{0} peak memory grows {1:.0f} bytes per item".format(path, per_item))
+
+    def test_search(self):
+        self.assert_per_item('search')
+
+    def test_wrap(self):
+        self.assert_per_item('wrap')
+
+    def test_feature(self):
+        self.assert_per_item('feature')
+
+    def test_download(self):
+        self.assert_per_item('download')
@@ -0,0 +1,69 @@
+import io
+import os
+import pstats
+import tempfile
+import unittest
+
+from nsl.stac import StacRequest, profiling, utils
+from nsl.stac.enum import AssetType
+from nsl.stac.experimental import NSLClientEx, StacRequestWrap
+from nsl.stac.fake import FakeAssetServer, FakeStacServer, FakeStacService, SyntheticCorpus
+
+
+class TestProfiling(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.asset_server = FakeAssetServer().start()
+        cls.server = FakeStacServer(FakeStacService(SyntheticCorpus(size=30, asset_host=cls.asset_server.url))).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        profiling.reset()
+        self.directory.cleanup()
+
+    def test_off(self):
+        client = self.server.client()
+        self.assertNotIn('search', vars(client))
+        self.assertFalse(hasattr(utils.download_asset, '_nsl_profiled'))
+
+    def test_per_call(self):
+        client = self.server.client(NSLClientEx, profile_dir=self.directory.name)
+        stac_items = list(client.search(StacRequest(), auto_paginate=True, page_size=7))
+        self.assertEqual(30, len(stac_items))
+        self.assertEqual(30, client.count(StacRequest()))
+        asset = utils.get_asset(stac_items[0], asset_type=AssetType.THUMBNAIL)
+        utils.download_asset(asset=asset, file_obj=io.BytesIO())
+
+        names = sorted(filename.split('.')[1] for filename in os.listdir(self.directory.name))
+        # one profile per outermost call. download_href_object is part of download_asset's profile
+        self.assertEqual(['count', 'download_asset', 'search'], names)
+        search_file = [filename for filename in os.listdir(self.directory.name) if '.search.' in filename][0]
+        stats = pstats.Stats(os.path.join(self.directory.name, search_file))
+        self.assertTrue(any(func_name == '_search_all' for _, _, func_name in stats.stats))
+
+        # a second client with profiling off is untouched
+        self.assertNotIn('search', vars(self.server.client()))
+
+    def test_aggregate(self):
+        profiler = profiling.get_profiler(self.directory.name, mode='aggregate')
+        client = self.server.client(NSLClientEx, profile_dir=self.directory.name)
+        request_wrapped = StacRequestWrap()
+        request_wrapped.limit = 5
+        for _ in range(3):
+            self.assertEqual(5, len(list(client.search_ex(request_wrapped))))
+            self.assertEqual(30, client.count_ex(request_wrapped))
+        self.assertEqual([], os.listdir(self.directory.name))
+
+        profiler.dump()
+        self.assertEqual(['NSLClientEx.count_ex.prof', 'NSLClientEx.search_ex.prof'],
+                         sorted(os.listdir(self.directory.name)))
+        stats = pstats.Stats(os.path.join(self.directory.name, 'NSLClientEx.count_ex.prof'))
+        self.assertEqual(3, [calls for (_, _, func_name), (calls, *_) in stats.stats.items()
+                             if func_name == 'count_ex'][0])
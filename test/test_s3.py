@@ -0,0 +1,71 @@
+import io
+import threading
+import unittest
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from nsl.stac.s3 import S3TransferEngine
+
+
+class TestS3TransferEngine(unittest.TestCase):
+    def setUp(self):
+        session = boto3.session.Session(aws_access_key_id='fake', aws_secret_access_key='fake',
+                                        region_name='us-east-1')
+        self.engine = S3TransferEngine(config=TransferConfig(use_threads=False), session=session)
+        self.stubber = Stubber(self.engine.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_shared_client(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(self.engine.client)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(client is self.engine.client for client in clients))
+
+    def test_download(self):
+        data = b'\x01' * 1000
+        transfers = []
+        self.engine.on_transfer = transfers.append
+        self.engine.set_requester_pays('bucket')
+        self.stubber.add_response('head_object', {'ContentLength': len(data), 'ETag': '"etag"'},
+                                  {'Bucket': 'bucket', 'Key': 'key.tif', 'RequestPayer': 'requester'})
+        self.stubber.add_response('get_object', {'Body': StreamingBody(io.BytesIO(data), len(data)),
+                                                 'ContentLength': len(data), 'ETag': '"etag"'})
+
+        file_obj = io.BytesIO()
+        transfer = self.engine.download('bucket', 'key.tif', file_obj=file_obj)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(data, file_obj.getvalue())
+        self.assertEqual(len(data), transfer.size)
+        self.assertGreater(transfer.throughput, 0)
+        self.assertEqual([transfer], transfers)
+
+        with self.assertRaises(ValueError):
+            self.engine.download('bucket', 'key.tif')
+
+    def test_requester_pays(self):
+        self.assertEqual({}, self.engine.extra_args('bucket'))
+        self.assertEqual({'RequestPayer': 'requester'}, self.engine.extra_args('bucket', requester_pays=True))
+        self.engine.set_requester_pays('bucket')
+        self.assertEqual({'RequestPayer': 'requester'}, self.engine.extra_args('bucket'))
+        self.assertEqual({}, self.engine.extra_args('other'))
+        self.engine.set_requester_pays('bucket', False)
+        self.assertEqual({}, self.engine.extra_args('bucket'))
+
+    def test_head(self):
+        self.stubber.add_response('head_object', {'ContentLength': 10}, {'Bucket': 'bucket', 'Key': 'found'})
+        self.stubber.add_client_error('head_object', service_error_code='404', http_status_code=404)
+        self.stubber.add_client_error('head_object', service_error_code='403', http_status_code=403)
+        self.assertEqual(10, self.engine.head('bucket', 'found')['ContentLength'])
+        self.assertIsNone(self.engine.head('bucket', 'missing'))
+        with self.assertRaises(ClientError):
+            self.engine.head('bucket', 'forbidden')
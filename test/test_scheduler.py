@@ -0,0 +1,178 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from nsl.stac import Asset, utils
+from nsl.stac.enum import AssetType, CloudPlatform
+from nsl.stac.fake import FakeAssetServer, SyntheticCorpus, use_fake_credentials
+from nsl.stac.scheduler import DownloadScheduler, TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        bucket = TokenBucket(rate=10000, burst=1000)
+        start = time.perf_counter()
+        for _ in range(6):
+            bucket.consume(1000)
+        # the burst, then 4000 bytes at 10000 a second before the last consumer is let through, in debt
+        self.assertGreaterEqual(time.perf_counter() - start, 0.35)
+
+    def test_priority(self):
+        bucket = TokenBucket(rate=10000, burst=1000)
+        bucket.consume(3000)
+        order = []
+
+        def consume(priority: int):
+            bucket.consume(1000, priority)
+            order.append(priority)
+
+        backfill = threading.Thread(target=consume, args=(2,))
+        backfill.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=consume, args=(0,))
+        interactive.start()
+        backfill.join()
+        interactive.join()
+        # the bucket was in debt when both waited, the urgent consumer went first
+        self.assertEqual([0, 2], order)
+
+
+class TestDownloadScheduler(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=32 * 1024, latency=0.1).start()
+        cls.slow_server = FakeAssetServer(sizes={}, default_size=32 * 1024, latency=1.0).start()
+        cls.corpus = SyntheticCorpus(size=6, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+        cls.slow_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.assets = [utils.get_asset(self.corpus[i], asset_type=AssetType.THUMBNAIL) for i in range(6)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_priority(self):
+        completed = []
+        with DownloadScheduler(max_workers=1) as scheduler:
+            futures = [scheduler.submit(asset, stac_id=str(i), priority='backfill',
+                                        save_directory=self.directory.name) for i, asset in enumerate(self.assets[:5])]
+            for future in futures:
+                future.add_done_callback(lambda f: completed.append(f.result().stac_id))
+            while scheduler.stats()['backfill'].active == 0:
+                time.sleep(0.01)
+            self.assertEqual(4, scheduler.stats()['backfill'].queued)
+            scheduler.submit(self.assets[5], stac_id='5', priority='interactive',
+                             save_directory=self.directory.name).add_done_callback(
+                lambda f: completed.append(f.result().stac_id))
+        # the interactive download skipped ahead of the queued backfill
+        self.assertEqual(['0', '5'], completed[:2])
+        self.assertEqual(6, len(completed))
+        stats = scheduler.stats()
+        self.assertEqual(5, stats['backfill'].completed)
+        self.assertEqual(1, stats['interactive'].completed)
+        self.assertEqual(0, stats['backfill'].queued + stats['backfill'].active)
+        self.assertEqual(32 * 1024, stats['interactive'].bytes)
+        self.assertGreater(stats['backfill'].throughput, 0)
+
+        with DownloadScheduler(max_workers=1) as scheduler, self.assertRaises(ValueError):
+            scheduler.submit(self.assets[0], priority='urgent')
+
+    def test_bandwidth(self):
+        with DownloadScheduler(max_workers=4, max_bytes_per_second=64 * 1024) as scheduler:
+            start = time.perf_counter()
+            results = scheduler.download(self.assets[:4], save_directory=self.directory.name)
+            elapsed = time.perf_counter() - start
+        self.assertTrue(all(result.ok for result in results))
+        # 128KB at 64KB a second, after a burst of 64KB. the last chunk is let through in debt
+        self.assertGreaterEqual(elapsed, 0.5)
+        self.assertEqual(128 * 1024, scheduler.stats()['default'].bytes)
+
+    def test_busy_host(self):
+        slow_corpus = SyntheticCorpus(size=3, asset_host=self.slow_server.url)
+        slow_assets = [utils.get_asset(slow_corpus[i], asset_type=AssetType.THUMBNAIL) for i in range(3)]
+        with DownloadScheduler(max_workers=2, max_per_host=1) as scheduler:
+            start = time.perf_counter()
+            backfill = [scheduler.submit(asset, priority='backfill', file_obj=io.BytesIO()) for asset in slow_assets]
+            while scheduler.stats()['backfill'].active == 0:
+                time.sleep(0.01)
+            interactive = scheduler.submit(self.assets[0], priority='interactive', file_obj=io.BytesIO())
+            self.assertTrue(interactive.result().ok)
+            elapsed = time.perf_counter() - start
+            # the slow host's queued downloads don't hold the second worker
+            self.assertLess(elapsed, 0.5)
+            self.assertEqual(2, scheduler.stats()['backfill'].queued)
+            self.assertTrue(all(future.result().ok for future in backfill))
+
+    def test_thumbnails(self):
+        with DownloadScheduler(max_workers=2, max_bytes_per_second=1024 * 1024) as scheduler:
+            results = list(scheduler.load_thumbnails([self.corpus[i] for i in range(3)], priority='interactive'))
+        self.assertEqual([32 * 1024] * 3, [len(result.data) for result in results])
+        # queued, throttled and counted like the other downloads
+        self.assertEqual(3, scheduler.stats()['interactive'].completed)
+        self.assertEqual(3 * 32 * 1024, scheduler.stats()['interactive'].bytes)
+
+
+class TestBucketDownloads(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.asset = Asset(cloud_platform=CloudPlatform.GCP, bucket='bucket', object_path='a.tif')
+        self.save_filename = os.path.join(self.directory.name, 'a.tif')
+        with open(self.save_filename, 'wb') as file_obj:
+            file_obj.write(b'existing')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def download(self, **download_kwargs):
+        with DownloadScheduler(max_workers=1, max_bytes_per_second=1024 * 1024) as scheduler:
+            return scheduler.submit(self.asset, save_filename=self.save_filename, from_bucket=True,
+                                    **download_kwargs).result()
+
+    def read(self) -> bytes:
+        with open(self.save_filename, 'rb') as file_obj:
+            return file_obj.read()
+
+    def test_skip_unchanged(self):
+        remote = (len(b'existing'), hashlib.md5(b'existing').hexdigest(), None)
+        with mock.patch.object(utils, 'remote_checksums', return_value=remote), \
+                mock.patch.object(utils, 'download_asset') as download_asset:
+            self.assertTrue(self.download(skip_unchanged=True).ok)
+        download_asset.assert_not_called()
+        self.assertEqual(b'existing', self.read())
+
+    def test_replaced_once_complete(self):
+        def fail(asset, file_obj, **kwargs):
+            file_obj.write(b'partial')
+            raise OSError('connection reset')
+
+        def succeed(asset, file_obj, **kwargs):
+            file_obj.write(b'downloaded')
+            return file_obj.name
+
+        with mock.patch.object(utils, 'download_asset', side_effect=fail):
+            self.assertFalse(self.download().ok)
+        # the file that was there is kept, and no temporary file is left
+        self.assertEqual(b'existing', self.read())
+        self.assertEqual(['a.tif'], os.listdir(self.directory.name))
+
+        with mock.patch.object(utils, 'download_asset', side_effect=succeed):
+            result = self.download()
+        self.assertEqual(self.save_filename, result.save_filename)
+        self.assertEqual(b'downloaded', self.read())
+        self.assertEqual(['a.tif'], os.listdir(self.directory.name))
+
+    def test_resumable(self):
+        with self.assertRaises(ValueError):
+            self.download(resumable=True)
@@ -0,0 +1,647 @@
+import hashlib
+import importlib.util
+import io
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import time
+import unittest
+import zlib
+
+from unittest import mock
+from urllib.parse import urlparse
+
+from nsl.stac import Asset, StacItem, utils
+from nsl.stac.cache import AssetCache
+from nsl.stac.connections import ConnectionPool, http_connection_pool
+from nsl.stac.enum import AssetType, CloudPlatform
+from nsl.stac.experimental import StacItemWrap
+from nsl.stac.fake import FakeAssetServer, SyntheticCorpus, use_fake_credentials
+from nsl.stac.transfer import DownloadEngine, download_many, download_segmented, load_thumbnails
+
+
+class TestDownloadEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(default_size=1024, sizes={'.tif': 4096}, latency=0.1).start()
+        cls.corpus = SyntheticCorpus(size=20, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_download_assets(self):
+        stac_item = self.corpus[0]
+        with DownloadEngine(max_workers=4) as engine:
+            results = engine.download_assets(stac_item, save_directory=self.directory.name)
+        self.assertEqual(2, len(results))
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual({'GEOTIFF_RGB', 'THUMBNAIL_RGB'}, {result.asset_key for result in results})
+        for result in results:
+            with open(result.save_filename, 'rb') as file_obj:
+                self.assertEqual(self.asset_server.content(urlparse(result.asset.href).path), file_obj.read())
+
+        filenames = utils.download_assets(self.corpus[1], save_directory=self.directory.name, max_workers=2)
+        self.assertEqual(2, len(filenames))
+        self.assertTrue(all(os.path.exists(filename) for filename in filenames))
+
+    def test_errors(self):
+        missing = utils.get_asset(self.corpus[2], asset_type=AssetType.THUMBNAIL)
+        self.asset_server.missing.add(urlparse(missing.href).path)
+        try:
+            stac_items = [StacItemWrap(self.corpus[i]) for i in range(2, 5)]
+            with DownloadEngine(max_workers=4) as engine:
+                results = list(engine.download_items(stac_items, save_directory=self.directory.name,
+                                                     asset_type=AssetType.THUMBNAIL))
+            self.assertEqual(3, len(results))
+            failed = [result for result in results if not result.ok]
+            self.assertEqual(1, len(failed))
+            self.assertEqual(self.corpus[2].id, failed[0].stac_id)
+            self.assertIsInstance(failed[0].error, ValueError)
+
+            with self.assertRaises(ValueError):
+                utils.download_assets(self.corpus[2], save_directory=self.directory.name, max_workers=2)
+        finally:
+            self.asset_server.missing.clear()
+
+    def test_host_limit(self):
+        assets = [utils.get_asset(self.corpus[i], asset_type=AssetType.THUMBNAIL) for i in range(8)]
+
+        start = time.perf_counter()
+        results = download_many(assets, self.directory.name, max_workers=8, max_per_host=2)
+        limited = time.perf_counter() - start
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([asset.href for asset in assets], [result.asset.href for result in results])
+        # 8 downloads of 0.1 seconds, 2 at a time
+        self.assertGreaterEqual(limited, 0.4)
+
+        start = time.perf_counter()
+        download_many(assets, self.directory.name, max_workers=8, max_per_host=8)
+        self.assertLess(time.perf_counter() - start, limited)
+
+    def test_no_head_of_line_blocking(self):
+        busy = [utils.get_asset(self.corpus[i], asset_type=AssetType.THUMBNAIL) for i in range(11, 15)]
+        with FakeAssetServer(sizes={}, default_size=1024) as other_server:
+            other = utils.get_asset(SyntheticCorpus(size=1, asset_host=other_server.url)[0],
+                                    asset_type=AssetType.THUMBNAIL)
+            with DownloadEngine(max_workers=2, max_per_host=1) as engine:
+                start = time.perf_counter()
+                futures = [engine.submit(asset, save_directory=self.directory.name) for asset in busy + [other]]
+                self.assertTrue(futures[-1].result().ok)
+                # the busy host's queued downloads don't hold the free worker
+                self.assertLess(time.perf_counter() - start, 0.2)
+                self.assertTrue(all(future.result().ok for future in futures))
+
+    def test_load_thumbnails(self):
+        no_thumbnail = StacItem()
+        no_thumbnail.CopyFrom(self.corpus[9])
+        del no_thumbnail.assets['THUMBNAIL_RGB']
+        stac_items = [self.corpus[i] if i % 2 else StacItemWrap(self.corpus[i]) for i in range(9)] + [no_thumbnail]
+
+        results = list(load_thumbnails(iter(stac_items), max_workers=4, max_pending=3))
+        self.assertEqual([self.corpus[i].id for i in range(10)], [result.stac_id for result in results])
+        for result in results[:9]:
+            self.assertTrue(result.ok)
+            self.assertEqual('THUMBNAIL_RGB', result.asset_key)
+            self.assertEqual(self.asset_server.content(urlparse(result.asset.href).path), result.data)
+            self.assertEqual('', result.save_filename)
+        self.assertIsInstance(results[9].error, ValueError)
+        self.assertIsNone(results[9].data)
+
+    @unittest.skipUnless(importlib.util.find_spec('PIL'), "needs Pillow")
+    def test_load_thumbnails_as_array(self):
+        import numpy as np
+
+        pixels = np.arange(4 * 3 * 3, dtype=np.uint8).reshape((4, 3, 3))
+        thumbnail = utils.get_asset(self.corpus[10], asset_type=AssetType.THUMBNAIL)
+        self.asset_server.files[urlparse(thumbnail.href).path] = _png(pixels)
+        try:
+            results = list(load_thumbnails([self.corpus[10]], as_array=True))
+            self.assertTrue(results[0].ok)
+            np.testing.assert_array_equal(pixels, results[0].data)
+        finally:
+            self.asset_server.files.clear()
+
+
+def _png(pixels) -> bytes:
+    """an RGB PNG of a (rows, columns, 3) uint8 array"""
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + \
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    rows, columns = pixels.shape[:2]
+    # each row of pixels starts with filter type 0, none
+    raw = b''.join(b'\x00' + pixels[row].tobytes() for row in range(rows))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', columns, rows, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+class _RecordingBuffer(io.BytesIO):
+    def __init__(self):
+        super().__init__()
+        self.write_sizes = []
+
+    def write(self, data):
+        self.write_sizes.append(len(data))
+        return super().write(data)
+
+
+class TestStreamingDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={'.tif': 300 * 1024}).start()
+        cls.asset = utils.get_asset(SyntheticCorpus(size=1, asset_host=cls.asset_server.url)[0],
+                                    asset_type=AssetType.GEOTIFF)
+        cls.content = cls.asset_server.content(urlparse(cls.asset.href).path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def test_chunks(self):
+        progress = []
+        checksum = hashlib.md5()
+        buffer = _RecordingBuffer()
+        utils.download_href_object(self.asset, file_obj=buffer, chunk_size=64 * 1024,
+                                   progress=lambda written, total: progress.append((written, total)),
+                                   checksum=checksum)
+        self.assertEqual(self.content, buffer.getvalue())
+        # never more than one chunk in hand at a time
+        self.assertLessEqual(max(buffer.write_sizes), 64 * 1024)
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+        self.assertGreaterEqual(len(progress), 5)
+        self.assertEqual(sorted(progress), progress)
+        self.assertEqual((len(self.content), len(self.content)), progress[-1])
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = utils.download_asset(self.asset, save_directory=directory)
+            with open(filename, 'rb') as file_obj:
+                self.assertEqual(self.content, file_obj.read())
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_keep_alive(self):
+        use_fake_credentials()
+        with FakeAssetServer() as asset_server:
+            corpus = SyntheticCorpus(size=10, asset_host=asset_server.url)
+            netloc = urlparse(asset_server.url).netloc
+            for stac_item in corpus:
+                utils.download_asset(utils.get_asset(stac_item, asset_type=AssetType.THUMBNAIL), file_obj=io.BytesIO())
+            self.assertEqual(10, asset_server.requests)
+            self.assertEqual(1, asset_server.connections)
+            self.assertEqual(1, http_connection_pool.idle_count('http', netloc))
+
+            # an error response closes its connection rather than returning it to the pool
+            missing = utils.get_asset(corpus[0], asset_type=AssetType.THUMBNAIL)
+            asset_server.missing.add(urlparse(missing.href).path)
+            with self.assertRaises(ValueError):
+                utils.download_asset(missing, file_obj=io.BytesIO())
+            self.assertEqual(0, http_connection_pool.idle_count('http', netloc))
+
+            # threads share the pool
+            with DownloadEngine(max_workers=4, max_per_host=4) as engine, tempfile.TemporaryDirectory() as directory:
+                results = engine.download([utils.get_asset(stac_item, asset_type=AssetType.GEOTIFF)
+                                           for stac_item in corpus] * 3, save_directory=directory)
+            self.assertTrue(all(result.ok for result in results))
+            self.assertLessEqual(asset_server.connections, 6)
+
+    def test_stale_connection(self):
+        pool = ConnectionPool()
+        with FakeAssetServer() as asset_server:
+            netloc = urlparse(asset_server.url).netloc
+            with pool.request('GET', 'http', netloc, '/a.png') as res:
+                self.assertEqual(64 * 1024, len(res.read()))
+            self.assertEqual(1, pool.idle_count('http', netloc))
+
+            # the idle connection goes away, as when a server times out keep-alive connections
+            pool._idle[('http', netloc)][0].sock.shutdown(socket.SHUT_RDWR)
+            with pool.request('GET', 'http', netloc, '/a.png') as res:
+                self.assertEqual(200, res.status)
+                res.read()
+            self.assertEqual(2, asset_server.connections)
+            self.assertEqual(1, pool.idle_count('http', netloc))
+        pool.close()
+        self.assertEqual(0, pool.idle_count('http', netloc))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs os.fork")
+    def test_fork(self):
+        pool = ConnectionPool()
+        with FakeAssetServer() as asset_server:
+            netloc = urlparse(asset_server.url).netloc
+            with pool.request('GET', 'http', netloc, '/a.png') as res:
+                res.read()
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                # the child doesn't get the parent's idle connection, it makes its own
+                try:
+                    idle = pool.idle_count('http', netloc)
+                    with pool.request('GET', 'http', netloc, '/b.png') as res:
+                        res.read()
+                    os.write(write_fd, bytes([idle, pool.idle_count('http', netloc)]))
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            os.waitpid(pid, 0)
+            with os.fdopen(read_fd, 'rb') as file_obj:
+                self.assertEqual(bytes([0, 1]), file_obj.read())
+            # the parent's connection is still usable
+            self.assertEqual(1, pool.idle_count('http', netloc))
+            with pool.request('GET', 'http', netloc, '/a.png') as res:
+                self.assertEqual(64 * 1024, len(res.read()))
+            self.assertEqual(2, asset_server.connections)
+        pool.close()
+
+
+class TestResumableDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={'.tif': 1024 * 1024}).start()
+        cls.asset = utils.get_asset(SyntheticCorpus(size=1, asset_host=cls.asset_server.url)[0],
+                                    asset_type=AssetType.GEOTIFF)
+        cls.path = urlparse(cls.asset.href).path
+        cls.content = cls.asset_server.content(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.save_filename = os.path.join(self.directory.name, 'asset.tif')
+
+    def tearDown(self):
+        self.asset_server.interrupt.clear()
+        self.directory.cleanup()
+
+    def test_resume(self):
+        self.asset_server.interrupt[self.path] = 300 * 1024
+        bytes_before = self.asset_server.bytes_sent
+        checksum = hashlib.md5()
+        filename = utils.download_asset(self.asset, save_filename=self.save_filename, resumable=True,
+                                        checksum=checksum)
+        self.assertEqual(self.save_filename, filename)
+        with open(filename, 'rb') as file_obj:
+            self.assertEqual(self.content, file_obj.read())
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+        self.assertFalse(os.path.exists(filename + '.part'))
+        # the second request only fetched what the first didn't
+        self.assertEqual(len(self.content), self.asset_server.bytes_sent - bytes_before)
+
+    def test_existing_part(self):
+        with open(self.save_filename + '.part', 'wb') as file_obj:
+            file_obj.write(self.content[:1000])
+        bytes_before = self.asset_server.bytes_sent
+        utils.download_href_object(self.asset, save_filename=self.save_filename, resumable=True)
+        self.assertEqual(len(self.content) - 1000, self.asset_server.bytes_sent - bytes_before)
+        with open(self.save_filename, 'rb') as file_obj:
+            self.assertEqual(self.content, file_obj.read())
+
+        # a complete part file is renamed without downloading anything more
+        with open(self.save_filename + '.part', 'wb') as file_obj:
+            file_obj.write(self.content)
+        os.remove(self.save_filename)
+        utils.download_href_object(self.asset, save_filename=self.save_filename, resumable=True)
+        self.assertTrue(os.path.exists(self.save_filename))
+
+    def test_range_ignored(self):
+        self.asset_server.accept_ranges = False
+        try:
+            with open(self.save_filename + '.part', 'wb') as file_obj:
+                file_obj.write(b'stale bytes')
+            checksum = hashlib.md5()
+            utils.download_href_object(self.asset, save_filename=self.save_filename, resumable=True,
+                                       checksum=checksum)
+            with open(self.save_filename, 'rb') as file_obj:
+                self.assertEqual(self.content, file_obj.read())
+            # the part file the download started over from isn't in the checksum
+            self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+
+            # nor are the bytes written before a retry started over
+            os.remove(self.save_filename)
+            self.asset_server.interrupt[self.path] = 300 * 1024
+            checksum = hashlib.md5()
+            utils.download_href_object(self.asset, save_filename=self.save_filename, resumable=True,
+                                       checksum=checksum)
+            self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+        finally:
+            self.asset_server.accept_ranges = True
+
+    def test_existing_part_checksum(self):
+        with open(self.save_filename + '.part', 'wb') as file_obj:
+            file_obj.write(self.content[:1000])
+        checksum = hashlib.md5()
+        utils.download_href_object(self.asset, save_filename=self.save_filename, resumable=True, checksum=checksum)
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+
+        # a complete part file is in the checksum too
+        with open(self.save_filename + '.part', 'wb') as file_obj:
+            file_obj.write(self.content)
+        checksum = hashlib.md5()
+        utils.download_href_object(self.asset, save_filename=self.save_filename, resumable=True, checksum=checksum)
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+
+    def test_changed_during_restart(self):
+        part_file = utils._PartFile(self.save_filename, checksum=hashlib.md5())
+        try:
+            part_file.write(b'first version')
+            part_file.restart()
+            with self.assertRaises(utils.ChecksumError):
+                part_file.write(b'second version')
+        finally:
+            part_file.close()
+
+
+class TestSegmentedDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={'.tif': 4 * 1024 * 1024 + 123}).start()
+        cls.asset = utils.get_asset(SyntheticCorpus(size=1, asset_host=cls.asset_server.url)[0],
+                                    asset_type=AssetType.GEOTIFF)
+        cls.content = cls.asset_server.content(urlparse(cls.asset.href).path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_segments(self):
+        requests_before = self.asset_server.requests
+        filename = download_segmented(self.asset, save_directory=self.directory.name,
+                                      segment_size=512 * 1024, max_workers=4)
+        with open(filename, 'rb') as file_obj:
+            self.assertEqual(self.content, file_obj.read())
+        self.assertFalse(os.path.exists(filename + '.part'))
+        # the size probe, then 9 ranges
+        self.assertEqual(10, self.asset_server.requests - requests_before)
+
+    def test_failed_segment(self):
+        self.asset_server.interrupt[urlparse(self.asset.href).path] = 1000
+        requests_before = self.asset_server.requests
+        filename = download_segmented(self.asset, save_filename=os.path.join(self.directory.name, 'asset.tif'),
+                                      segment_size=1024 * 1024, max_workers=2)
+        with open(filename, 'rb') as file_obj:
+            self.assertEqual(self.content, file_obj.read())
+        # the size probe, 5 ranges and a retry of the range that was cut off
+        self.assertEqual(7, self.asset_server.requests - requests_before)
+
+    def test_no_ranges(self):
+        self.asset_server.accept_ranges = False
+        try:
+            requests_before = self.asset_server.requests
+            filename = download_segmented(self.asset, save_directory=self.directory.name, segment_size=512 * 1024)
+            with open(filename, 'rb') as file_obj:
+                self.assertEqual(self.content, file_obj.read())
+            self.assertEqual(1, self.asset_server.requests - requests_before)
+        finally:
+            self.asset_server.accept_ranges = True
+
+    def test_empty(self):
+        path = urlparse(self.asset.href).path
+        self.asset_server.files[path] = b''
+        try:
+            filename = download_segmented(self.asset, save_directory=self.directory.name)
+        finally:
+            del self.asset_server.files[path]
+        self.assertEqual(0, os.path.getsize(filename))
+
+    def test_verify(self):
+        path = urlparse(self.asset.href).path
+        # the size probe, then the first range
+        self.asset_server.corrupt[path] = 2
+        try:
+            with self.assertRaises(utils.ChecksumError):
+                download_segmented(self.asset, save_directory=self.directory.name, segment_size=1024 * 1024,
+                                   max_workers=1)
+        finally:
+            self.asset_server.corrupt.clear()
+        self.assertEqual([], os.listdir(self.directory.name))
+
+    def test_missing_blob(self):
+        asset = Asset(cloud_platform=CloudPlatform.GCP, bucket='bucket', object_path='missing.tif')
+        with mock.patch.object(utils, 'get_blob_metadata', return_value=None), self.assertRaises(ValueError):
+            download_segmented(asset, save_directory=self.directory.name, from_bucket=True)
+
+
+class TestSkipUnchanged(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=64 * 1024).start()
+        cls.corpus = SyntheticCorpus(size=2, asset_host=cls.asset_server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.asset = utils.get_asset(self.corpus[0], asset_type=AssetType.GEOTIFF)
+        self.content = self.asset_server.content(urlparse(self.asset.href).path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_skip(self):
+        filename = utils.download_asset(self.asset, save_directory=self.directory.name, skip_unchanged=True)
+        bytes_before = self.asset_server.bytes_sent
+        requests_before = self.asset_server.requests
+        checksum = hashlib.md5()
+        self.assertEqual(filename, utils.download_asset(self.asset, save_directory=self.directory.name,
+                                                        skip_unchanged=True, checksum=checksum))
+        # one HEAD request and no body
+        self.assertEqual(1, self.asset_server.requests - requests_before)
+        self.assertEqual(bytes_before, self.asset_server.bytes_sent)
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+
+    def test_changed(self):
+        filename = os.path.join(self.directory.name, 'asset.tif')
+        for local in (self.content[:-1] + b'\0', self.content[:100]):
+            with open(filename, 'wb') as file_obj:
+                file_obj.write(local)
+            bytes_before = self.asset_server.bytes_sent
+            utils.download_asset(self.asset, save_filename=filename, skip_unchanged=True)
+            self.assertEqual(len(self.content), self.asset_server.bytes_sent - bytes_before)
+            with open(filename, 'rb') as file_obj:
+                self.assertEqual(self.content, file_obj.read())
+
+    def test_file_matches(self):
+        import google_crc32c
+
+        filename = os.path.join(self.directory.name, 'asset.tif')
+        with open(filename, 'wb') as file_obj:
+            file_obj.write(self.content)
+        crc32c = google_crc32c.Checksum(self.content).digest().hex()
+        self.assertTrue(utils.file_matches(filename, size=len(self.content), crc32c=crc32c))
+        self.assertFalse(utils.file_matches(filename, size=len(self.content), crc32c='00000000'))
+        # the size alone isn't enough
+        self.assertFalse(utils.file_matches(filename, size=len(self.content)))
+        self.assertFalse(utils.file_matches(filename))
+        self.assertFalse(utils.file_matches(filename + '.missing', size=len(self.content)))
+
+
+class TestDownloadInto(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=200 * 1024).start()
+        cls.asset = utils.get_asset(SyntheticCorpus(size=1, asset_host=cls.asset_server.url)[0],
+                                    asset_type=AssetType.GEOTIFF)
+        cls.content = cls.asset_server.content(urlparse(cls.asset.href).path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def test_bytearray(self):
+        buffer = bytearray(len(self.content) + 10)
+        checksum = hashlib.md5()
+        progress = []
+        size = utils.download_asset_into(self.asset, buffer, checksum=checksum,
+                                         progress=lambda written, total: progress.append(written), cache=False)
+        self.assertEqual(len(self.content), size)
+        self.assertEqual(self.content, buffer[:size])
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+        self.assertEqual(len(self.content), progress[-1])
+
+        with self.assertRaises(ValueError):
+            utils.download_asset_into(self.asset, bytearray(len(self.content) - 1), cache=False)
+        with self.assertRaises(ValueError):
+            utils.download_asset_into(self.asset, bytes(len(self.content)), cache=False)
+
+    def test_mmap(self):
+        with tempfile.TemporaryFile() as file_obj:
+            file_obj.truncate(len(self.content))
+            with mmap.mmap(file_obj.fileno(), len(self.content)) as mapped:
+                # a region of the mapping, through a memoryview
+                self.assertEqual(len(self.content), utils.download_asset_into(self.asset, memoryview(mapped),
+                                                                              cache=False))
+                self.assertEqual(self.content, mapped[:])
+
+    def test_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = AssetCache(directory)
+            buffer = bytearray(len(self.content))
+            self.assertEqual(len(self.content), utils.download_asset_into(self.asset, buffer, cache=cache))
+            bytes_before = self.asset_server.bytes_sent
+            buffer = bytearray(len(self.content))
+            self.assertEqual(len(self.content), utils.download_asset_into(self.asset, buffer, cache=cache))
+            self.assertEqual(self.content, buffer)
+            # only the version of the asset is looked up
+            self.assertEqual(bytes_before, self.asset_server.bytes_sent)
+
+    def test_buffer_writer(self):
+        buffer = bytearray(8)
+        writer = utils._BufferWriter(memoryview(buffer))
+        # out of order parts, as written by a multipart download
+        writer.seek(4)
+        writer.write(b'5678')
+        writer.seek(0)
+        writer.write(b'1234')
+        self.assertEqual(8, writer.written)
+        self.assertEqual(b'12345678', buffer)
+        writer.seek(0, io.SEEK_END)
+        with self.assertRaises(ValueError):
+            writer.write(b'9')
+
+
+class TestVerify(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_fake_credentials()
+        cls.asset_server = FakeAssetServer(sizes={}, default_size=64 * 1024).start()
+        cls.asset = utils.get_asset(SyntheticCorpus(size=1, asset_host=cls.asset_server.url)[0],
+                                    asset_type=AssetType.GEOTIFF)
+        cls.path = urlparse(cls.asset.href).path
+        cls.content = cls.asset_server.content(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.asset_server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.asset_server.corrupt.clear()
+        self.directory.cleanup()
+
+    def test_retry(self):
+        for resumable in (False, True):
+            self.asset_server.corrupt[self.path] = 1
+            requests_before = self.asset_server.requests
+            filename = utils.download_asset(self.asset, save_directory=self.directory.name, resumable=resumable,
+                                            cache=False)
+            with open(filename, 'rb') as file_obj:
+                self.assertEqual(self.content, file_obj.read())
+            # the corrupt download and the one that replaced it
+            self.assertEqual(2, self.asset_server.requests - requests_before)
+            os.remove(filename)
+
+    def test_mismatch(self):
+        self.asset_server.corrupt[self.path] = utils.VERIFY_ATTEMPTS
+        with self.assertRaises(utils.ChecksumError):
+            utils.download_asset(self.asset, save_directory=self.directory.name, cache=False)
+        self.assertEqual([], os.listdir(self.directory.name))
+
+        self.asset_server.corrupt[self.path] = 1
+        with self.assertRaises(utils.ChecksumError):
+            utils.download_asset(self.asset, file_obj=io.BytesIO(), cache=False)
+        self.asset_server.corrupt[self.path] = 1
+        with self.assertRaises(utils.ChecksumError):
+            utils.download_asset_into(self.asset, bytearray(len(self.content)), cache=False)
+
+        self.asset_server.corrupt[self.path] = 1
+        file_obj = io.BytesIO()
+        utils.download_asset(self.asset, file_obj=file_obj, verify=False, cache=False)
+        self.assertNotEqual(self.content, file_obj.getvalue())
+
+    def test_resumable_checksum(self):
+        # the checksum of a resumed download covers the part file left before, without reading the file again
+        self.asset_server.interrupt[self.path] = 1000
+        checksum = hashlib.md5()
+        filename = utils.download_asset(self.asset, save_directory=self.directory.name, resumable=True,
+                                        checksum=checksum)
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+        self.assertEqual(len(self.content), os.path.getsize(filename))
+
+        # nor is a download that completes at once read again
+        os.remove(filename)
+        checksum = hashlib.md5()
+        with mock.patch.object(utils, '_file_digest', side_effect=AssertionError("file read again")):
+            utils.download_asset(self.asset, save_directory=self.directory.name, resumable=True, checksum=checksum)
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), checksum.hexdigest())
+
+    def test_content_range_start(self):
+        self.assertEqual(100, utils._content_range_start('bytes 100-199/1234'))
+        self.assertIsNone(utils._content_range_start('bytes */1234'))
+        self.assertIsNone(utils._content_range_start(None))
+
+    def test_response_checksums(self):
+        class Response:
+            status = 200
+            headers = {'x-goog-hash': 'crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ==', 'etag': '"abc"'}
+
+            def getheader(self, name):
+                return self.headers.get(name)
+
+        self.assertEqual(('3a393d7377617f182829554763015b1d', '9f4df1e8'), utils._response_checksums(Response()))
+        Response.headers = {'etag': '"3A393D7377617F182829554763015B1D"'}
+        self.assertEqual(('3a393d7377617f182829554763015b1d', None), utils._response_checksums(Response()))